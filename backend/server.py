@@ -1,8 +1,10 @@
-from fastapi import FastAPI, APIRouter, HTTPException, Depends, status, WebSocket, WebSocketDisconnect
+from fastapi import FastAPI, APIRouter, BackgroundTasks, HTTPException, Depends, Header, Request, Response, status, WebSocket, WebSocketDisconnect
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
@@ -14,6 +16,20 @@ from passlib.context import CryptContext
 import jwt
 from enum import IntEnum, Enum
 import json
+import asyncio
+from src.core import queue_events
+from src.core.event_bus import event_bus, MongoChangeStreamBackend
+from src.core.password_hasher import PasswordHasherBusy, password_hasher
+from src.core.principal_cache import principal_cache, token_id, user_changed
+from src.core.token_claims import principal_claims, token_claims
+from src.core.rate_limiter import MongoBucketBackend, RateLimited, parse_networks, rate_limiter, request_client_ip, retry_after_header
+from src.core.priority_aging import priority_aging, DEFAULT_AGING_CEILING, DEFAULT_AGING_THRESHOLDS
+from src.core.queue_engine import queue_engine
+from src.core.queue_snapshot import queue_snapshot
+from src.core.token_sequencer import token_sequencer, DEFAULT_BLOCK_SIZE
+from src.core.wait_estimator import wait_estimator
+from src.queue_stream import queue_stream
+from src.websocket_manager import manager
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -23,16 +39,81 @@ mongo_url = os.environ.get('MONGO_URL', 'mongodb://localhost:27017')
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ.get('DB_NAME', 'hospital_management')]
 
+# Daily token-number counters, reserved in blocks per worker
+token_sequencer.configure(
+    db.token_counters,
+    block_size=int(os.environ.get('TOKEN_SEQUENCE_BLOCK_SIZE', DEFAULT_BLOCK_SIZE))
+)
+
 # Security
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 security = HTTPBearer()
+optional_security = HTTPBearer(auto_error=False)
 SECRET_KEY = os.environ.get("JWT_SECRET_KEY", "hospital-token-management-secret-key-2025")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_HOURS = 24
 
+# Role-gated routes trust a token's signed role for this long after issue; older tokens
+# (and users changed since the token was issued) go through the cached user lookup
+token_claims.configure(max_age_seconds=float(os.environ.get('TOKEN_CLAIMS_MAX_AGE_SECONDS', 900)))
+
+# bcrypt runs on this many threads; logins beyond the pending cap get 503 instead of queueing
+# bcrypt cost: PASSWORD_HASH_ROUNDS, or the cost closest to PASSWORD_HASH_TARGET_MS on this host
+# (see `python -m src.scripts.calibrate_bcrypt`); stored hashes are moved to it on login
+password_hasher.configure(
+    workers=int(os.environ.get('PASSWORD_HASH_WORKERS', min(4, os.cpu_count() or 1))),
+    max_pending=int(os.environ.get('PASSWORD_HASH_MAX_PENDING', 64)),
+    rounds=int(os.environ.get('PASSWORD_HASH_ROUNDS', 0)),
+    target_ms=float(os.environ.get('PASSWORD_HASH_TARGET_MS', 0))
+)
+pwd_context.update(bcrypt__default_rounds=password_hasher.rounds)
+
+# Authenticated users are cached per token for this long instead of loaded on every request
+principal_cache.configure(
+    max_entries=int(os.environ.get('PRINCIPAL_CACHE_SIZE', 10000)),
+    ttl_seconds=float(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', 60))
+)
+
+# Password attempts (login, register, create-staff) per client IP and per email, as token
+# buckets: a burst, then a steady refill. RATE_LIMIT_BACKEND=mongo shares them across replicas
+RATE_LIMIT_BACKEND = os.environ.get('RATE_LIMIT_BACKEND', 'memory')
+# Proxies (addresses or CIDRs) whose X-Forwarded-For is believed, e.g. the ingress pods' range.
+# Without them the IP bucket is off unless RATE_LIMIT_IP_BURST is set, since behind a proxy
+# every client would share the proxy's bucket
+TRUSTED_PROXIES = os.environ.get('TRUSTED_PROXIES', '')
+rate_limiter.configure(
+    backend=MongoBucketBackend(db.rate_limits) if RATE_LIMIT_BACKEND == 'mongo' else None,
+    trusted_proxies=parse_networks(TRUSTED_PROXIES),
+    ip_burst=float(os.environ.get('RATE_LIMIT_IP_BURST', 20 if TRUSTED_PROXIES else 0)),
+    ip_per_minute=float(os.environ.get('RATE_LIMIT_IP_PER_MINUTE', 10)),
+    email_burst=float(os.environ.get('RATE_LIMIT_EMAIL_BURST', 5)),
+    email_per_minute=float(os.environ.get('RATE_LIMIT_EMAIL_PER_MINUTE', 2))
+)
+
+# Upper bound on tokens accepted by one bulk intake request
+MAX_BULK_TOKENS = int(os.environ.get('MAX_BULK_TOKENS', 200))
+
+# Queue/token events reach other workers through Mongo change streams when
+# EVENT_BUS_BACKEND=mongo (requires a replica set); "memory" supports one worker in one replica
+EVENT_BUS_BACKEND = os.environ.get('EVENT_BUS_BACKEND', 'memory')
+if EVENT_BUS_BACKEND == 'mongo':
+    event_bus.configure(MongoChangeStreamBackend(
+        db.queue_events,
+        ttl_seconds=int(os.environ.get('EVENT_BUS_TTL_SECONDS', 3600))
+    ))
+
 # Create the main app
 app = FastAPI(title="Hospital Token Management System", version="1.0.0")
 
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy(request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"}, headers={"Retry-After": "1"})
+
+@app.exception_handler(RateLimited)
+async def rate_limited(request, exc: RateLimited):
+    return JSONResponse(status_code=429, content={"detail": "Too many attempts, please retry later"},
+                        headers={"Retry-After": retry_after_header(exc)})
+
 # Configure CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -72,76 +153,6 @@ async def health_check():
 # Create a router without extra prefix (mounted at /api/v1 below)
 api_router = APIRouter()
 
-# WebSocket Connection Manager
-class ConnectionManager:
-    def __init__(self):
-        self.active_connections: Dict[str, List[WebSocket]] = {
-            'patient': [],
-            'staff': [],
-            'admin': []
-        }
-        self.user_connections: Dict[str, WebSocket] = {}
-
-    async def connect(self, websocket: WebSocket, user_id: str, user_role: str):
-        await websocket.accept()
-        self.user_connections[user_id] = websocket
-        self.active_connections[user_role].append(websocket)
-        logging.info(f"User {user_id} ({user_role}) connected. Total connections: {len(self.user_connections)}")
-
-    def disconnect(self, websocket: WebSocket, user_id: str, user_role: str):
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
-        if websocket in self.active_connections[user_role]:
-            self.active_connections[user_role].remove(websocket)
-        logging.info(f"User {user_id} ({user_role}) disconnected. Total connections: {len(self.user_connections)}")
-
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.user_connections:
-            try:
-                await self.user_connections[user_id].send_text(message)
-            except Exception as e:
-                logging.error(f"Error sending message to user {user_id}: {e}")
-
-    async def broadcast_to_role(self, message: str, role: str):
-        if role in self.active_connections:
-            disconnected = []
-            for connection in self.active_connections[role]:
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    logging.error(f"Error broadcasting to {role}: {e}")
-                    disconnected.append(connection)
-            
-            # Remove disconnected connections
-            for connection in disconnected:
-                if connection in self.active_connections[role]:
-                    self.active_connections[role].remove(connection)
-
-    async def send_queue_update(self, queue_data: List[Dict[str, Any]]):
-        """Send queue update to all staff and admin users"""
-        message = json.dumps({
-            "type": "queue_update",
-            "data": queue_data
-        })
-        await self.broadcast_to_role(message, "staff")
-        await self.broadcast_to_role(message, "admin")
-
-    async def send_token_update(self, token_data: Dict[str, Any], user_id: str = None):
-        """Send token update to specific user or all relevant users"""
-        message = json.dumps({
-            "type": "token_update",
-            "data": token_data
-        })
-        
-        if user_id:
-            await self.send_personal_message(message, user_id)
-        
-        await self.broadcast_to_role(message, "staff")
-        await self.broadcast_to_role(message, "admin")
-
-# Global connection manager
-manager = ConnectionManager()
-
 # Enums
 class UserRole(str, Enum):
     PATIENT = "patient"
@@ -158,6 +169,7 @@ class TokenPriority(IntEnum):
 
 class TokenStatus(str, Enum):
     ACTIVE = "active"
+    IN_SERVICE = "in_service"
     COMPLETED = "completed"
     CANCELLED = "cancelled"
 
@@ -193,9 +205,12 @@ class Token(BaseModel):
     category: str
     status: TokenStatus = TokenStatus.ACTIVE
     symptoms: Optional[str] = None
-    position: int
-    estimated_wait_time: int  # in minutes
+    # Derived from the queue engine on read; never persisted
+    position: int = 0
+    estimated_wait_time: int = 0  # in minutes
     created_by: str
+    counter: Optional[str] = None
+    called_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -211,48 +226,72 @@ class QueuePosition(BaseModel):
     token_number: str
     patient_name: str
     priority_level: int
+    effective_priority: Optional[int] = None
+    category: Optional[str] = None
     position: int
     estimated_wait_time: int
     status: str
     created_at: datetime
 
 # Utility Functions
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
+# bcrypt runs on the password pool so a login never blocks the event loop
+async def hash_password(password: str) -> str:
+    return await password_hasher.run(pwd_context.hash, password)
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
     # Some existing users may have empty/invalid hashes; guard to avoid 500
     if not hashed_password or not isinstance(hashed_password, str):
         return False
     try:
-        return pwd_context.verify(plain_password, hashed_password)
+        return await password_hasher.run(pwd_context.verify, plain_password, hashed_password)
+    except PasswordHasherBusy:
+        raise
     except Exception:
         # UnknownHashError or backend issues should not 500 the request
         return False
 
+async def rehash_password(user_id: str, old_hash: str, password: str):
+    """Store the password again at the configured cost; runs after the login response"""
+    try:
+        new_hash = await hash_password(password)
+    except PasswordHasherBusy:
+        return  # the next login tries again
+    # Conditional on the old hash, so a password changed meanwhile is never overwritten
+    result = await db.users.update_one({"id": user_id, "password_hash": old_hash}, {"$set": {"password_hash": new_hash}})
+    if result.modified_count:
+        password_hasher.stats["rehashed"] += 1
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
         expire = datetime.now(timezone.utc) + expires_delta
     else:
         expire = datetime.now(timezone.utc) + timedelta(hours=ACCESS_TOKEN_EXPIRE_HOURS)
-    to_encode.update({"exp": expire})
+    # jti keys the principal cache, so each issued token has its own entry; iat bounds claim trust
+    to_encode.update({"exp": expire, "iat": datetime.now(timezone.utc), "jti": uuid.uuid4().hex})
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def generate_token_number(priority: TokenPriority) -> str:
-    priority_prefix = {
-        TokenPriority.CRITICAL: "E",
-        TokenPriority.HIGH: "H", 
-        TokenPriority.MEDIUM_HIGH: "MH",
-        TokenPriority.MEDIUM_LOW: "ML",
-        TokenPriority.REPORT_PICKUP: "R",
-        TokenPriority.CONSULTATION: "C"
-    }
-    
-    date_str = datetime.now().strftime("%d%m%y")
-    sequence = str(uuid.uuid4().int)[:3].zfill(3)
-    return f"{priority_prefix[priority]}-{sequence}-{date_str}"
+TOKEN_NUMBER_PREFIX = {
+    TokenPriority.CRITICAL: "E",
+    TokenPriority.HIGH: "H", 
+    TokenPriority.MEDIUM_HIGH: "MH",
+    TokenPriority.MEDIUM_LOW: "ML",
+    TokenPriority.REPORT_PICKUP: "R",
+    TokenPriority.CONSULTATION: "C"
+}
+
+async def generate_token_number(priority: TokenPriority) -> str:
+    return await token_sequencer.next_token_number(TOKEN_NUMBER_PREFIX[priority])
+
+async def generate_token_numbers(priorities: List[TokenPriority]) -> List[str]:
+    """Token numbers for a batch, reserving one block per prefix"""
+    numbers: Dict[TokenPriority, List[str]] = {}
+    for priority in set(priorities):
+        numbers[priority] = await token_sequencer.next_token_numbers(
+            TOKEN_NUMBER_PREFIX[priority], priorities.count(priority)
+        )
+    return [numbers[priority].pop(0) for priority in priorities]
 
 def assign_priority_by_category(category: str) -> TokenPriority:
     category_priority_map = {
@@ -265,57 +304,210 @@ def assign_priority_by_category(category: str) -> TokenPriority:
     }
     return category_priority_map.get(category, TokenPriority.MEDIUM_LOW)
 
+# Static per-patient service times; priors for the adaptive estimator
+BASE_TIME_PER_PATIENT = {
+    TokenPriority.CRITICAL: 0,     # Immediate
+    TokenPriority.HIGH: 5,         # 5 min avg
+    TokenPriority.MEDIUM_HIGH: 15, # 15 min avg
+    TokenPriority.MEDIUM_LOW: 20,  # 20 min avg
+    TokenPriority.REPORT_PICKUP: 5, # 5 min avg
+    TokenPriority.CONSULTATION: 10  # 10 min avg
+}
+
 def calculate_wait_time(position: int, priority: TokenPriority) -> int:
-    base_time_per_patient = {
-        TokenPriority.CRITICAL: 0,     # Immediate
-        TokenPriority.HIGH: 5,         # 5 min avg
-        TokenPriority.MEDIUM_HIGH: 15, # 15 min avg
-        TokenPriority.MEDIUM_LOW: 20,  # 20 min avg
-        TokenPriority.REPORT_PICKUP: 5, # 5 min avg
-        TokenPriority.CONSULTATION: 10  # 10 min avg
+    return position * BASE_TIME_PER_PATIENT[priority]
+
+# Learns from observed call-to-complete durations; falls back to the table above
+wait_estimator.configure(
+    priors=BASE_TIME_PER_PATIENT,
+    counters=int(os.environ.get('SERVICE_COUNTERS', 1))
+)
+
+# Long-waiting tokens move up one class per threshold (JSON of category -> minutes)
+aging_thresholds = os.environ.get('PRIORITY_AGING_THRESHOLDS')
+priority_aging.configure(
+    thresholds=json.loads(aging_thresholds) if aging_thresholds else DEFAULT_AGING_THRESHOLDS,
+    ceiling=int(os.environ.get('PRIORITY_AGING_CEILING', DEFAULT_AGING_CEILING))
+)
+PRIORITY_AGING_INTERVAL = float(os.environ.get('PRIORITY_AGING_INTERVAL', 30))
+
+# Queue heads tried by /queue/next before the engine is reloaded from Mongo and the claim retried
+CALL_NEXT_CANDIDATES = 5
+
+# Queue mutations within this window go out as one staff/admin broadcast
+BROADCAST_COALESCE_MS = int(os.environ.get('BROADCAST_COALESCE_MS', 100))
+
+# Per-socket outbound buffer; slow consumers are downgraded, then evicted
+WS_SEND_QUEUE_SIZE = int(os.environ.get('WS_SEND_QUEUE_SIZE', 64))
+WS_SEND_TIMEOUT_SECONDS = float(os.environ.get('WS_SEND_TIMEOUT_SECONDS', 5))
+
+# Patient position pushes: only on moves of this many places or minutes, every move near the head
+POSITION_PUSH_STEP = int(os.environ.get('POSITION_PUSH_STEP', 3))
+POSITION_PUSH_ETA_MINUTES = int(os.environ.get('POSITION_PUSH_ETA_MINUTES', 5))
+POSITION_PUSH_NEAR_HEAD = int(os.environ.get('POSITION_PUSH_NEAR_HEAD', 5))
+
+# Server pings each socket on this interval; sockets silent for the idle timeout are closed
+WS_HEARTBEAT_SECONDS = float(os.environ.get('WS_HEARTBEAT_SECONDS', 25))
+WS_IDLE_TIMEOUT_SECONDS = float(os.environ.get('WS_IDLE_TIMEOUT_SECONDS', 60))
+
+# Connection limits (0 = unlimited); per-role limits as JSON, e.g. {"patient": 5000}
+WS_MAX_CONNECTIONS = int(os.environ.get('WS_MAX_CONNECTIONS', 10000))
+WS_MAX_CONNECTIONS_PER_USER = int(os.environ.get('WS_MAX_CONNECTIONS_PER_USER', 5))
+# Per client IP as resolved behind TRUSTED_PROXIES; off by default without them, since behind
+# the ingress every socket would share the ingress pod's address
+WS_MAX_CONNECTIONS_PER_IP = int(os.environ.get('WS_MAX_CONNECTIONS_PER_IP', 50 if TRUSTED_PROXIES else 0))
+ws_role_limits = os.environ.get('WS_MAX_CONNECTIONS_PER_ROLE')
+WS_MAX_CONNECTIONS_PER_ROLE = json.loads(ws_role_limits) if ws_role_limits else {}
+
+# Fields computed on read from the in-memory queue instead of being stored
+DERIVED_TOKEN_FIELDS = {"position", "estimated_wait_time"}
+
+def apply_queue_position(token: Dict[str, Any]) -> Dict[str, Any]:
+    """Fill in position and estimated wait time from the queue engine (0 when not queued)"""
+    position = queue_engine.position(token["id"]) or 0
+    token["position"] = position
+    token["estimated_wait_time"] = wait_estimator.queue_estimates(queue_engine).get(token["id"], 0) if position else 0
+    return token
+
+def duplicate_key_detail(error: Dict[str, Any]) -> str:
+    """Client-facing reason for a duplicate-key write error, by the index it hit"""
+    key_pattern = error.get("keyPattern") or {}
+    if "patient_id" in key_pattern or "active_token_per_patient" in error.get("errmsg", ""):
+        return "Patient already has an active token"
+    # e.g. a token_number collision; the row was not stored and can be resubmitted
+    return f"Duplicate {', '.join(key_pattern) or 'key'}, please retry"
+
+def build_queue_data() -> List[Dict[str, Any]]:
+    """Active queue in order, with positions and wait times derived from the sort key"""
+    estimates = wait_estimator.queue_estimates(queue_engine)
+    queue_data = []
+    for position, entry in enumerate(queue_engine.entries(), start=1):
+        queue_data.append({
+            "token_id": entry["id"],
+            "token_number": entry["token_number"],
+            "patient_name": entry["patient_name"],
+            "priority_level": entry["priority_level"],
+            "effective_priority": entry["effective_priority"],
+            "category": entry.get("category"),
+            "position": position,
+            "estimated_wait_time": estimates[entry["id"]],
+            "status": entry["status"],
+            "created_at": entry["created_at"]
+        })
+    return queue_data
+
+def build_queue_snapshot() -> Dict[str, Any]:
+    queue_data = [QueuePosition(**entry) for entry in build_queue_data()]
+    return {
+        "queue": queue_data,
+        "total_count": len(queue_data)
     }
-    return position * base_time_per_patient[priority]
 
-async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+# GET /queue is served from one serialized body per queue version
+queue_snapshot.configure(build=build_queue_snapshot, stamp=lambda: wait_estimator.stamp(queue_engine))
+
+# WebSocket queue broadcasts rebuild from the engine once per coalescing window
+manager.configure(
+    queue_source=build_queue_data,
+    wait_model_source=lambda: wait_estimator.wait_model(queue_engine),
+    coalesce_window=BROADCAST_COALESCE_MS / 1000,
+    send_queue_size=WS_SEND_QUEUE_SIZE,
+    send_timeout=WS_SEND_TIMEOUT_SECONDS,
+    position_step=POSITION_PUSH_STEP,
+    eta_step=POSITION_PUSH_ETA_MINUTES,
+    near_head=POSITION_PUSH_NEAR_HEAD,
+    heartbeat_interval=WS_HEARTBEAT_SECONDS,
+    idle_timeout=WS_IDLE_TIMEOUT_SECONDS,
+    max_connections=WS_MAX_CONNECTIONS,
+    max_connections_per_user=WS_MAX_CONNECTIONS_PER_USER,
+    max_connections_per_ip=WS_MAX_CONNECTIONS_PER_IP,
+    max_connections_per_role=WS_MAX_CONNECTIONS_PER_ROLE
+)
+
+def decode_access_token(token: str) -> dict:
     try:
-        payload = jwt.decode(credentials.credentials, SECRET_KEY, algorithms=[ALGORITHM])
-        user_id: str = payload.get("sub")
-        if user_id is None:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+        if payload.get("sub") is None:
             raise HTTPException(status_code=401, detail="Invalid authentication credentials")
     except jwt.PyJWTError:
         raise HTTPException(status_code=401, detail="Invalid authentication credentials")
-    
-    user = await db.users.find_one({"id": user_id})
+    return payload
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    return await load_user(decode_access_token(credentials.credentials), credentials.credentials)
+
+async def load_user(payload: dict, token: str) -> User:
+    user_id = payload["sub"]
+    cache_key = token_id(payload, token)
+    user = principal_cache.get(user_id, cache_key)
     if user is None:
-        raise HTTPException(status_code=401, detail="User not found")
-    return User(**user)
+        user_doc = await db.users.find_one({"id": user_id})
+        if user_doc is None:
+            raise HTTPException(status_code=401, detail="User not found")
+        user = User(**user_doc)
+        principal_cache.put(user_id, cache_key, user, payload.get("exp"))
+    if not user.is_active:
+        raise HTTPException(status_code=401, detail="Account is deactivated")
+    return user
+
+async def get_stream_user(
+    credentials: Optional[HTTPAuthorizationCredentials] = Depends(optional_security),
+    access_token: Optional[str] = None
+):
+    """Browsers' EventSource cannot set headers, so display boards may pass the JWT as ?access_token="""
+    token = credentials.credentials if credentials else access_token
+    if not token:
+        raise HTTPException(status_code=401, detail="Not authenticated")
+    return await get_current_user(HTTPAuthorizationCredentials(scheme="Bearer", credentials=token))
+
+async def get_current_principal(credentials: HTTPAuthorizationCredentials = Depends(security)):
+    """The user as signed in a fresh token, for routes that only check role and id; no database call"""
+    return await principal_from_token(credentials.credentials)
 
-async def get_current_staff(current_user: User = Depends(get_current_user)):
+async def principal_from_token(token: str) -> User:
+    payload = decode_access_token(token)
+    claims = token_claims.principal(payload)
+    if claims is None:
+        return await load_user(payload, token)
+    claims["role"] = UserRole(claims["role"])
+    return User.model_construct(**claims)
+
+async def get_websocket_principal(access_token: Optional[str]) -> Optional[User]:
+    """The handshake's user, or None for a missing, invalid or deactivated token"""
+    if not access_token:
+        return None
+    try:
+        return await principal_from_token(access_token)
+    except HTTPException:
+        return None
+
+async def get_current_staff(current_user: User = Depends(get_current_principal)):
     if current_user.role not in [UserRole.STAFF, UserRole.ADMIN]:
         raise HTTPException(status_code=403, detail="Staff access required")
     return current_user
 
-async def get_current_admin(current_user: User = Depends(get_current_user)):
+async def get_current_admin(current_user: User = Depends(get_current_principal)):
     if current_user.role != UserRole.ADMIN:
         raise HTTPException(status_code=403, detail="Admin access required")
     return current_user
 
 # Authentication Routes
 @api_router.post("/auth/register")
-async def register_user(user_data: UserCreate):
+async def register_user(user_data: UserCreate, request: Request):
+    await rate_limiter.check(request_client_ip(request), user_data.email)
     existing_user = await db.users.find_one({"email": user_data.email})
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     user_dict = user_data.dict()
     user_dict.pop("password")
-    user_dict["password_hash"] = hashed_password
     
     user = User(**user_dict)
-    await db.users.insert_one(user.dict())
+    # User has no password field, so the hash is added to the stored document explicitly
+    await db.users.insert_one({**user.dict(), "password_hash": hashed_password})
     
-    access_token = create_access_token(data={"sub": user.id})
+    access_token = create_access_token(data={"sub": user.id, **principal_claims(user.dict())})
     
     return {
         "access_token": access_token,
@@ -341,15 +533,19 @@ async def get_current_user_info(current_user: User = Depends(get_current_user)):
     }
 
 @api_router.post("/auth/login")
-async def login_user(user_data: UserLogin):
+async def login_user(user_data: UserLogin, request: Request, background_tasks: BackgroundTasks):
+    await rate_limiter.check(request_client_ip(request), user_data.email)
     user = await db.users.find_one({"email": user_data.email})
-    if not user or not verify_password(user_data.password, user.get("password_hash", "")):
+    if not user or not await verify_password(user_data.password, user.get("password_hash", "")):
         raise HTTPException(status_code=401, detail="Invalid email or password")
     
     if not user.get("is_active", True):
         raise HTTPException(status_code=400, detail="Account is deactivated")
     
-    access_token = create_access_token(data={"sub": user["id"]})
+    if password_hasher.needs_rehash(user["password_hash"]):
+        background_tasks.add_task(rehash_password, user["id"], user["password_hash"], user_data.password)
+    
+    access_token = create_access_token(data={"sub": user["id"], **principal_claims(user)})
     
     return {
         "access_token": access_token,
@@ -365,7 +561,7 @@ async def login_user(user_data: UserLogin):
 
 # Token Routes
 @api_router.post("/tokens", response_model=Token)
-async def create_token(token_data: TokenCreate, current_user: User = Depends(get_current_user)):
+async def create_token(token_data: TokenCreate, current_user: User = Depends(get_current_principal)):
     # Determine patient info
     if current_user.role == UserRole.PATIENT:
         patient_id = current_user.id
@@ -378,42 +574,11 @@ async def create_token(token_data: TokenCreate, current_user: User = Depends(get
         patient_name = token_data.patient_name
         patient_phone = token_data.patient_phone
     
-    # Check for existing active token for patient
-    existing_token = await db.tokens.find_one({
-        "patient_id": patient_id,
-        "status": TokenStatus.ACTIVE
-    })
-    
-    if existing_token:
-        raise HTTPException(status_code=400, detail="Patient already has an active token")
-    
     # Assign priority based on category
     priority = assign_priority_by_category(token_data.category)
     
     # Generate token number
-    token_number = generate_token_number(priority)
-    
-    # Calculate position in queue
-    existing_tokens = await db.tokens.find({"status": TokenStatus.ACTIVE}).to_list(1000)
-    position = 1
-    
-    # Find correct position based on priority (lower value = higher priority)
-    for existing_token in existing_tokens:
-        if priority >= existing_token["priority_level"]:
-            position += 1
-    
-    # Update positions of lower priority tokens
-    await db.tokens.update_many(
-        {
-            "status": TokenStatus.ACTIVE,
-            "priority_level": {"$gt": priority},
-            "position": {"$gte": position}
-        },
-        {"$inc": {"position": 1}}
-    )
-    
-    # Calculate estimated wait time
-    estimated_wait_time = calculate_wait_time(position, priority)
+    token_number = await generate_token_number(priority)
     
     # Create token
     token = Token(
@@ -424,36 +589,111 @@ async def create_token(token_data: TokenCreate, current_user: User = Depends(get
         priority_level=priority,
         category=token_data.category,
         symptoms=token_data.symptoms,
-        position=position,
-        estimated_wait_time=estimated_wait_time,
         created_by=current_user.id
     )
     
-    await db.tokens.insert_one(token.dict())
+    # Single-document write: queue positions are derived, never shifted in Mongo.
+    # The partial unique index on (patient_id, status=active) rejects a second
+    # active token atomically, even when two desks submit at the same time.
+    try:
+        await db.tokens.insert_one(token.dict(exclude=DERIVED_TOKEN_FIELDS))
+    except DuplicateKeyError as e:
+        detail = duplicate_key_detail(e.details or {})
+        if "patient_id" in (e.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=400, detail=detail)
+        # Any other unique index (e.g. token_number): nothing was stored, so the request can be retried
+        raise HTTPException(status_code=409, detail=detail)
     
-    # Send real-time update to all connected users
-    await manager.send_token_update(token.dict(), current_user.id)
+    # Rank the token on every worker; emergencies skip the broadcast coalescing window
+    await queue_events.tokens_queued([token.dict()], urgent=token.priority_level == TokenPriority.CRITICAL)
+    token.position = queue_engine.position(token.id) or 0
+    token.estimated_wait_time = wait_estimator.queue_estimates(queue_engine).get(token.id, 0)
     
-    # Send queue update to staff/admin
-    queue_tokens = await db.tokens.find({"status": TokenStatus.ACTIVE}).sort("position", 1).to_list(1000)
-    queue_data = []
-    for t in queue_tokens:
-        queue_data.append({
-            "token_id": t["id"],
-            "token_number": t["token_number"],
-            "patient_name": t["patient_name"],
-            "priority_level": t["priority_level"],
-            "position": t["position"],
-            "estimated_wait_time": t["estimated_wait_time"],
-            "status": t["status"],
-            "created_at": t["created_at"]
-        })
-    await manager.send_queue_update(queue_data)
+    # Send real-time update to all connected users
+    await queue_events.token_updated(token.dict(), current_user.id)
     
     return token
 
+@api_router.post("/tokens/bulk")
+async def create_tokens_bulk(tokens_data: List[TokenCreate], current_user: User = Depends(get_current_staff)):
+    """Register a batch of patients (mass-casualty intake, kiosk batches) in one pass"""
+    if not tokens_data:
+        raise HTTPException(status_code=400, detail="At least one token is required")
+    if len(tokens_data) > MAX_BULK_TOKENS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BULK_TOKENS} tokens per request")
+    
+    # Validate the whole batch before writing anything
+    seen_patients = set()
+    for index, token_data in enumerate(tokens_data):
+        if not token_data.patient_id or not token_data.patient_name or not token_data.patient_phone:
+            raise HTTPException(status_code=400, detail=f"Patient information required for token at index {index}")
+        if token_data.patient_id in seen_patients:
+            raise HTTPException(status_code=400, detail=f"Duplicate patient in batch at index {index}")
+        seen_patients.add(token_data.patient_id)
+    
+    active = await db.tokens.find(
+        {"patient_id": {"$in": list(seen_patients)}, "status": TokenStatus.ACTIVE},
+        {"patient_id": 1}
+    ).to_list(len(seen_patients))
+    if active:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": "Patients already have an active token",
+                "patient_ids": sorted(t["patient_id"] for t in active)
+            }
+        )
+    
+    # Priorities and token numbers in one pass
+    priorities = [assign_priority_by_category(t.category) for t in tokens_data]
+    token_numbers = await generate_token_numbers(priorities)
+    tokens = [
+        Token(
+            token_number=token_number,
+            patient_id=token_data.patient_id,
+            patient_name=token_data.patient_name,
+            patient_phone=token_data.patient_phone,
+            priority_level=priority,
+            category=token_data.category,
+            symptoms=token_data.symptoms,
+            created_by=current_user.id
+        )
+        for token_data, priority, token_number in zip(tokens_data, priorities, token_numbers)
+    ]
+    
+    # Unordered insert so a patient registered concurrently elsewhere only drops that row
+    rejected = []
+    try:
+        await db.tokens.insert_many(
+            [token.dict(exclude=DERIVED_TOKEN_FIELDS) for token in tokens],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in write_errors):
+            raise
+        failed = {error["index"]: duplicate_key_detail(error) for error in write_errors}
+        rejected = [
+            {"index": index, "patient_id": tokens[index].patient_id, "detail": failed[index]}
+            for index in sorted(failed)
+        ]
+        tokens = [token for index, token in enumerate(tokens) if index not in failed]
+    
+    # Rank everything in one event (one coalesced broadcast), then derive positions
+    await queue_events.tokens_queued(
+        [token.dict() for token in tokens],
+        urgent=any(token.priority_level == TokenPriority.CRITICAL for token in tokens)
+    )
+    created = [Token(**apply_queue_position(token.dict())) for token in tokens]
+    
+    return {
+        "tokens": created,
+        "created_count": len(created),
+        "rejected": rejected
+    }
+
 @api_router.get("/tokens/{token_id}")
-async def get_token(token_id: str, current_user: User = Depends(get_current_user)):
+async def get_token(token_id: str, current_user: User = Depends(get_current_principal)):
     token = await db.tokens.find_one({"id": token_id})
     if not token:
         raise HTTPException(status_code=404, detail="Token not found")
@@ -462,91 +702,119 @@ async def get_token(token_id: str, current_user: User = Depends(get_current_user
     if current_user.role == UserRole.PATIENT and token["patient_id"] != current_user.id:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return Token(**token)
+    return Token(**apply_queue_position(token))
 
 @api_router.get("/tokens", response_model=List[Token])
-async def get_user_tokens(current_user: User = Depends(get_current_user)):
+async def get_user_tokens(current_user: User = Depends(get_current_principal)):
     if current_user.role == UserRole.PATIENT:
         tokens = await db.tokens.find({"patient_id": current_user.id}).to_list(100)
     else:
         tokens = await db.tokens.find().to_list(1000)
     
-    return [Token(**token) for token in tokens]
+    return [Token(**apply_queue_position(token)) for token in tokens]
 
 # Queue Routes
 @api_router.get("/queue")
-async def get_queue(current_user: User = Depends(get_current_user)):
-    tokens = await db.tokens.find(
-        {"status": TokenStatus.ACTIVE}
-    ).sort("position", 1).to_list(1000)
+async def get_queue(
+    if_none_match: Optional[str] = Header(None),
+    current_user: User = Depends(get_current_user)
+):
+    etag, body = queue_snapshot.check(if_none_match)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@api_router.get("/queue/stream")
+async def stream_queue(
+    fields: Optional[str] = None,
+    last_event_id: Optional[str] = Header(None),
+    current_user: User = Depends(get_stream_user)
+):
+    """
+    Server-Sent Events feed of queue_snapshot/queue_delta messages for read-only screens.
+    Reconnects resume from Last-Event-ID; ?fields=token_number,position trims every row
+    to those fields (token_id is always kept).
+    """
+    projection = None
+    if fields:
+        projection = frozenset(field.strip() for field in fields.split(",") if field.strip())
+        unknown = projection - set(QueuePosition.model_fields)
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown queue fields: {', '.join(sorted(unknown))}")
+    return StreamingResponse(
+        queue_stream.events(last_event_id, projection),
+        media_type="text/event-stream",
+        # No proxy buffering, or events arrive in bursts
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@api_router.post("/queue/next", response_model=Token)
+async def call_next_token(
+    counter: Optional[str] = None,
+    category: Optional[str] = None,
+    current_user: User = Depends(get_current_staff)
+):
+    """Atomically take the head of the queue (optionally one category) for a service counter"""
+    now = datetime.now(timezone.utc)
+    claim = {
+        "$set": {
+            "status": TokenStatus.IN_SERVICE,
+            "called_at": now,
+            "counter": counter,
+            "updated_at": now
+        }
+    }
     
-    queue_data = []
-    for token in tokens:
-        queue_data.append(QueuePosition(
-            token_id=token["id"],
-            token_number=token["token_number"],
-            patient_name=token["patient_name"],
-            priority_level=token["priority_level"],
-            position=token["position"],
-            estimated_wait_time=token["estimated_wait_time"],
-            status=token["status"],
-            created_at=token["created_at"]
-        ))
+    # Claim in engine order so aged tokens are honoured; concurrent counters can never take the same patient
+    token, stale = await queue_engine.claim_head(db.tokens, claim, category, CALL_NEXT_CANDIDATES)
+    if not token and stale:
+        # Every candidate was claimed or closed elsewhere: rebuild from Mongo (aging is
+        # re-applied on load) and retry, rather than claiming in stored order, which ignores aging
+        await reload_queue_engine()
+        token, _ = await queue_engine.claim_head(db.tokens, claim, category, CALL_NEXT_CANDIDATES)
+    if not token:
+        raise HTTPException(status_code=404, detail="No patients waiting")
     
-    return {
-        "queue": queue_data,
-        "total_count": len(queue_data)
-    }
+    await queue_events.token_dequeued(token["id"])
+    await queue_events.token_updated(
+        {"id": token["id"], "status": TokenStatus.IN_SERVICE.value, "counter": counter},
+        token["patient_id"]
+    )
+    
+    return Token(**token)
 
 @api_router.put("/tokens/{token_id}/complete")
 async def complete_token(token_id: str, current_user: User = Depends(get_current_staff)):
-    token = await db.tokens.find_one({"id": token_id})
-    if not token:
-        raise HTTPException(status_code=404, detail="Token not found")
-    
-    # Update token status
-    await db.tokens.update_one(
-        {"id": token_id},
+    # Update token status; only a queued or in-service token completes, so a repeated
+    # request cannot record the same service time twice
+    completed_at = datetime.now(timezone.utc)
+    token = await db.tokens.find_one_and_update(
+        {"id": token_id, "status": {"$in": [TokenStatus.ACTIVE, TokenStatus.IN_SERVICE]}},
         {
             "$set": {
                 "status": TokenStatus.COMPLETED,
-                "updated_at": datetime.now(timezone.utc)
+                "updated_at": completed_at
             }
         }
     )
+    if not token:
+        if await db.tokens.count_documents({"id": token_id}, limit=1):
+            raise HTTPException(status_code=409, detail="Token is already completed or cancelled")
+        raise HTTPException(status_code=404, detail="Token not found")
     
-    # Update positions of remaining tokens
-    await db.tokens.update_many(
-        {
-            "status": TokenStatus.ACTIVE,
-            "position": {"$gt": token["position"]}
-        },
-        {"$inc": {"position": -1}}
-    )
+    await queue_events.token_dequeued(token_id)
     
-    # Send real-time update
-    await manager.send_token_update({"id": token_id, "status": "completed"}, token["patient_id"])
+    # Feed the observed call-to-complete duration into every worker's estimator
+    await queue_events.service_recorded(token, completed_at)
     
-    # Send updated queue to staff/admin
-    queue_tokens = await db.tokens.find({"status": TokenStatus.ACTIVE}).sort("position", 1).to_list(1000)
-    queue_data = []
-    for t in queue_tokens:
-        queue_data.append({
-            "token_id": t["id"],
-            "token_number": t["token_number"],
-            "patient_name": t["patient_name"],
-            "priority_level": t["priority_level"],
-            "position": t["position"],
-            "estimated_wait_time": t["estimated_wait_time"],
-            "status": t["status"],
-            "created_at": t["created_at"]
-        })
-    await manager.send_queue_update(queue_data)
+    # Send real-time update
+    await queue_events.token_updated({"id": token_id, "status": "completed"}, token["patient_id"])
     
     return {"message": "Token completed successfully"}
 
 @api_router.put("/tokens/{token_id}/cancel")
-async def cancel_token(token_id: str, current_user: User = Depends(get_current_user)):
+async def cancel_token(token_id: str, current_user: User = Depends(get_current_principal)):
     token = await db.tokens.find_one({"id": token_id})
     if not token:
         raise HTTPException(status_code=404, detail="Token not found")
@@ -566,14 +834,7 @@ async def cancel_token(token_id: str, current_user: User = Depends(get_current_u
         }
     )
     
-    # Update positions of remaining tokens
-    await db.tokens.update_many(
-        {
-            "status": TokenStatus.ACTIVE,
-            "position": {"$gt": token["position"]}
-        },
-        {"$inc": {"position": -1}}
-    )
+    await queue_events.token_dequeued(token_id)
     
     return {"message": "Token cancelled successfully"}
 
@@ -591,56 +852,24 @@ async def update_token_priority(
         raise HTTPException(status_code=404, detail="Token not found")
     
     old_priority = token["priority_level"]
-    old_position = token["position"]
     
     if old_priority == new_priority:
         return {"message": "Priority unchanged"}
     
-    # Remove from current position
-    await db.tokens.update_many(
-        {
-            "status": TokenStatus.ACTIVE,
-            "position": {"$gt": old_position}
-        },
-        {"$inc": {"position": -1}}
-    )
-    
-    # Find new position based on new priority
-    existing_tokens = await db.tokens.find({
-        "status": TokenStatus.ACTIVE,
-        "id": {"$ne": token_id}
-    }).to_list(1000)
-    
-    new_position = 1
-    for existing_token in existing_tokens:
-        if new_priority >= existing_token["priority_level"]:
-            new_position += 1
-    
-    # Update positions of tokens that will be after this one
-    await db.tokens.update_many(
-        {
-            "status": TokenStatus.ACTIVE,
-            "position": {"$gte": new_position},
-            "id": {"$ne": token_id}
-        },
-        {"$inc": {"position": 1}}
-    )
-    
-    # Update the token
-    estimated_wait_time = calculate_wait_time(new_position, TokenPriority(new_priority))
-    
     await db.tokens.update_one(
         {"id": token_id},
         {
             "$set": {
                 "priority_level": new_priority,
-                "position": new_position,
-                "estimated_wait_time": estimated_wait_time,
                 "updated_at": datetime.now(timezone.utc)
             }
         }
     )
     
+    await queue_events.token_reprioritized(
+        token_id, new_priority, urgent=new_priority == TokenPriority.CRITICAL
+    )
+    
     return {"message": "Token priority updated successfully"}
 
 # User Management Routes (Admin only)
@@ -650,7 +879,8 @@ async def get_users(current_user: User = Depends(get_current_admin)):
     return [User(**user) for user in users]
 
 @api_router.post("/users/create-staff")
-async def create_staff_user(user_data: UserCreate, current_user: User = Depends(get_current_admin)):
+async def create_staff_user(user_data: UserCreate, request: Request, current_user: User = Depends(get_current_admin)):
+    await rate_limiter.check(request_client_ip(request), user_data.email)
     if user_data.role not in [UserRole.STAFF, UserRole.ADMIN]:
         raise HTTPException(status_code=400, detail="Can only create staff or admin users")
     
@@ -658,16 +888,28 @@ async def create_staff_user(user_data: UserCreate, current_user: User = Depends(
     if existing_user:
         raise HTTPException(status_code=400, detail="Email already registered")
     
-    hashed_password = hash_password(user_data.password)
+    hashed_password = await hash_password(user_data.password)
     user_dict = user_data.dict()
     user_dict.pop("password")
-    user_dict["password_hash"] = hashed_password
     
     user = User(**user_dict)
-    await db.users.insert_one(user.dict())
+    await db.users.insert_one({**user.dict(), "password_hash": hashed_password})
     
     return {"message": "Staff user created successfully", "user_id": user.id}
 
+@api_router.put("/users/{user_id}/status")
+async def set_user_status(user_id: str, is_active: bool, current_user: User = Depends(get_current_admin)):
+    if user_id == current_user.id and not is_active:
+        raise HTTPException(status_code=400, detail="Cannot deactivate your own account")
+    changed_at = datetime.now(timezone.utc)
+    result = await db.users.update_one({"id": user_id}, {"$set": {"is_active": is_active, "updated_at": changed_at}})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="User not found")
+    # Drops cached principals and stops trusting earlier tokens' claims; on every worker only
+    # with EVENT_BUS_BACKEND=mongo, see principal_cache and token_claims
+    await user_changed(user_id, changed_at.timestamp())
+    return {"message": "User activated" if is_active else "User deactivated"}
+
 # Analytics Routes
 @api_router.get("/analytics/dashboard")
 async def get_dashboard_analytics(current_user: User = Depends(get_current_staff)):
@@ -686,15 +928,21 @@ async def get_dashboard_analytics(current_user: User = Depends(get_current_staff
         "updated_at": {"$gte": today_start}
     })
     
-    # Calculate average wait time
-    tokens_with_wait = await db.tokens.find({
-        "status": TokenStatus.COMPLETED,
-        "updated_at": {"$gte": today_start}
-    }).to_list(1000)
+    # Calculate average wait time (creation to completion, in minutes)
+    tokens_with_wait = await db.tokens.find(
+        {
+            "status": TokenStatus.COMPLETED,
+            "updated_at": {"$gte": today_start}
+        },
+        {"created_at": 1, "updated_at": 1}
+    ).to_list(1000)
     
     avg_wait_time = 0
     if tokens_with_wait:
-        total_wait = sum(token["estimated_wait_time"] for token in tokens_with_wait)
+        total_wait = sum(
+            (token["updated_at"] - token["created_at"]).total_seconds() / 60
+            for token in tokens_with_wait
+        )
         avg_wait_time = total_wait / len(tokens_with_wait)
     
     # Priority distribution
@@ -714,20 +962,67 @@ async def get_dashboard_analytics(current_user: User = Depends(get_current_staff
         "priority_distribution": priority_distribution
     }
 
+@api_router.get("/analytics/service-times")
+async def get_service_time_analytics(current_user: User = Depends(get_current_staff)):
+    """Observed service-time statistics (EWMA, p50, p90) per category and hour of day"""
+    return wait_estimator.stats()
+
+@api_router.get("/analytics/priority-aging")
+async def get_priority_aging_analytics(current_user: User = Depends(get_current_staff)):
+    """Aging thresholds, scheduled promotions and promotions applied so far"""
+    return priority_aging.stats()
+
+@api_router.get("/analytics/auth-cache")
+async def get_auth_cache_analytics(current_user: User = Depends(get_current_admin)):
+    """Principal cache size and hit/miss counters, and how often signed claims stood in for it"""
+    return {**principal_cache.counts(), "claims": token_claims.counts()}
+
+@api_router.get("/analytics/password-hashing")
+async def get_password_hashing_analytics(current_user: User = Depends(get_current_admin)):
+    """Password pool size, jobs in flight and 503 rejections"""
+    return password_hasher.counts()
+
+@api_router.get("/analytics/rate-limits")
+async def get_rate_limit_analytics(current_user: User = Depends(get_current_admin)):
+    """Password-attempt limits, attempts let through and 429s by bucket"""
+    return rate_limiter.counts()
+
+@api_router.get("/analytics/websockets")
+async def get_websocket_analytics(current_user: User = Depends(get_current_admin)):
+    """Per-connection send latency and queue depth, plus downgrade/eviction counters"""
+    return manager.stats()
+
+@api_router.get("/analytics/websockets/counts")
+async def get_websocket_counts(current_user: User = Depends(get_current_admin)):
+    """Live connection counts by role, limits and reap/reject counters, without per-connection detail"""
+    return {**manager.counts(), "queue_streams": queue_stream.counts()}
+
 # Include the router in the main app
 app.include_router(api_router, prefix="/api/v1")
 
 # WebSocket endpoint for real-time updates
 @app.websocket("/ws/{user_id}/{user_role}")
-async def websocket_endpoint(websocket: WebSocket, user_id: str, user_role: str):
-    await manager.connect(websocket, user_id, user_role)
+async def websocket_endpoint(websocket: WebSocket, user_id: str, user_role: str, access_token: Optional[str] = None):
+    """Browsers cannot set headers on a WebSocket handshake, so the JWT comes as ?access_token="""
+    user = await get_websocket_principal(access_token)
+    if user is None or user.id != user_id or user.role.value != user_role:
+        # The path must name the token's own user and role
+        await manager.refuse(websocket, f"unauthorized handshake for {user_id} ({user_role})")
+        return
+    # From here on the socket acts as the verified user, never as the path says
+    user_id, user_role = user.id, user.role.value
+    if not await manager.connect(websocket, user_id, user_role, request_client_ip(websocket)):
+        return
     try:
         while True:
             # Keep connection alive and handle any incoming messages
             data = await websocket.receive_text()
-            # Echo back for connection testing
-            await websocket.send_text(f"Echo: {data}")
+            if not await manager.handle_message(websocket, data):
+                # Echo back for connection testing
+                await manager.send_to(websocket, f"Echo: {data}")
     except WebSocketDisconnect:
+        pass
+    finally:
         manager.disconnect(websocket, user_id, user_role)
 
 # Configure logging
@@ -737,6 +1032,64 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+@app.on_event("startup")
+async def load_queue_engine():
+    # At most one active token per patient, enforced by Mongo rather than a pre-check. It is the
+    # only guard against concurrent duplicate creates, so the app does not start without it
+    try:
+        await db.tokens.create_index(
+            [("patient_id", 1), ("status", 1)],
+            name="active_token_per_patient",
+            unique=True,
+            partialFilterExpression={"status": TokenStatus.ACTIVE.value}
+        )
+    except Exception as e:
+        logger.error(f"Cannot ensure the active_token_per_patient index, refusing to start: {str(e)}")
+        raise
+    # Serves the active-token scans behind queue reloads, in queue order
+    await db.tokens.create_index([("status", 1), ("priority_level", 1), ("created_at", 1)])
+    await queue_engine.load(db.tokens)
+    await wait_estimator.warm(db.tokens)
+    # Publish the loaded queue now; until the first mutation, snapshots would otherwise be empty
+    await manager.flush_queue_update()
+    await token_claims.load(db.users)
+    # uvicorn and gunicorn both take their worker count from WEB_CONCURRENCY
+    event_bus.check_workers(int(os.environ.get('WEB_CONCURRENCY', 1)))
+    try:
+        await rate_limiter.start()
+    except Exception as e:
+        logger.warning(f"Rate limit index warning: {str(e)}")
+    await event_bus.start()
+    app.state.priority_aging_task = asyncio.create_task(
+        priority_aging.run(PRIORITY_AGING_INTERVAL, on_change=broadcast_aged_queue)
+    )
+    app.state.websocket_heartbeat_task = asyncio.create_task(manager.run_heartbeat())
+
+async def broadcast_aged_queue(token_ids: List[str]):
+    manager.queue_changed()
+
+async def broadcast_queue_event(event: Dict[str, Any]):
+    """Push bus events, local or from other workers, to this worker's sockets"""
+    payload = event["payload"]
+    if event["type"] == queue_events.TOKEN_UPDATED:
+        await manager.send_token_update(payload["data"], payload.get("user_id"))
+    elif event["type"] in queue_events.QUEUE_CHANGING_EVENTS:
+        manager.queue_changed(urgent=payload.get("urgent", False))
+
+async def reload_queue_engine():
+    """Rebuild from Mongo after events from other workers may have been missed; sockets refresh via the bus"""
+    await queue_events.reload_queue(db.tokens)
+
+event_bus.subscribe(broadcast_queue_event)
+event_bus.on_gap(reload_queue_engine)
+event_bus.on_gap(lambda: token_claims.load(db.users))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for name in ("priority_aging_task", "websocket_heartbeat_task"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    await event_bus.stop()
+    password_hasher.shutdown()
     client.close()
\ No newline at end of file
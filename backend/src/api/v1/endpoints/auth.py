@@ -1,5 +1,5 @@
 import logging
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from motor.motor_asyncio import AsyncIOMotorClient
 from datetime import datetime, timedelta, timezone
@@ -7,6 +7,8 @@ from jose import JWTError, jwt
 import bcrypt
 from pydantic import BaseModel, EmailStr
 from src.core.config import settings
+from src.core.password_hasher import PasswordHasherBusy, password_hasher
+from src.core.rate_limiter import rate_limiter, request_client_ip
 from src.db.mongodb import get_database
 
 router = APIRouter()
@@ -66,14 +68,31 @@ class LoginRequest(BaseModel):
     email: EmailStr
     password: str
 
+async def rehash_password(db, user_id, old_hash: str, password: str):
+    """Store the password again at the configured cost; runs after the login response"""
+    try:
+        new_hash = await password_hasher.run(bcrypt.hashpw, password.encode('utf-8'), password_hasher.salt())
+    except PasswordHasherBusy:
+        return
+    result = await db["users"].update_one(
+        {"_id": user_id, "password_hash": old_hash},
+        {"$set": {"password_hash": new_hash.decode('utf-8')}}
+    )
+    if result.modified_count:
+        password_hasher.stats["rehashed"] += 1
+
 @router.post("/login")
 async def login(
     credentials: LoginRequest,
+    request: Request,
+    background_tasks: BackgroundTasks,
     db = Depends(get_database)
 ):
     """
     Login endpoint that accepts JSON data
     """
+    # Before the user lookup and bcrypt; RateLimited becomes a 429 in the app
+    await rate_limiter.check(request_client_ip(request), credentials.email)
     try:
         logging.info(f"Login attempt for email: {credentials.email}")
         
@@ -100,18 +119,28 @@ async def login(
             )
 
         try:
-            if not bcrypt.checkpw(credentials.password.encode('utf-8'), stored_password.encode('utf-8')):
-                logging.warning(f"Login failed: Invalid password for email {credentials.email}")
-                raise HTTPException(
-                    status_code=status.HTTP_401_UNAUTHORIZED,
-                    detail="Incorrect email or password"
-                )
+            # Off the event loop: bcrypt would otherwise stall every other request
+            password_valid = await password_hasher.run(
+                bcrypt.checkpw, credentials.password.encode('utf-8'), stored_password.encode('utf-8')
+            )
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             logging.error(f"Password verification error: {str(e)}")
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail="Error verifying password"
             )
+        if not password_valid:
+            logging.warning(f"Login failed: Invalid password for email {credentials.email}")
+            raise HTTPException(
+                status_code=status.HTTP_401_UNAUTHORIZED,
+                detail="Incorrect email or password"
+            )
+
+        # Moves the stored hash to the configured cost without a password reset
+        if user.get("password_hash") and password_hasher.needs_rehash(stored_password):
+            background_tasks.add_task(rehash_password, db, user["_id"], stored_password, credentials.password)
         
         # Generate JWT token
         access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -121,6 +150,8 @@ async def login(
             "email": user["email"],
             "name": user.get("full_name") or user.get("name", ""),
             "role": user.get("role", "patient"),
+            "phone": user.get("phone", ""),
+            "iat": datetime.now(timezone.utc),
             "exp": expire
         }
         
@@ -137,6 +168,8 @@ async def login(
                 "role": user.get("role", "patient")
             }
         }
+    except (HTTPException, PasswordHasherBusy):
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -146,11 +179,13 @@ async def login(
 @router.post("/register", response_model=Token)
 async def register(
     user: UserCreate,
+    request: Request,
     db = Depends(get_database)
 ):
     """
     Register new user with validation
     """
+    await rate_limiter.check(request_client_ip(request), user.email)
     try:
         # Check if user already exists
         user_collection = db["users"]
@@ -172,11 +207,13 @@ async def register(
         try:
             # Convert password to bytes and generate salt
             password_bytes = user.password.encode('utf-8')
-            salt = bcrypt.gensalt()
-            hashed_password = bcrypt.hashpw(password_bytes, salt)
+            salt = password_hasher.salt()
+            hashed_password = await password_hasher.run(bcrypt.hashpw, password_bytes, salt)
             # Convert hash to string for storage
             hashed_password = hashed_password.decode('utf-8')
             logging.info("Password hashing successful")
+        except PasswordHasherBusy:
+            raise
         except Exception as e:
             logging.error(f"Password hashing error: {str(e)}")
             raise HTTPException(
@@ -211,6 +248,8 @@ async def register(
             "email": user.email,
             "name": user.name,
             "role": user.role,
+            "phone": user.phone,
+            "iat": datetime.now(timezone.utc),
             "exp": expire
         }
         
@@ -236,7 +275,7 @@ async def register(
                 "phone": user.phone
             }
         }
-    except HTTPException:
+    except (HTTPException, PasswordHasherBusy):
         raise
     except Exception as e:
         logging.error(f"Registration error: {str(e)}")
@@ -1,10 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 from datetime import datetime, timezone
-from typing import List, Optional
+from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field
+from src.core.config import settings
 from src.db.mongodb import get_database
-from src.api.v1.endpoints.users import get_current_user
+from src.api.v1.endpoints.users import get_current_principal
+from src.core import queue_events
+from src.core.priority_aging import priority_aging
+from src.core.queue_engine import queue_engine
+from src.core.queue_snapshot import queue_snapshot
+from src.core.token_sequencer import token_sequencer
+from src.core.wait_estimator import wait_estimator
 import uuid
 
 router = APIRouter()
@@ -26,9 +34,12 @@ class Token(BaseModel):
     category: str
     status: str = "active"
     symptoms: Optional[str] = None
-    position: int
-    estimated_wait_time: int
+    # Derived from the queue engine on read; never persisted
+    position: int = 0
+    estimated_wait_time: int = 0
     created_by: str
+    counter: Optional[str] = None
+    called_at: Optional[datetime] = None
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
@@ -37,6 +48,7 @@ class QueuePosition(BaseModel):
     token_number: str
     patient_name: str
     priority_level: int
+    effective_priority: Optional[int] = None
     position: int
     estimated_wait_time: int
     status: str
@@ -53,35 +65,102 @@ def assign_priority_by_category(category: str) -> int:
     }
     return category_priority_map.get(category, 4)
 
-def generate_token_number(priority: int) -> str:
-    priority_prefix = {
-        1: "E",  # Emergency
-        2: "H",  # High
-        3: "MH", # Medium High
-        4: "ML", # Medium Low
-        5: "R",  # Report
-        6: "C"   # Consultation
-    }
-    
-    date_str = datetime.now().strftime("%d%m%y")
-    sequence = str(uuid.uuid4().int)[:3].zfill(3)
-    return f"{priority_prefix[priority]}-{sequence}-{date_str}"
+TOKEN_NUMBER_PREFIX = {
+    1: "E",  # Emergency
+    2: "H",  # High
+    3: "MH", # Medium High
+    4: "ML", # Medium Low
+    5: "R",  # Report
+    6: "C"   # Consultation
+}
+
+async def generate_token_number(priority: int) -> str:
+    return await token_sequencer.next_token_number(TOKEN_NUMBER_PREFIX[priority])
+
+async def generate_token_numbers(priorities: List[int]) -> List[str]:
+    """Token numbers for a batch, reserving one block per prefix"""
+    numbers = {}
+    for priority in set(priorities):
+        numbers[priority] = await token_sequencer.next_token_numbers(
+            TOKEN_NUMBER_PREFIX[priority], priorities.count(priority)
+        )
+    return [numbers[priority].pop(0) for priority in priorities]
+
+# Static per-patient service times; priors for the adaptive estimator
+BASE_TIME_PER_PATIENT = {
+    1: 0,   # Emergency - Immediate
+    2: 5,   # High - 5 min avg
+    3: 15,  # Medium High - 15 min avg
+    4: 20,  # Medium Low - 20 min avg
+    5: 5,   # Report - 5 min avg
+    6: 10   # Consultation - 10 min avg
+}
 
 def calculate_wait_time(position: int, priority: int) -> int:
-    base_time_per_patient = {
-        1: 0,   # Emergency - Immediate
-        2: 5,   # High - 5 min avg
-        3: 15,  # Medium High - 15 min avg
-        4: 20,  # Medium Low - 20 min avg
-        5: 5,   # Report - 5 min avg
-        6: 10   # Consultation - 10 min avg
+    return position * BASE_TIME_PER_PATIENT[priority]
+
+# Learns from observed call-to-complete durations; falls back to the table above
+wait_estimator.configure(priors=BASE_TIME_PER_PATIENT, counters=settings.SERVICE_COUNTERS)
+
+# Long-waiting tokens move up one class per category threshold
+priority_aging.configure(
+    thresholds=settings.PRIORITY_AGING_THRESHOLDS,
+    ceiling=settings.PRIORITY_AGING_CEILING
+)
+
+# Queue heads tried by /queue/next before the engine is reloaded from Mongo and the claim retried
+CALL_NEXT_CANDIDATES = 5
+
+# Fields computed on read from the in-memory queue instead of being stored
+DERIVED_TOKEN_FIELDS = {"position", "estimated_wait_time"}
+
+def apply_queue_position(token: dict) -> dict:
+    """Fill in position and estimated wait time from the queue engine (0 when not queued)"""
+    position = queue_engine.position(token["id"]) or 0
+    token["position"] = position
+    token["estimated_wait_time"] = wait_estimator.queue_estimates(queue_engine).get(token["id"], 0) if position else 0
+    return token
+
+def duplicate_key_detail(error: Dict[str, Any]) -> str:
+    """Client-facing reason for a duplicate-key write error, by the index it hit"""
+    key_pattern = error.get("keyPattern") or {}
+    if "patient_id" in key_pattern or "active_token_per_patient" in error.get("errmsg", ""):
+        return "Patient already has an active token"
+    # e.g. a token_number collision; the row was not stored and can be resubmitted
+    return f"Duplicate {', '.join(key_pattern) or 'key'}, please retry"
+
+def build_queue_data() -> List[dict]:
+    """Active queue in order, with positions and wait times derived from the sort key"""
+    estimates = wait_estimator.queue_estimates(queue_engine)
+    queue_data = []
+    for position, entry in enumerate(queue_engine.entries(), start=1):
+        queue_data.append({
+            "token_id": entry["id"],
+            "token_number": entry["token_number"],
+            "patient_name": entry["patient_name"],
+            "priority_level": entry["priority_level"],
+            "effective_priority": entry["effective_priority"],
+            "position": position,
+            "estimated_wait_time": estimates[entry["id"]],
+            "status": entry["status"],
+            "created_at": entry["created_at"]
+        })
+    return queue_data
+
+def build_queue_snapshot() -> dict:
+    queue_data = [QueuePosition(**entry) for entry in build_queue_data()]
+    return {
+        "queue": queue_data,
+        "total_count": len(queue_data)
     }
-    return position * base_time_per_patient[priority]
+
+# GET /queue is served from one serialized body per queue version
+queue_snapshot.configure(build=build_queue_snapshot, stamp=lambda: wait_estimator.stamp(queue_engine))
 
 @router.post("/tokens", response_model=Token)
 async def create_token(
     token_data: TokenCreate, 
-    current_user = Depends(get_current_user),
+    current_user = Depends(get_current_principal),
     db: AsyncIOMotorClient = Depends(get_database)
 ):
     # Determine patient info
@@ -96,42 +175,11 @@ async def create_token(
         patient_name = token_data.patient_name
         patient_phone = token_data.patient_phone
     
-    # Check for existing active token for patient
-    existing_token = await db.tokens.find_one({
-        "patient_id": patient_id,
-        "status": "active"
-    })
-    
-    if existing_token:
-        raise HTTPException(status_code=400, detail="Patient already has an active token")
-    
     # Assign priority based on category
     priority = assign_priority_by_category(token_data.category)
     
     # Generate token number
-    token_number = generate_token_number(priority)
-    
-    # Calculate position in queue
-    existing_tokens = await db.tokens.find({"status": "active"}).to_list(1000)
-    position = 1
-    
-    # Find correct position based on priority (lower value = higher priority)
-    for existing_token in existing_tokens:
-        if priority >= existing_token["priority_level"]:
-            position += 1
-    
-    # Update positions of lower priority tokens
-    await db.tokens.update_many(
-        {
-            "status": "active",
-            "priority_level": {"$gt": priority},
-            "position": {"$gte": position}
-        },
-        {"$inc": {"position": 1}}
-    )
-    
-    # Calculate estimated wait time
-    estimated_wait_time = calculate_wait_time(position, priority)
+    token_number = await generate_token_number(priority)
     
     # Create token
     token = Token(
@@ -142,18 +190,116 @@ async def create_token(
         priority_level=priority,
         category=token_data.category,
         symptoms=token_data.symptoms,
-        position=position,
-        estimated_wait_time=estimated_wait_time,
         created_by=current_user["id"]
     )
     
-    await db.tokens.insert_one(token.dict())
+    # Single-document write: queue positions are derived, never shifted in Mongo.
+    # The partial unique index on (patient_id, status=active) rejects a second
+    # active token atomically, even when two desks submit at the same time.
+    try:
+        await db.tokens.insert_one(token.dict(exclude=DERIVED_TOKEN_FIELDS))
+    except DuplicateKeyError as e:
+        detail = duplicate_key_detail(e.details or {})
+        if "patient_id" in (e.details or {}).get("keyPattern", {}):
+            raise HTTPException(status_code=400, detail=detail)
+        # Any other unique index (e.g. token_number): nothing was stored, so the request can be retried
+        raise HTTPException(status_code=409, detail=detail)
+    
+    # Rank the token on every worker (ordered by priority, then arrival)
+    await queue_events.tokens_queued([token.dict()], urgent=token.priority_level == 1)
+    token.position = queue_engine.position(token.id) or 0
+    token.estimated_wait_time = wait_estimator.queue_estimates(queue_engine).get(token.id, 0)
     return token
 
+@router.post("/tokens/bulk")
+async def create_tokens_bulk(
+    tokens_data: List[TokenCreate],
+    current_user = Depends(get_current_principal),
+    db: AsyncIOMotorClient = Depends(get_database)
+):
+    """Register a batch of patients (mass-casualty intake, kiosk batches) in one pass"""
+    # Only staff and admin can register patients in bulk
+    if current_user["role"] not in ["staff", "admin"]:
+        raise HTTPException(status_code=403, detail="Staff access required")
+    if not tokens_data:
+        raise HTTPException(status_code=400, detail="At least one token is required")
+    if len(tokens_data) > settings.MAX_BULK_TOKENS:
+        raise HTTPException(status_code=400, detail=f"At most {settings.MAX_BULK_TOKENS} tokens per request")
+    
+    # Validate the whole batch before writing anything
+    seen_patients = set()
+    for index, token_data in enumerate(tokens_data):
+        if not token_data.patient_id or not token_data.patient_name or not token_data.patient_phone:
+            raise HTTPException(status_code=400, detail=f"Patient information required for token at index {index}")
+        if token_data.patient_id in seen_patients:
+            raise HTTPException(status_code=400, detail=f"Duplicate patient in batch at index {index}")
+        seen_patients.add(token_data.patient_id)
+    
+    active = await db.tokens.find(
+        {"patient_id": {"$in": list(seen_patients)}, "status": "active"},
+        {"patient_id": 1}
+    ).to_list(len(seen_patients))
+    if active:
+        raise HTTPException(
+            status_code=400,
+            detail={
+                "message": "Patients already have an active token",
+                "patient_ids": sorted(t["patient_id"] for t in active)
+            }
+        )
+    
+    # Priorities and token numbers in one pass
+    priorities = [assign_priority_by_category(t.category) for t in tokens_data]
+    token_numbers = await generate_token_numbers(priorities)
+    tokens = [
+        Token(
+            token_number=token_number,
+            patient_id=token_data.patient_id,
+            patient_name=token_data.patient_name,
+            patient_phone=token_data.patient_phone,
+            priority_level=priority,
+            category=token_data.category,
+            symptoms=token_data.symptoms,
+            created_by=current_user["id"]
+        )
+        for token_data, priority, token_number in zip(tokens_data, priorities, token_numbers)
+    ]
+    
+    # Unordered insert so a patient registered concurrently elsewhere only drops that row
+    rejected = []
+    try:
+        await db.tokens.insert_many(
+            [token.dict(exclude=DERIVED_TOKEN_FIELDS) for token in tokens],
+            ordered=False
+        )
+    except BulkWriteError as e:
+        write_errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != 11000 for error in write_errors):
+            raise
+        failed = {error["index"]: duplicate_key_detail(error) for error in write_errors}
+        rejected = [
+            {"index": index, "patient_id": tokens[index].patient_id, "detail": failed[index]}
+            for index in sorted(failed)
+        ]
+        tokens = [token for index, token in enumerate(tokens) if index not in failed]
+    
+    # Rank everything in one event, then derive positions once for the final queue
+    await queue_events.tokens_queued(
+        [token.dict() for token in tokens],
+        urgent=any(token.priority_level == 1 for token in tokens)
+    )
+    created = [Token(**apply_queue_position(token.dict())) for token in tokens]
+    
+    return {
+        "tokens": created,
+        "created_count": len(created),
+        "rejected": rejected
+    }
+
 @router.get("/tokens/{token_id}")
 async def get_token(
     token_id: str, 
-    current_user = Depends(get_current_user),
+    current_user = Depends(get_current_principal),
     db: AsyncIOMotorClient = Depends(get_database)
 ):
     token = await db.tokens.find_one({"id": token_id})
@@ -164,11 +310,11 @@ async def get_token(
     if current_user["role"] == "patient" and token["patient_id"] != current_user["id"]:
         raise HTTPException(status_code=403, detail="Access denied")
     
-    return Token(**token)
+    return Token(**apply_queue_position(token))
 
 @router.get("/tokens", response_model=List[Token])
 async def get_user_tokens(
-    current_user = Depends(get_current_user),
+    current_user = Depends(get_current_principal),
     db: AsyncIOMotorClient = Depends(get_database)
 ):
     if current_user["role"] == "patient":
@@ -176,75 +322,92 @@ async def get_user_tokens(
     else:
         tokens = await db.tokens.find().to_list(1000)
     
-    return [Token(**token) for token in tokens]
+    return [Token(**apply_queue_position(token)) for token in tokens]
 
 @router.get("/queue")
 async def get_queue(
-    current_user = Depends(get_current_user),
+    if_none_match: Optional[str] = Header(None),
+    current_user = Depends(get_current_principal)
+):
+    etag, body = queue_snapshot.check(if_none_match)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if body is None:
+        return Response(status_code=304, headers=headers)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+@router.post("/queue/next", response_model=Token)
+async def call_next_token(
+    counter: Optional[str] = None,
+    category: Optional[str] = None,
+    current_user = Depends(get_current_principal),
     db: AsyncIOMotorClient = Depends(get_database)
 ):
-    tokens = await db.tokens.find(
-        {"status": "active"}
-    ).sort("position", 1).to_list(1000)
-    
-    queue_data = []
-    for token in tokens:
-        queue_data.append(QueuePosition(
-            token_id=token["id"],
-            token_number=token["token_number"],
-            patient_name=token["patient_name"],
-            priority_level=token["priority_level"],
-            position=token["position"],
-            estimated_wait_time=token["estimated_wait_time"],
-            status=token["status"],
-            created_at=token["created_at"]
-        ))
+    """Atomically take the head of the queue (optionally one category) for a service counter"""
+    # Only staff and admin can call patients
+    if current_user["role"] not in ["staff", "admin"]:
+        raise HTTPException(status_code=403, detail="Staff access required")
     
-    return {
-        "queue": queue_data,
-        "total_count": len(queue_data)
+    now = datetime.now(timezone.utc)
+    claim = {
+        "$set": {
+            "status": "in_service",
+            "called_at": now,
+            "counter": counter,
+            "updated_at": now
+        }
     }
+    
+    # Claim in engine order so aged tokens are honoured; concurrent counters can never take the same patient
+    token, stale = await queue_engine.claim_head(db.tokens, claim, category, CALL_NEXT_CANDIDATES)
+    if not token and stale:
+        # Every candidate was claimed or closed elsewhere: rebuild from Mongo (aging is
+        # re-applied on load) and retry, rather than claiming in stored order, which ignores aging
+        await queue_events.reload_queue(db.tokens)
+        token, _ = await queue_engine.claim_head(db.tokens, claim, category, CALL_NEXT_CANDIDATES)
+    if not token:
+        raise HTTPException(status_code=404, detail="No patients waiting")
+    
+    await queue_events.token_dequeued(token["id"])
+    return Token(**token)
 
 @router.put("/tokens/{token_id}/complete")
 async def complete_token(
     token_id: str, 
-    current_user = Depends(get_current_user),
+    current_user = Depends(get_current_principal),
     db: AsyncIOMotorClient = Depends(get_database)
 ):
     # Only staff and admin can complete tokens
     if current_user["role"] not in ["staff", "admin"]:
         raise HTTPException(status_code=403, detail="Staff access required")
     
-    token = await db.tokens.find_one({"id": token_id})
-    if not token:
-        raise HTTPException(status_code=404, detail="Token not found")
-    
-    # Update token status
-    await db.tokens.update_one(
-        {"id": token_id},
+    # Update token status; only a queued or in-service token completes, so a repeated
+    # request cannot record the same service time twice
+    completed_at = datetime.now(timezone.utc)
+    token = await db.tokens.find_one_and_update(
+        {"id": token_id, "status": {"$in": ["active", "in_service"]}},
         {
             "$set": {
                 "status": "completed",
-                "updated_at": datetime.now(timezone.utc)
+                "updated_at": completed_at
             }
         }
     )
+    if not token:
+        if await db.tokens.count_documents({"id": token_id}, limit=1):
+            raise HTTPException(status_code=409, detail="Token is already completed or cancelled")
+        raise HTTPException(status_code=404, detail="Token not found")
     
-    # Update positions of remaining tokens
-    await db.tokens.update_many(
-        {
-            "status": "active",
-            "position": {"$gt": token["position"]}
-        },
-        {"$inc": {"position": -1}}
-    )
+    await queue_events.token_dequeued(token_id)
+    
+    # Feed the observed call-to-complete duration into every worker's estimator
+    await queue_events.service_recorded(token, completed_at)
     
     return {"message": "Token completed successfully"}
 
 @router.put("/tokens/{token_id}/cancel")
 async def cancel_token(
     token_id: str, 
-    current_user = Depends(get_current_user),
+    current_user = Depends(get_current_principal),
     db: AsyncIOMotorClient = Depends(get_database)
 ):
     token = await db.tokens.find_one({"id": token_id})
@@ -266,14 +429,7 @@ async def cancel_token(
         }
     )
     
-    # Update positions of remaining tokens
-    await db.tokens.update_many(
-        {
-            "status": "active",
-            "position": {"$gt": token["position"]}
-        },
-        {"$inc": {"position": -1}}
-    )
+    await queue_events.token_dequeued(token_id)
     
     return {"message": "Token cancelled successfully"}
 
@@ -3,37 +3,67 @@ from fastapi.security import OAuth2PasswordBearer
 from motor.motor_asyncio import AsyncIOMotorClient
 from jose import JWTError, jwt
 from src.core.config import settings
+from src.core.principal_cache import principal_cache, token_id
+from src.core.token_claims import token_claims
 from src.db.mongodb import get_database
 from bson import ObjectId
 
 router = APIRouter()
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorClient = Depends(get_database)):
-    credentials_exception = HTTPException(
+principal_cache.configure(
+    max_entries=settings.PRINCIPAL_CACHE_SIZE,
+    ttl_seconds=settings.PRINCIPAL_CACHE_TTL_SECONDS
+)
+token_claims.configure(max_age_seconds=settings.TOKEN_CLAIMS_MAX_AGE_SECONDS)
+
+def credentials_exception() -> HTTPException:
+    return HTTPException(
         status_code=401,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+
+def decode_token(token: str) -> dict:
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=["HS256"])
-        user_id: str = payload.get("sub")
-        if user_id is None:
-            raise credentials_exception
+        if payload.get("sub") is None:
+            raise credentials_exception()
     except JWTError:
-        raise credentials_exception
-        
-    user = await db.users.find_one({"_id": ObjectId(user_id)})
+        raise credentials_exception()
+    return payload
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncIOMotorClient = Depends(get_database)):
+    return await load_user(decode_token(token), token, db)
+
+async def get_current_principal(token: str = Depends(oauth2_scheme), db: AsyncIOMotorClient = Depends(get_database)):
+    """The user as signed in a fresh token, for routes that only check role and id; no database call"""
+    payload = decode_token(token)
+    claims = token_claims.principal(payload)
+    if claims is None:
+        return await load_user(payload, token, db)
+    return claims
+
+async def load_user(payload: dict, token: str, db) -> dict:
+    user_id = payload["sub"]
+    cache_key = token_id(payload, token)
+    user = principal_cache.get(user_id, cache_key)
     if user is None:
-        raise credentials_exception
-        
-    user["id"] = str(user["_id"])
-    del user["_id"]
-    if "hashed_password" in user:
-        del user["hashed_password"]
-    if "password_hash" in user:
-        del user["password_hash"]
-    return user
+        user = await db.users.find_one({"_id": ObjectId(user_id)})
+        if user is None:
+            raise credentials_exception()
+
+        user["id"] = str(user["_id"])
+        del user["_id"]
+        if "hashed_password" in user:
+            del user["hashed_password"]
+        if "password_hash" in user:
+            del user["password_hash"]
+        principal_cache.put(user_id, cache_key, user, payload.get("exp"))
+    if not user.get("is_active", True):
+        raise credentials_exception()
+    # Handlers get their own copy; the cached one is shared by later requests
+    return dict(user)
 
 @router.get("/me")
 async def read_users_me(current_user = Depends(get_current_user)):
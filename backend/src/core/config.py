@@ -1,6 +1,7 @@
-from typing import List
+from typing import Dict, List
 from pydantic_settings import BaseSettings, SettingsConfigDict
 import os
+from src.core.priority_aging import DEFAULT_AGING_CEILING, DEFAULT_AGING_THRESHOLDS
 
 class Settings(BaseSettings):
     PROJECT_NAME: str = "Hospital Management System"
@@ -11,6 +12,49 @@ class Settings(BaseSettings):
     MONGODB_URL: str = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
     MONGODB_DB_NAME: str = os.getenv("MONGODB_DB_NAME", "hospital_management")
     CORS_ORIGINS: List[str] = ["http://localhost:3000", "http://localhost:8000"]
+    # Token numbers reserved per worker in one counter round trip
+    TOKEN_SEQUENCE_BLOCK_SIZE: int = int(os.getenv("TOKEN_SEQUENCE_BLOCK_SIZE", "20"))
+    # Upper bound on tokens accepted by one bulk intake request
+    MAX_BULK_TOKENS: int = int(os.getenv("MAX_BULK_TOKENS", "200"))
+    # Counters serving the queue in parallel; divides estimated wait times
+    SERVICE_COUNTERS: int = int(os.getenv("SERVICE_COUNTERS", "1"))
+    # Minutes waited per one-class promotion by category (JSON in the environment)
+    PRIORITY_AGING_THRESHOLDS: Dict[str, float] = DEFAULT_AGING_THRESHOLDS
+    # Best class aging can reach; 2 keeps CRITICAL for triage only
+    PRIORITY_AGING_CEILING: int = int(os.getenv("PRIORITY_AGING_CEILING", str(DEFAULT_AGING_CEILING)))
+    # Seconds between aging ticks
+    PRIORITY_AGING_INTERVAL: float = float(os.getenv("PRIORITY_AGING_INTERVAL", "30"))
+    # "memory" for one worker in one replica; "mongo" shares queue events via change streams (replica set)
+    EVENT_BUS_BACKEND: str = os.getenv("EVENT_BUS_BACKEND", "memory")
+    # Worker processes per replica (uvicorn/gunicorn read it too); more than one needs the mongo bus
+    WEB_CONCURRENCY: int = int(os.getenv("WEB_CONCURRENCY", "1"))
+    # How long published events stay in the queue_events collection
+    EVENT_BUS_TTL_SECONDS: int = int(os.getenv("EVENT_BUS_TTL_SECONDS", "3600"))
+    # Threads running bcrypt for login/registration
+    PASSWORD_HASH_WORKERS: int = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+    # Password jobs in flight before requests are answered 503
+    PASSWORD_HASH_MAX_PENDING: int = int(os.getenv("PASSWORD_HASH_MAX_PENDING", "64"))
+    # bcrypt cost; 0 picks the cost closest to PASSWORD_HASH_TARGET_MS on this host
+    PASSWORD_HASH_ROUNDS: int = int(os.getenv("PASSWORD_HASH_ROUNDS", "0"))
+    # Target milliseconds per hash when PASSWORD_HASH_ROUNDS is 0 (0 keeps the default cost)
+    PASSWORD_HASH_TARGET_MS: float = float(os.getenv("PASSWORD_HASH_TARGET_MS", "0"))
+    # Authenticated users cached per token; 0 disables the cache
+    PRINCIPAL_CACHE_SIZE: int = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+    # Longest a cached user may be served without reloading it
+    PRINCIPAL_CACHE_TTL_SECONDS: float = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+    # Seconds after issue a token's signed role is trusted without loading the user; 0 always loads
+    TOKEN_CLAIMS_MAX_AGE_SECONDS: float = float(os.getenv("TOKEN_CLAIMS_MAX_AGE_SECONDS", "900"))
+    # "memory" limits password attempts per worker; "mongo" shares the buckets across replicas
+    RATE_LIMIT_BACKEND: str = os.getenv("RATE_LIMIT_BACKEND", "memory")
+    # Proxies (addresses or CIDRs, comma-separated) whose X-Forwarded-For names the client
+    TRUSTED_PROXIES: str = os.getenv("TRUSTED_PROXIES", "")
+    # Password attempts a client IP may make at once, then per minute; 0 disables.
+    # Off by default without TRUSTED_PROXIES, where every client may share the proxy's address
+    RATE_LIMIT_IP_BURST: float = float(os.getenv("RATE_LIMIT_IP_BURST", "20" if os.getenv("TRUSTED_PROXIES") else "0"))
+    RATE_LIMIT_IP_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_IP_PER_MINUTE", "10"))
+    # Password attempts against one email at once, then per minute; 0 disables
+    RATE_LIMIT_EMAIL_BURST: float = float(os.getenv("RATE_LIMIT_EMAIL_BURST", "5"))
+    RATE_LIMIT_EMAIL_PER_MINUTE: float = float(os.getenv("RATE_LIMIT_EMAIL_PER_MINUTE", "2"))
 
     model_config = SettingsConfigDict(
         case_sensitive=True,
@@ -0,0 +1,64 @@
+import json
+from datetime import date, datetime, time
+from decimal import Decimal
+from enum import Enum
+from typing import Any, Optional
+from uuid import UUID
+
+from bson import ObjectId
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - stdlib fallback
+    orjson = None
+
+
+def _default(value: Any) -> Any:
+    """Types neither encoder handles natively; orjson covers datetime/Enum/UUID itself"""
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, BaseModel):
+        return value.model_dump()
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return value.value
+    if isinstance(value, UUID):
+        return str(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def dumps(value: Any) -> bytes:
+    """Encode to compact JSON bytes; datetimes are ISO 8601 either way"""
+    if orjson is not None:
+        return orjson.dumps(value, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    return json.dumps(value, default=_default, separators=(",", ":")).encode()
+
+
+class Frame:
+    """
+    One serialized message shared by every recipient.
+
+    HTTP responses use the bytes; WebSocket text frames need str, which is
+    decoded once on first use and then reused for every socket.
+    """
+
+    __slots__ = ("data", "_text")
+
+    def __init__(self, value: Any):
+        self.data = dumps(value)
+        self._text: Optional[str] = None
+
+    @property
+    def text(self) -> str:
+        if self._text is None:
+            self._text = self.data.decode()
+        return self._text
+
+    def __len__(self) -> int:
+        return len(self.data)
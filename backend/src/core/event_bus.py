@@ -0,0 +1,175 @@
+import asyncio
+import logging
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+Handler = Callable[[Event], Awaitable[None]]
+
+
+class InProcessBackend:
+    """
+    Single-process deployments: local dispatch is all there is.
+
+    Exactly one worker in exactly one replica. Every process keeps its own
+    queue engine, so a second one would serve its own diverging queue,
+    positions and call-next order. Workers are refused by check_workers;
+    replicas cannot be seen from here, so deployments must keep one.
+    """
+
+    async def start(self, deliver: Handler, gap: Callable[[], Awaitable[None]]):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def publish(self, event: Event):
+        pass
+
+
+class MongoChangeStreamBackend:
+    """
+    Shares events between workers and replicas through a Mongo collection.
+
+    Each publish inserts one document; every worker tails inserts with a
+    change stream and hands events from other workers to its handlers. The
+    resume token survives transient stream errors; when the stream cannot be
+    resumed, the gap callback lets the app rebuild its state from Mongo.
+    A TTL index keeps the collection small. Change streams need a replica
+    set (a single-node one is enough).
+    """
+
+    def __init__(self, collection, ttl_seconds: int = 3600, retry_seconds: float = 1.0):
+        self._collection = collection
+        self.ttl_seconds = ttl_seconds
+        self.retry_seconds = retry_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self, deliver: Handler, gap: Callable[[], Awaitable[None]]):
+        try:
+            await self._collection.create_index("created_at", expireAfterSeconds=self.ttl_seconds)
+        except Exception as e:
+            logger.warning(f"Event collection index warning: {e}")
+        self._task = asyncio.get_running_loop().create_task(self._watch(deliver, gap))
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    async def publish(self, event: Event):
+        await self._collection.insert_one({**event, "created_at": datetime.now(timezone.utc)})
+
+    async def _watch(self, deliver: Handler, gap: Callable[[], Awaitable[None]]):
+        resume_token = None
+        # Events published before the first stream opened are only in Mongo
+        needs_resync = True
+        failures = 0
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                async with self._collection.watch(pipeline, resume_after=resume_token) as stream:
+                    if needs_resync:
+                        # Rebuild only once the new stream is open, so nothing falls in between
+                        await gap()
+                        needs_resync = False
+                    async for change in stream:
+                        resume_token = stream.resume_token
+                        failures = 0
+                        await deliver(change["fullDocument"])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                failures += 1
+                logger.error(f"Event change stream failed ({failures}): {e}")
+                if resume_token is None or failures > 1:
+                    # Continuity cannot be proven; open a fresh stream and resync
+                    resume_token = None
+                    needs_resync = True
+                await asyncio.sleep(min(self.retry_seconds * 2 ** (failures - 1), 30))
+
+
+class EventBus:
+    """
+    Publish/subscribe for queue and token events.
+
+    publish() runs the local handlers first, so the publishing request sees
+    its own change, then hands the event to the backend for other workers.
+    Events coming back from the backend with this worker's origin are
+    skipped, so every handler sees each event exactly once per worker.
+    """
+
+    def __init__(self, backend=None):
+        self.origin = uuid.uuid4().hex
+        self.backend = backend or InProcessBackend()
+        self._handlers: List[Handler] = []
+        self._gap_handlers: List[Callable[[], Awaitable[None]]] = []
+        self.stats = {"published": 0, "received": 0, "publish_errors": 0, "handler_errors": 0, "gaps": 0}
+
+    def configure(self, backend):
+        self.backend = backend
+
+    def check_workers(self, workers: int):
+        """
+        Refuse to serve several worker processes from the in-process backend.
+
+        Its events never leave the worker that published them, so the other
+        workers would keep stale queues, cached users and trusted claims.
+        """
+        if workers > 1 and isinstance(self.backend, InProcessBackend):
+            raise RuntimeError(
+                f"{workers} workers need EVENT_BUS_BACKEND=mongo; the in-process event bus reaches one worker only"
+            )
+
+    def subscribe(self, handler: Handler):
+        self._handlers.append(handler)
+
+    def on_gap(self, handler: Callable[[], Awaitable[None]]):
+        """Called when remote events may have been missed and state must be rebuilt"""
+        self._gap_handlers.append(handler)
+
+    async def start(self):
+        await self.backend.start(self._receive, self._gap)
+
+    async def stop(self):
+        await self.backend.stop()
+
+    async def publish(self, event_type: str, payload: Dict[str, Any]):
+        event = {"type": event_type, "payload": payload, "origin": self.origin}
+        self.stats["published"] += 1
+        await self._dispatch(event)
+        try:
+            await self.backend.publish(event)
+        except Exception as e:
+            # Local state is already updated; other workers catch up on their next gap
+            self.stats["publish_errors"] += 1
+            logger.error(f"Failed to publish {event_type}: {e}")
+
+    async def _receive(self, event: Event):
+        if event.get("origin") == self.origin:
+            return
+        self.stats["received"] += 1
+        await self._dispatch(event)
+
+    async def _dispatch(self, event: Event):
+        for handler in self._handlers:
+            try:
+                await handler(event)
+            except Exception as e:
+                self.stats["handler_errors"] += 1
+                logger.error(f"Event handler failed for {event.get('type')}: {e}")
+
+    async def _gap(self):
+        self.stats["gaps"] += 1
+        for handler in self._gap_handlers:
+            try:
+                await handler()
+            except Exception as e:
+                logger.error(f"Event gap handler failed: {e}")
+
+
+# Process-wide bus; the backend is chosen by the app at startup
+event_bus = EventBus()
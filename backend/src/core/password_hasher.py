@@ -0,0 +1,153 @@
+"""
+Bounded worker pool for password hashing and verification.
+
+bcrypt takes hundreds of milliseconds per call by design. Run inline in an
+async handler it stalls the event loop, and with it every request and
+WebSocket fan-out, for the whole of each login. Here the work runs on a
+small thread pool instead (bcrypt releases the GIL, so threads hash in
+parallel). A cap on jobs in flight turns a login storm into fast 503s
+rather than an ever-growing backlog.
+
+The bcrypt cost is set per deployment, either directly or as a target hash
+time measured on the host. Stored hashes with any other cost are rehashed
+on the next successful login (see needs_rehash).
+"""
+import asyncio
+import os
+import re
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, TypeVar
+
+import bcrypt
+
+T = TypeVar("T")
+
+DEFAULT_ROUNDS = 12
+# Below 10 bcrypt is too cheap to slow offline guessing; above 16 a login takes seconds
+MIN_ROUNDS, MAX_ROUNDS = 10, 16
+# Cost measured when calibrating at startup; each extra round doubles the time
+PROBE_ROUNDS = 8
+
+_BCRYPT_COST = re.compile(r"^\$2[abxy]?\$(\d{2})\$")
+
+
+def hash_rounds(hashed: Any) -> Optional[int]:
+    """Cost of a stored bcrypt hash, or None when it is not one"""
+    if isinstance(hashed, bytes):
+        hashed = hashed.decode("utf-8", "replace")
+    match = _BCRYPT_COST.match(hashed or "")
+    return int(match.group(1)) if match else None
+
+
+def measure_cost(rounds: int, samples: int = 3) -> float:
+    """Median milliseconds for one bcrypt hash at this cost on this host"""
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        bcrypt.hashpw(b"calibration-password", bcrypt.gensalt(rounds=rounds))
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def rounds_for_target(target_ms: float, probe_ms: Optional[float] = None) -> int:
+    """Cost whose hash time is closest to target_ms, extrapolated from one cheap probe"""
+    probe_ms = probe_ms if probe_ms is not None else measure_cost(PROBE_ROUNDS)
+    best = min(
+        range(MIN_ROUNDS, MAX_ROUNDS + 1),
+        key=lambda rounds: abs(probe_ms * 2 ** (rounds - PROBE_ROUNDS) - target_ms),
+    )
+    return best
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password jobs in flight; the app answers 503 with Retry-After"""
+
+
+class PasswordHasher:
+    def __init__(self, workers: Optional[int] = None, max_pending: int = 64, rounds: int = DEFAULT_ROUNDS):
+        self.workers = workers or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending
+        self.rounds = rounds
+        self.target_ms: Optional[float] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self.pending = 0
+        self.stats = {"completed": 0, "rejected": 0, "max_pending": 0, "wait_ms_max": 0.0, "run_ms_max": 0.0,
+                      "rehashed": 0}
+
+    def configure(self, workers: Optional[int] = None, max_pending: Optional[int] = None,
+                  rounds: Optional[int] = None, target_ms: Optional[float] = None):
+        """An explicit rounds wins; otherwise target_ms picks the cost by timing this host"""
+        if workers is not None and workers != self.workers:
+            self.workers = workers
+            self.shutdown()
+        if max_pending is not None:
+            self.max_pending = max_pending
+        if rounds:
+            self.rounds = rounds
+        elif target_ms:
+            self.target_ms = target_ms
+            self.rounds = rounds_for_target(target_ms)
+
+    def salt(self) -> bytes:
+        return bcrypt.gensalt(rounds=self.rounds)
+
+    def needs_rehash(self, hashed: Any) -> bool:
+        """True for bcrypt hashes stored with a cost other than the configured one"""
+        rounds = hash_rounds(hashed)
+        return rounds is not None and rounds != self.rounds
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="password")
+        return self._executor
+
+    async def run(self, fn: Callable[..., T], *args: Any) -> T:
+        """Run fn(*args) on the pool; raises PasswordHasherBusy when max_pending jobs are in flight"""
+        if self.pending >= self.max_pending:
+            self.stats["rejected"] += 1
+            raise PasswordHasherBusy()
+        self.pending += 1
+        self.stats["max_pending"] = max(self.stats["max_pending"], self.pending)
+        loop = asyncio.get_running_loop()
+        submitted = time.perf_counter()
+
+        def timed():
+            started = time.perf_counter()
+            try:
+                return fn(*args)
+            finally:
+                try:
+                    loop.call_soon_threadsafe(self._finished, submitted, started, time.perf_counter())
+                except RuntimeError:
+                    pass  # loop already closed at shutdown
+
+        # The slot is released when the thread finishes, even if the request was cancelled meanwhile
+        future = self._pool().submit(timed)
+        return await asyncio.wrap_future(future)
+
+    def _finished(self, submitted: float, started: float, finished: float):
+        self.pending -= 1
+        self.stats["completed"] += 1
+        self.stats["wait_ms_max"] = max(self.stats["wait_ms_max"], (started - submitted) * 1000)
+        self.stats["run_ms_max"] = max(self.stats["run_ms_max"], (finished - started) * 1000)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    def counts(self) -> Dict[str, Any]:
+        return {
+            "rounds": self.rounds,
+            "target_ms": self.target_ms,
+            "workers": self.workers,
+            "pending": self.pending,
+            "max_pending_allowed": self.max_pending,
+            **{key: round(value, 3) if isinstance(value, float) else value for key, value in self.stats.items()},
+        }
+
+
+# Process-wide pool shared by both apps' auth routes
+password_hasher = PasswordHasher()
@@ -0,0 +1,122 @@
+"""
+Authenticated-principal cache for get_current_user.
+
+Both apps decode the JWT and then load the user from Mongo on every request.
+The cache keeps the loaded user for a short TTL, keyed by subject and token
+id, so repeat requests with the same token cost one dict lookup. Entries
+never outlive the token's own expiry. Changing or deactivating a user
+publishes USER_CHANGED on the event bus, which drops that user's entries.
+With EVENT_BUS_BACKEND=mongo that reaches every worker and replica; the
+in-process bus supports exactly one backend process (see event_bus).
+"""
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional, Set, Tuple
+
+from src.core.event_bus import Event, event_bus
+
+USER_CHANGED = "user.changed"
+
+Key = Tuple[str, Hashable]
+
+
+def token_id(payload: Dict[str, Any], token: str) -> str:
+    """The token's jti, or its signature for tokens issued without one"""
+    return payload.get("jti") or token.rsplit(".", 1)[-1]
+
+
+class PrincipalCache:
+    """Bounded LRU of principals with a TTL, keyed by (subject, token id)"""
+
+    def __init__(self, max_entries: int = 10000, ttl_seconds: float = 60.0,
+                 clock: Callable[[], float] = time.time):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._entries: "OrderedDict[Key, Tuple[float, Any]]" = OrderedDict()
+        self._by_subject: Dict[str, Set[Key]] = {}
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "evicted": 0, "invalidated": 0}
+
+    def configure(self, max_entries: Optional[int] = None, ttl_seconds: Optional[float] = None):
+        if max_entries is not None:
+            self.max_entries = max_entries
+        if ttl_seconds is not None:
+            self.ttl_seconds = ttl_seconds
+        self.clear()
+
+    def get(self, subject: str, token: Hashable) -> Optional[Any]:
+        key = (subject, token)
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        expires, principal = entry
+        if self._clock() >= expires:
+            self.stats["expired"] += 1
+            self.stats["misses"] += 1
+            self._drop(key)
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return principal
+
+    def put(self, subject: str, token: Hashable, principal: Any, token_expires: Optional[float] = None):
+        """Cache a principal until the TTL or token_expires (epoch seconds), whichever is first"""
+        if self.max_entries <= 0 or self.ttl_seconds <= 0:
+            return
+        expires = self._clock() + self.ttl_seconds
+        if token_expires is not None:
+            expires = min(expires, token_expires)
+        key = (subject, token)
+        self._entries[key] = (expires, principal)
+        self._entries.move_to_end(key)
+        self._by_subject.setdefault(subject, set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self.stats["evicted"] += 1
+            self._drop(oldest)
+
+    def invalidate(self, subject: str) -> int:
+        """Forget every cached token of one user; returns how many entries went"""
+        keys = self._by_subject.pop(subject, set())
+        for key in keys:
+            self._entries.pop(key, None)
+        self.stats["invalidated"] += len(keys)
+        return len(keys)
+
+    def clear(self):
+        self._entries.clear()
+        self._by_subject.clear()
+
+    def _drop(self, key: Key):
+        self._entries.pop(key, None)
+        keys = self._by_subject.get(key[0])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_subject[key[0]]
+
+    def counts(self) -> Dict[str, Any]:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl_seconds,
+            "hit_rate": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            **self.stats,
+        }
+
+
+async def user_changed(user_id: str, changed_at: Optional[float] = None):
+    """Publish after writing a user's role, profile or active flag (changed_at matches the stored updated_at)"""
+    await event_bus.publish(USER_CHANGED, {"user_id": user_id, "changed_at": changed_at or time.time()})
+
+
+async def apply_user_event(event: Event):
+    if event["type"] == USER_CHANGED:
+        principal_cache.invalidate(event["payload"]["user_id"])
+
+
+# Process-wide cache; each app sets its size and TTL
+principal_cache = PrincipalCache()
+event_bus.subscribe(apply_user_event)
@@ -0,0 +1,152 @@
+import asyncio
+import logging
+import math
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from src.core.queue_engine import QueueEngine, queue_engine, to_timestamp
+
+logger = logging.getLogger(__name__)
+
+# Minutes waited per one-class promotion; categories not listed never age
+DEFAULT_AGING_THRESHOLDS = {
+    "serious_condition": 45.0,
+    "regular_consultation": 60.0,
+    "report_pickup": 30.0,
+    "report_consultation": 60.0,
+}
+
+# Aging never promotes past HIGH; CRITICAL stays reserved for triage
+DEFAULT_AGING_CEILING = 2
+
+
+class PriorityAgingScheduler:
+    """
+    Starvation-free aging: a token's effective priority improves by one class
+    for every `threshold` minutes it waits, up to `ceiling`.
+
+    Each token is filed in a timer-wheel bucket (granularity seconds wide) for
+    the moment its next promotion falls due, so a tick only visits the tokens
+    whose effective class actually changes. Scheduling and cancelling are
+    O(1); each promotion is one O(log n) re-rank in the queue engine.
+    """
+
+    def __init__(self, engine: QueueEngine, thresholds: Optional[Dict[str, float]] = None,
+                 ceiling: int = DEFAULT_AGING_CEILING, granularity: float = 30.0,
+                 clock: Callable[[], float] = time.time):
+        self.engine = engine
+        self.thresholds = dict(DEFAULT_AGING_THRESHOLDS if thresholds is None else thresholds)
+        self.ceiling = ceiling
+        self.granularity = granularity
+        self._clock = clock
+        self._buckets: Dict[int, Set[str]] = {}
+        self._due: Dict[str, int] = {}
+        self._next_bucket: Optional[int] = None
+        self.promotions = 0
+        engine.add_observer(self)
+
+    def configure(self, thresholds: Optional[Dict[str, float]] = None, ceiling: Optional[int] = None,
+                  granularity: Optional[float] = None):
+        if thresholds is not None:
+            self.thresholds = dict(thresholds)
+        if ceiling is not None:
+            self.ceiling = ceiling
+        if granularity is not None:
+            self.granularity = granularity
+
+    def effective_priority(self, priority_level: int, category: Optional[str], created_ts: float,
+                           now: float):
+        """Return (effective priority, timestamp of the next promotion or None)"""
+        threshold = self.thresholds.get(category or "")
+        if not threshold or priority_level <= self.ceiling:
+            return priority_level, None
+        step = threshold * 60
+        steps = int(max(0.0, now - created_ts) // step)
+        effective = max(self.ceiling, priority_level - steps)
+        if effective == self.ceiling:
+            return effective, None
+        return effective, created_ts + (steps + 1) * step
+
+    # Queue engine observer protocol
+
+    def tracked(self, token_id: str, entry: Dict[str, Any]):
+        self._unschedule(token_id)
+        self._apply(token_id, entry, self._clock())
+
+    def untracked(self, token_id: str):
+        self._unschedule(token_id)
+
+    def cleared(self):
+        self._buckets.clear()
+        self._due.clear()
+
+    def _unschedule(self, token_id: str):
+        bucket = self._due.pop(token_id, None)
+        if bucket is not None:
+            members = self._buckets.get(bucket)
+            if members is not None:
+                members.discard(token_id)
+                if not members:
+                    del self._buckets[bucket]
+
+    def _apply(self, token_id: str, entry: Dict[str, Any], now: float) -> bool:
+        effective, next_due = self.effective_priority(
+            int(entry["priority_level"]), entry.get("category"), to_timestamp(entry.get("created_at")), now
+        )
+        changed = self.engine.set_effective_priority(token_id, effective)
+        if next_due is not None:
+            # Round up so a bucket is only processed once every member is due
+            bucket = math.ceil(next_due / self.granularity)
+            self._buckets.setdefault(bucket, set()).add(token_id)
+            self._due[token_id] = bucket
+        return changed
+
+    def tick(self, now: Optional[float] = None) -> List[str]:
+        """Promote every token whose next aging step is due; returns the re-ranked ids"""
+        now = self._clock() if now is None else now
+        current = int(now // self.granularity)
+        if self._next_bucket is None:
+            self._next_bucket = min(self._buckets, default=current)
+        if current - self._next_bucket <= len(self._buckets):
+            due_buckets = range(self._next_bucket, current + 1)
+        else:
+            # Long gap since the last tick: visit only buckets that exist
+            due_buckets = sorted(bucket for bucket in self._buckets if bucket <= current)
+
+        changed = []
+        for bucket in due_buckets:
+            for token_id in self._buckets.pop(bucket, ()):
+                self._due.pop(token_id, None)
+                entry = self.engine.entry(token_id)
+                if entry is not None and self._apply(token_id, entry, now):
+                    changed.append(token_id)
+        self._next_bucket = current + 1
+        self.promotions += len(changed)
+        return changed
+
+    async def run(self, interval: float = 30.0,
+                  on_change: Optional[Callable[[List[str]], Awaitable[None]]] = None):
+        """Tick forever; on_change is awaited with the ids re-ranked by each tick"""
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                changed = self.tick()
+                if changed:
+                    logger.info(f"Priority aging promoted {len(changed)} tokens")
+                    if on_change is not None:
+                        await on_change(changed)
+            except Exception as e:
+                logger.error(f"Priority aging tick failed: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "scheduled_tokens": len(self._due),
+            "pending_buckets": len(self._buckets),
+            "promotions": self.promotions,
+            "thresholds_minutes": self.thresholds,
+            "ceiling": self.ceiling,
+        }
+
+
+# Process-wide scheduler attached to the shared queue engine
+priority_aging = PriorityAgingScheduler(queue_engine)
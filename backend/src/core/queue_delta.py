@@ -0,0 +1,130 @@
+import bisect
+from collections import deque
+from typing import Any, Deque, Dict, FrozenSet, List, Optional
+
+# Fields that follow from a row's place in the queue. The estimated wait is the service time of
+# everyone ahead, so one insert at the head changes it on every row behind; clients recompute it
+# from the order and the wait model instead of receiving it in `updated`.
+DERIVED_FIELDS = frozenset({"position", "estimated_wait_time"})
+
+
+def _stable_ids(ids: List[str], old_index: Dict[str, int]) -> set:
+    """Longest run of ids that kept their relative order (LIS over old indices)"""
+    tails: List[int] = []
+    tail_ids: List[int] = []
+    parents: List[int] = [-1] * len(ids)
+    for i, token_id in enumerate(ids):
+        value = old_index[token_id]
+        slot = bisect.bisect_left(tails, value)
+        if slot == len(tails):
+            tails.append(value)
+            tail_ids.append(i)
+        else:
+            tails[slot] = value
+            tail_ids[slot] = i
+        parents[i] = tail_ids[slot - 1] if slot else -1
+    stable = set()
+    i = tail_ids[-1] if tail_ids else -1
+    while i != -1:
+        stable.add(ids[i])
+        i = parents[i]
+    return stable
+
+
+class QueueDeltaTracker:
+    """
+    Turns successive queue views into sequenced delta messages.
+
+    A queue_delta lists the ids removed, the entries inserted, the ids moved
+    to a new position and the changed fields of entries that stayed put, so
+    its size follows the change rather than the queue. Clients apply it by
+    dropping removed and moved ids, inserting moved and inserted entries at
+    their positions in ascending order, merging `updated`, and renumbering.
+    Derived fields are never diffed: after renumbering, clients recompute
+    each row's estimated_wait_time from the latest `wait_model` (sent in
+    snapshots, and in a delta whenever it changes):
+
+        ahead = running total of service_minutes["<category>:<priority_level>"]
+                up to and including the row, minus the row's own
+        estimated_wait_time = round_half_even(ahead / counters)
+
+    Each delta carries `seq`; a client that sees a gap sends
+    {"type": "resync", "since": <last seq>} and gets the missed deltas back
+    from a short history, or a full queue_snapshot when they have expired.
+    """
+
+    def __init__(self, history: int = 64, derived_fields: FrozenSet[str] = DERIVED_FIELDS):
+        self.seq = 0
+        self.derived_fields = derived_fields
+        self._queue: List[Dict[str, Any]] = []
+        self._rows: Dict[str, Dict[str, Any]] = {}
+        self._wait_model: Optional[Dict[str, Any]] = None
+        self._history: Deque[Dict[str, Any]] = deque(maxlen=history)
+
+    def publish(self, queue_data: List[Dict[str, Any]],
+                wait_model: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+        """Record a new queue view; returns its delta message, or None when nothing changed"""
+        queue = list(queue_data)
+        rows = {row["token_id"]: row for row in queue}
+        old_index = {row["token_id"]: index for index, row in enumerate(self._queue)}
+
+        removed = [token_id for token_id in old_index if token_id not in rows]
+        kept = [row["token_id"] for row in queue if row["token_id"] in old_index]
+        stable = _stable_ids(kept, old_index)
+
+        inserted, moved, updated = [], [], []
+        for row in queue:
+            token_id = row["token_id"]
+            previous = self._rows.get(token_id)
+            if previous is None:
+                inserted.append(row)
+                continue
+            if token_id not in stable:
+                moved.append({"token_id": token_id, "position": row["position"]})
+            changes = {
+                field: value for field, value in row.items()
+                if field not in self.derived_fields and previous.get(field) != value
+            }
+            if changes:
+                updated.append({"token_id": token_id, **changes})
+
+        self._queue, self._rows = queue, rows
+        model_changed = wait_model is not None and wait_model != self._wait_model
+        if model_changed:
+            self._wait_model = wait_model
+        if not (removed or inserted or moved or updated or model_changed):
+            return None
+        self.seq += 1
+        delta = {
+            "type": "queue_delta",
+            "seq": self.seq,
+            "removed": removed,
+            "inserted": inserted,
+            "moved": moved,
+            "updated": updated,
+            "total_count": len(queue),
+        }
+        if model_changed:
+            delta["wait_model"] = wait_model
+        self._history.append(delta)
+        return delta
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Full view as of the latest published seq"""
+        snapshot = {"type": "queue_snapshot", "seq": self.seq, "data": self._queue}
+        if self._wait_model is not None:
+            snapshot["wait_model"] = self._wait_model
+        return snapshot
+
+    def row(self, token_id: str) -> Optional[Dict[str, Any]]:
+        """Entry for token_id as of the latest published view, or None when it is not queued"""
+        return self._rows.get(token_id)
+
+    def since(self, seq: int) -> Optional[List[Dict[str, Any]]]:
+        """Deltas published after seq, or None when some of them are no longer buffered"""
+        if seq > self.seq:
+            return None
+        missed = [delta for delta in self._history if delta["seq"] > seq]
+        if len(missed) != self.seq - seq:
+            return None
+        return missed
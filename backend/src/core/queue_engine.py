@@ -0,0 +1,366 @@
+import logging
+import random
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+# Fields kept in memory for every active token; enough to build queue payloads
+QUEUE_ENTRY_FIELDS = (
+    "id",
+    "token_number",
+    "patient_id",
+    "patient_name",
+    "priority_level",
+    "category",
+    "status",
+    "created_at",
+)
+
+def to_timestamp(value: Any) -> float:
+    """Normalise created_at values to a UTC epoch so naive and aware datetimes compare"""
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            # Mongo hands back naive datetimes that are stored as UTC
+            value = value.replace(tzinfo=timezone.utc)
+        return value.timestamp()
+    if isinstance(value, (int, float)):
+        return float(value)
+    return 0.0
+
+def sort_key(priority_level: int, created_at: Any, token_id: str) -> Tuple[int, float, str]:
+    """Queue ordering: priority first (lower value = higher priority), then arrival time"""
+    return (int(priority_level), to_timestamp(created_at), token_id)
+
+
+class _Node:
+    __slots__ = ("key", "next", "width")
+
+    def __init__(self, key, level: int):
+        self.key = key
+        self.next: List[Optional["_Node"]] = [None] * level
+        self.width: List[int] = [1] * level
+
+
+class RankedSkipList:
+    """
+    Indexable skip list: ordered keys with O(log n) insert, remove, rank and select.
+
+    Each forward link stores how many level-0 steps it skips, so rank lookups
+    accumulate widths on the way down instead of walking the list.
+    """
+
+    MAX_LEVEL = 24
+
+    def __init__(self):
+        self._head = _Node(None, self.MAX_LEVEL)
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def __iter__(self) -> Iterator:
+        node = self._head.next[0]
+        while node is not None:
+            yield node.key
+            node = node.next[0]
+
+    def _random_level(self) -> int:
+        level = 1
+        while level < self.MAX_LEVEL and random.random() < 0.5:
+            level += 1
+        return level
+
+    def insert(self, key) -> int:
+        """Insert key and return its 0-based rank"""
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        rank = [0] * self.MAX_LEVEL
+        node = self._head
+        for i in reversed(range(self.MAX_LEVEL)):
+            rank[i] = rank[i + 1] if i + 1 < self.MAX_LEVEL else 0
+            while node.next[i] is not None and node.next[i].key < key:
+                rank[i] += node.width[i]
+                node = node.next[i]
+            update[i] = node
+
+        level = self._random_level()
+        new_node = _Node(key, level)
+        for i in range(self.MAX_LEVEL):
+            if i < level:
+                new_node.next[i] = update[i].next[i]
+                update[i].next[i] = new_node
+                new_node.width[i] = update[i].width[i] - (rank[0] - rank[i])
+                update[i].width[i] = rank[0] - rank[i] + 1
+            else:
+                update[i].width[i] += 1
+
+        self._size += 1
+        return rank[0]
+
+    def remove(self, key) -> int:
+        """Remove key and return the 0-based rank it had; raises KeyError if absent"""
+        update: List[_Node] = [self._head] * self.MAX_LEVEL
+        rank = 0
+        node = self._head
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                rank += node.width[i]
+                node = node.next[i]
+            update[i] = node
+
+        target = update[0].next[0]
+        if target is None or target.key != key:
+            raise KeyError(key)
+
+        for i in range(self.MAX_LEVEL):
+            if update[i].next[i] is target:
+                update[i].width[i] += target.width[i] - 1
+                update[i].next[i] = target.next[i]
+            else:
+                update[i].width[i] -= 1
+
+        self._size -= 1
+        return rank
+
+    def rank(self, key) -> int:
+        """Return the 0-based rank of key; raises KeyError if absent"""
+        rank = 0
+        node = self._head
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.next[i] is not None and node.next[i].key < key:
+                rank += node.width[i]
+                node = node.next[i]
+        node = node.next[0]
+        if node is None or node.key != key:
+            raise KeyError(key)
+        return rank
+
+    def select(self, index: int):
+        """Return the key at 0-based index"""
+        if index < 0:
+            index += self._size
+        if not 0 <= index < self._size:
+            raise IndexError("skip list index out of range")
+        remaining = index + 1
+        node = self._head
+        for i in reversed(range(self.MAX_LEVEL)):
+            while node.next[i] is not None and node.width[i] <= remaining:
+                remaining -= node.width[i]
+                node = node.next[i]
+        return node.key
+
+
+class QueueEngine:
+    """
+    In-memory ranking of active tokens.
+
+    Mongo stays the source of truth; the engine is loaded once at startup and
+    every token mutation is mirrored into it so position lookups never scan
+    the tokens collection. Positions returned are 1-based, matching the API.
+    `version` increases on every mutation so derived views can be cached.
+
+    Ordering uses each entry's effective_priority, which equals priority_level
+    unless an observer (the aging scheduler) promotes a long-waiting token.
+    Observers get tracked(token_id, entry) after a token is added or
+    re-prioritised, untracked(token_id) after removal and cleared() on reset.
+    """
+
+    def __init__(self):
+        self._index = RankedSkipList()
+        self._keys: Dict[str, Tuple[int, float, str]] = {}
+        self._entries: Dict[str, Dict[str, Any]] = {}
+        self._observers: List[Any] = []
+        # One journal per load in progress: token id -> token added meanwhile, or None if removed
+        self._journals: List[Dict[str, Optional[Dict[str, Any]]]] = []
+        self.version = 0
+
+    def add_observer(self, observer):
+        self._observers.append(observer)
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, token_id: str) -> bool:
+        return token_id in self._keys
+
+    def clear(self):
+        self._index = RankedSkipList()
+        self._keys.clear()
+        self._entries.clear()
+        self.version += 1
+        for observer in self._observers:
+            observer.cleared()
+
+    async def load(self, collection) -> int:
+        """
+        Rebuild the engine from every active token in the collection.
+
+        The new index is built off to the side and swapped in at once, so
+        requests served while the cursor drains see the previous queue, not
+        a partial one. Adds and removals made meanwhile are replayed on top.
+        """
+        projection = {field: 1 for field in QUEUE_ENTRY_FIELDS}
+        projection["_id"] = 0
+        journal: Dict[str, Optional[Dict[str, Any]]] = {}
+        self._journals.append(journal)
+        try:
+            tokens = [token async for token in collection.find({"status": "active"}, projection)]
+        finally:
+            self._journals.remove(journal)
+        self._replace(tokens)
+        for token_id, token in journal.items():
+            if token is None:
+                self.remove(token_id)
+            else:
+                self.add(token)
+        logger.info(f"Queue engine loaded {len(self)} active tokens")
+        return len(self)
+
+    def _replace(self, tokens: List[Dict[str, Any]]):
+        index = RankedSkipList()
+        keys: Dict[str, Tuple[int, float, str]] = {}
+        entries: Dict[str, Dict[str, Any]] = {}
+        for token in tokens:
+            token_id = token["id"]
+            if token_id in keys:
+                index.remove(keys[token_id])
+            key = sort_key(token["priority_level"], token.get("created_at"), token_id)
+            keys[token_id] = key
+            entry = {field: token.get(field) for field in QUEUE_ENTRY_FIELDS}
+            entry["effective_priority"] = key[0]
+            entries[token_id] = entry
+            index.insert(key)
+        self._index, self._keys, self._entries = index, keys, entries
+        self.version += 1
+        for observer in self._observers:
+            observer.cleared()
+            # Observers may re-rank (aging), which now applies to the swapped-in index
+            for token_id, entry in list(entries.items()):
+                observer.tracked(token_id, entry)
+
+    def add(self, token: Dict[str, Any]) -> int:
+        """Track an active token and return its queue position"""
+        token_id = token["id"]
+        for journal in self._journals:
+            journal[token_id] = token
+        if token_id in self._keys:
+            self.remove(token_id)
+        key = sort_key(token["priority_level"], token.get("created_at"), token_id)
+        self._keys[token_id] = key
+        entry = {field: token.get(field) for field in QUEUE_ENTRY_FIELDS}
+        entry["effective_priority"] = key[0]
+        self._entries[token_id] = entry
+        self.version += 1
+        position = self._index.insert(key) + 1
+        if self._observers:
+            for observer in self._observers:
+                observer.tracked(token_id, entry)
+            position = self.position(token_id)
+        return position
+
+    def remove(self, token_id: str) -> Optional[int]:
+        """Stop tracking a token; returns the position it held, or None if unknown"""
+        for journal in self._journals:
+            journal[token_id] = None
+        key = self._keys.pop(token_id, None)
+        if key is None:
+            return None
+        self._entries.pop(token_id, None)
+        self.version += 1
+        position = self._index.remove(key) + 1
+        for observer in self._observers:
+            observer.untracked(token_id)
+        return position
+
+    def reprioritize(self, token_id: str, priority_level: int) -> Tuple[Optional[int], Optional[int]]:
+        """Move a token to a new priority class; returns (old_position, new_position)"""
+        key = self._keys.get(token_id)
+        if key is None:
+            return None, None
+        old_position = self._index.remove(key) + 1
+        new_key = (int(priority_level), key[1], key[2])
+        self._keys[token_id] = new_key
+        entry = self._entries[token_id]
+        entry["priority_level"] = entry["effective_priority"] = int(priority_level)
+        for journal in self._journals:
+            journal[token_id] = dict(entry)
+        self.version += 1
+        new_position = self._index.insert(new_key) + 1
+        if self._observers:
+            for observer in self._observers:
+                observer.tracked(token_id, entry)
+            new_position = self.position(token_id)
+        return old_position, new_position
+
+    def set_effective_priority(self, token_id: str, effective_priority: int) -> bool:
+        """Re-rank a token under a different effective class; base priority_level is kept"""
+        key = self._keys.get(token_id)
+        if key is None or key[0] == effective_priority:
+            return False
+        self._index.remove(key)
+        new_key = (int(effective_priority), key[1], key[2])
+        self._keys[token_id] = new_key
+        self._entries[token_id]["effective_priority"] = int(effective_priority)
+        self._index.insert(new_key)
+        self.version += 1
+        return True
+
+    def position(self, token_id: str) -> Optional[int]:
+        key = self._keys.get(token_id)
+        if key is None:
+            return None
+        return self._index.rank(key) + 1
+
+    def entry(self, token_id: str) -> Optional[Dict[str, Any]]:
+        return self._entries.get(token_id)
+
+    def token_at(self, position: int) -> Optional[str]:
+        if not 1 <= position <= len(self._index):
+            return None
+        return self._index.select(position - 1)[2]
+
+    def ordered_ids(self) -> List[str]:
+        return [key[2] for key in self._index]
+
+    def entries(self) -> Iterator[Dict[str, Any]]:
+        """Active token entries in queue order"""
+        for key in self._index:
+            yield self._entries[key[2]]
+
+    def head_ids(self, category: Optional[str] = None, limit: int = 1) -> List[str]:
+        """First `limit` token ids in queue order, optionally restricted to a category"""
+        ids: List[str] = []
+        for key in self._index:
+            if len(ids) >= limit:
+                break
+            if category is None or self._entries[key[2]].get("category") == category:
+                ids.append(key[2])
+        return ids
+
+    async def claim_head(self, collection, update: Dict[str, Any], category: Optional[str] = None,
+                         candidates: int = 5) -> Tuple[Optional[Dict[str, Any]], int]:
+        """
+        Claim the first still-active token in queue order (effective priority, so aging is
+        honoured). The status filter keeps each claim atomic across counters; candidates
+        found claimed or closed elsewhere are dropped from the engine. Returns the claimed
+        token (or None) and how many stale candidates were dropped: None with no stale
+        candidates means nobody is waiting, rather than that the engine fell behind Mongo.
+        """
+        stale = 0
+        for token_id in self.head_ids(category, limit=candidates):
+            token = await collection.find_one_and_update(
+                {"id": token_id, "status": "active"},
+                update,
+                return_document=ReturnDocument.AFTER
+            )
+            if token:
+                return token, stale
+            self.remove(token_id)
+            stale += 1
+        return None, stale
+
+
+# Process-wide engine shared by the API routes
+queue_engine = QueueEngine()
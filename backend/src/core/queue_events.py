@@ -0,0 +1,78 @@
+"""
+Queue and token events shared between workers through the event bus.
+
+Routes publish these after writing Mongo instead of touching the queue
+engine directly; every worker, the publishing one included, applies them
+to its own engine and wait-time estimator, so all replicas rank the queue
+the same way.
+"""
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from src.core.event_bus import Event, event_bus
+from src.core.queue_engine import QUEUE_ENTRY_FIELDS, queue_engine
+from src.core.wait_estimator import wait_estimator
+
+TOKENS_QUEUED = "tokens.queued"
+TOKEN_DEQUEUED = "token.dequeued"
+TOKEN_REPRIORITIZED = "token.reprioritized"
+SERVICE_RECORDED = "service.recorded"
+# Notification only: the token's new state for the patient's and staff screens
+TOKEN_UPDATED = "token.updated"
+# Notification only: a worker rebuilt its engine from Mongo, so screens should refresh
+QUEUE_RELOADED = "queue.reloaded"
+
+QUEUE_CHANGING_EVENTS = {TOKENS_QUEUED, TOKEN_DEQUEUED, TOKEN_REPRIORITIZED, QUEUE_RELOADED}
+
+
+async def tokens_queued(tokens: Iterable[Dict[str, Any]], urgent: bool = False):
+    entries = [{field: token.get(field) for field in QUEUE_ENTRY_FIELDS} for token in tokens]
+    await event_bus.publish(TOKENS_QUEUED, {"tokens": entries, "urgent": urgent})
+
+
+async def token_dequeued(token_id: str):
+    await event_bus.publish(TOKEN_DEQUEUED, {"token_id": token_id})
+
+
+async def token_reprioritized(token_id: str, priority_level: int, urgent: bool = False):
+    await event_bus.publish(TOKEN_REPRIORITIZED, {
+        "token_id": token_id, "priority_level": int(priority_level), "urgent": urgent
+    })
+
+
+async def service_recorded(token: Dict[str, Any], completed_at: datetime):
+    if not token.get("called_at"):
+        return
+    await event_bus.publish(SERVICE_RECORDED, {
+        "category": token.get("category", ""), "called_at": token["called_at"], "completed_at": completed_at
+    })
+
+
+async def token_updated(token_data: Dict[str, Any], user_id: Optional[str] = None):
+    await event_bus.publish(TOKEN_UPDATED, {"data": token_data, "user_id": user_id})
+
+
+async def reload_queue(collection) -> int:
+    """Rebuild this worker's engine from Mongo, then have screens pick up the rebuilt queue"""
+    count = await queue_engine.load(collection)
+    # Urgent: screens and snapshots should not keep the pre-reload view for a coalescing window
+    await event_bus.publish(QUEUE_RELOADED, {"urgent": True})
+    return count
+
+
+async def apply_queue_event(event: Event):
+    payload = event["payload"]
+    event_type = event["type"]
+    if event_type == TOKENS_QUEUED:
+        for entry in payload["tokens"]:
+            queue_engine.add(entry)
+    elif event_type == TOKEN_DEQUEUED:
+        queue_engine.remove(payload["token_id"])
+    elif event_type == TOKEN_REPRIORITIZED:
+        queue_engine.reprioritize(payload["token_id"], payload["priority_level"])
+    elif event_type == SERVICE_RECORDED:
+        wait_estimator.record_service(payload, payload["completed_at"])
+
+
+# Registered first so later subscribers (broadcasts) see the updated engine
+event_bus.subscribe(apply_queue_event)
@@ -0,0 +1,77 @@
+import uuid
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from src.core.encoding import dumps
+
+
+class QueueSnapshotCache:
+    """
+    Pre-serialized GET /queue body, rebuilt at most once per queue version.
+
+    `stamp` returns a value that changes whenever the rendered queue would
+    (engine version, estimator revision, hour). The ETag combines it with a
+    per-process epoch so a restarted worker, whose versions start again from
+    zero, never validates a stale client copy. Polls whose If-None-Match
+    matches are answered with 304 without building or serializing anything.
+    """
+
+    def __init__(self, build: Optional[Callable[[], Any]] = None,
+                 stamp: Optional[Callable[[], Hashable]] = None):
+        self._build = build
+        self._stamp = stamp
+        self.epoch = uuid.uuid4().hex[:8]
+        self._etag: Optional[str] = None
+        self._body: bytes = b""
+        self.builds = 0
+        self.hits = 0
+        self.not_modified = 0
+
+    def configure(self, build: Callable[[], Any], stamp: Callable[[], Hashable]):
+        self._build = build
+        self._stamp = stamp
+        self._etag = None
+
+    def etag(self) -> str:
+        if self._stamp is None:
+            raise RuntimeError("Queue snapshot cache is not configured")
+        version = "-".join(str(part) for part in self._stamp())
+        return f'"{self.epoch}-{version}"'
+
+    @staticmethod
+    def matches(if_none_match: Optional[str], etag: str) -> bool:
+        if not if_none_match:
+            return False
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        # Weak comparison, as RFC 9110 requires for If-None-Match
+        return "*" in candidates or etag in (tag[2:] if tag.startswith("W/") else tag for tag in candidates)
+
+    def body(self, etag: Optional[str] = None) -> bytes:
+        """Serialized snapshot for the current version"""
+        etag = etag or self.etag()
+        if etag != self._etag:
+            self._body = dumps(self._build())
+            self._etag = etag
+            self.builds += 1
+        else:
+            self.hits += 1
+        return self._body
+
+    def check(self, if_none_match: Optional[str]):
+        """Return (etag, body); body is None when the client copy is current"""
+        etag = self.etag()
+        if self.matches(if_none_match, etag):
+            self.not_modified += 1
+            return etag, None
+        return etag, self.body(etag)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "etag": self._etag,
+            "builds": self.builds,
+            "hits": self.hits,
+            "not_modified": self.not_modified,
+        }
+
+
+# Process-wide snapshot of the shared queue engine; each app sets the builder
+queue_snapshot = QueueSnapshotCache()
@@ -0,0 +1,231 @@
+"""
+Token-bucket limits for the password endpoints (login, registration, staff creation).
+
+Each attempt costs a bcrypt hash or verify, so one scripted client could
+keep every password worker busy. Attempts take a token from a bucket per
+client IP and one per email; a bucket refills at a steady rate up to its
+burst size. Checks run before any hashing or user lookup, and a refused
+attempt is always the same 429 whether or not the account exists.
+
+The in-process backend limits each worker on its own. The Mongo backend
+keeps the buckets in one collection, so the limits hold across workers and
+replicas (one atomic update per bucket per attempt).
+
+Behind a reverse proxy or ingress every connection comes from the proxy,
+so one IP bucket would be shared by all clients. client_ip() only looks
+past the peer address when the peer is a listed trusted proxy, and then
+takes the right-most X-Forwarded-For hop that is not itself trusted; the
+hops to its left are whatever the client chose to send. Running uvicorn
+with --proxy-headers --forwarded-allow-ips=<proxy addresses> rewrites the
+peer address the same way, and a rewritten address passes through here
+unchanged. Without trusted proxies the apps leave the IP bucket off by
+default and rely on the per-email bucket.
+"""
+import asyncio
+import hashlib
+import ipaddress
+import math
+import time
+from collections import OrderedDict
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple, Union
+
+from pymongo import ReturnDocument
+
+Network = Union[ipaddress.IPv4Network, ipaddress.IPv6Network]
+
+
+class RateLimited(Exception):
+    """Bucket empty; the app answers 429 with Retry-After"""
+
+    def __init__(self, retry_after: float):
+        super().__init__()
+        self.retry_after = retry_after
+
+
+class InProcessBucketBackend:
+    """Buckets in this worker's memory, least recently used dropped beyond max_keys"""
+
+    def __init__(self, max_keys: int = 100000):
+        self.max_keys = max_keys
+        self._buckets: "OrderedDict[str, Tuple[float, float]]" = OrderedDict()
+        self.evicted = 0
+
+    async def start(self):
+        pass
+
+    async def take(self, key: str, burst: float, per_second: float, now: float) -> Tuple[bool, float]:
+        """Take one token; returns (allowed, tokens left)"""
+        tokens, updated = self._buckets.pop(key, (burst, now))
+        tokens = min(burst, tokens + max(0.0, now - updated) * per_second)
+        allowed = tokens >= 1
+        if allowed:
+            tokens -= 1
+        self._buckets[key] = (tokens, now)
+        if len(self._buckets) > self.max_keys:
+            # A dropped bucket comes back full, which only ever errs towards allowing
+            self._buckets.popitem(last=False)
+            self.evicted += 1
+        return allowed, tokens
+
+    def __len__(self):
+        return len(self._buckets)
+
+
+class MongoBucketBackend:
+    """
+    Buckets shared by every worker through a Mongo collection.
+
+    Refill and take happen in one pipeline update, so concurrent attempts
+    from different workers cannot both spend the last token. A TTL index
+    removes buckets once they would be full again anyway.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    async def start(self):
+        await self._collection.create_index("expires_at", expireAfterSeconds=0)
+
+    async def take(self, key: str, burst: float, per_second: float, now: float) -> Tuple[bool, float]:
+        elapsed = {"$max": [0, {"$subtract": [now, {"$ifNull": ["$updated", now]}]}]}
+        refilled = {"$min": [burst, {"$add": [{"$ifNull": ["$tokens", burst]}, {"$multiply": [elapsed, per_second]}]}]}
+        full_at = datetime.fromtimestamp(now + burst / per_second, timezone.utc)
+        doc = await self._collection.find_one_and_update(
+            {"_id": key},
+            [
+                {"$set": {"refilled": refilled}},
+                {"$set": {
+                    "allowed": {"$gte": ["$refilled", 1]},
+                    "tokens": {"$cond": [{"$gte": ["$refilled", 1]}, {"$subtract": ["$refilled", 1]}, "$refilled"]},
+                    "updated": now,
+                    "expires_at": full_at,
+                }},
+                {"$project": {"refilled": 0}},
+            ],
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        return doc["allowed"], doc["tokens"]
+
+
+def email_key(email: str) -> str:
+    """Bucket key for an address; the shared store never holds the address itself"""
+    return hashlib.sha256(email.strip().lower().encode("utf-8")).hexdigest()[:32]
+
+
+def parse_networks(spec: str) -> List[Network]:
+    """Comma-separated addresses or CIDR ranges, e.g. TRUSTED_PROXIES=10.0.0.0/8,127.0.0.1"""
+    return [ipaddress.ip_network(part.strip(), strict=False) for part in spec.split(",") if part.strip()]
+
+
+class RateLimiter:
+    def __init__(self, backend=None, ip_burst: float = 20, ip_per_minute: float = 10,
+                 email_burst: float = 5, email_per_minute: float = 2,
+                 trusted_proxies: Iterable[Network] = (),
+                 clock: Callable[[], float] = time.time):
+        self.backend = backend or InProcessBucketBackend()
+        self.trusted_proxies = list(trusted_proxies)
+        self.ip_burst = ip_burst
+        self.ip_per_minute = ip_per_minute
+        self.email_burst = email_burst
+        self.email_per_minute = email_per_minute
+        self._clock = clock
+        self.stats = {"allowed": 0, "rejected": 0, "rejected_ip": 0, "rejected_email": 0, "backend_errors": 0}
+
+    def configure(self, backend=None, ip_burst: Optional[float] = None, ip_per_minute: Optional[float] = None,
+                  email_burst: Optional[float] = None, email_per_minute: Optional[float] = None,
+                  trusted_proxies: Optional[Iterable[Network]] = None):
+        """A burst or rate of 0 switches that limit off"""
+        if backend is not None:
+            self.backend = backend
+        if trusted_proxies is not None:
+            self.trusted_proxies = list(trusted_proxies)
+        if ip_burst is not None:
+            self.ip_burst = ip_burst
+        if ip_per_minute is not None:
+            self.ip_per_minute = ip_per_minute
+        if email_burst is not None:
+            self.email_burst = email_burst
+        if email_per_minute is not None:
+            self.email_per_minute = email_per_minute
+
+    async def start(self):
+        await self.backend.start()
+
+    def _trusted(self, address: str) -> bool:
+        try:
+            ip = ipaddress.ip_address(address)
+        except ValueError:
+            return False
+        return any(ip in network for network in self.trusted_proxies)
+
+    def client_ip(self, peer: Optional[str], forwarded_for: Optional[str] = None) -> Optional[str]:
+        """The address to limit: the peer, or the nearest untrusted X-Forwarded-For hop behind trusted proxies"""
+        if peer is None or not self._trusted(peer):
+            return peer
+        hops = [hop.strip() for hop in (forwarded_for or "").split(",") if hop.strip()]
+        for hop in reversed(hops):
+            if not self._trusted(hop):
+                return hop
+        # Every hop is trusted: only the right-most was written by a proxy, the rest may be
+        # the client's own invention, so never key on them
+        return hops[-1] if hops else peer
+
+    async def _take(self, key: str, burst: float, per_minute: float, now: float) -> Optional[float]:
+        """Seconds until the bucket has a token again, or None when the attempt may go ahead"""
+        per_second = per_minute / 60
+        try:
+            allowed, tokens = await self.backend.take(key, burst, per_second, now)
+        except Exception:
+            # A store outage must not lock everyone out; the password pool cap still applies
+            self.stats["backend_errors"] += 1
+            return None
+        return None if allowed else (1 - tokens) / per_second
+
+    async def check(self, ip: Optional[str], email: Optional[str] = None):
+        """Spend one attempt for this client and address; raises RateLimited when either is used up"""
+        now = self._clock()
+        checks = {}
+        if ip and self.ip_burst and self.ip_per_minute:
+            checks["ip"] = self._take(f"ip:{ip}", self.ip_burst, self.ip_per_minute, now)
+        if email and self.email_burst and self.email_per_minute:
+            checks["email"] = self._take(f"email:{email_key(email)}", self.email_burst, self.email_per_minute, now)
+        # Both buckets are always charged, so the refusal looks the same whichever one ran out
+        waits = dict(zip(checks, await asyncio.gather(*checks.values())))
+        refused = {name: wait for name, wait in waits.items() if wait is not None}
+        if not refused:
+            self.stats["allowed"] += 1
+            return
+        self.stats["rejected"] += 1
+        for name in refused:
+            self.stats[f"rejected_{name}"] += 1
+        raise RateLimited(max(refused.values()))
+
+    def counts(self) -> Dict[str, Any]:
+        backend = self.backend
+        return {
+            "backend": "memory" if isinstance(backend, InProcessBucketBackend) else "mongo",
+            "buckets": len(backend) if isinstance(backend, InProcessBucketBackend) else None,
+            "evicted": getattr(backend, "evicted", 0),
+            "ip_burst": self.ip_burst,
+            "ip_per_minute": self.ip_per_minute,
+            "email_burst": self.email_burst,
+            "email_per_minute": self.email_per_minute,
+            "trusted_proxies": [str(network) for network in self.trusted_proxies],
+            **self.stats,
+        }
+
+
+def retry_after_header(exc: RateLimited) -> str:
+    return str(max(1, math.ceil(exc.retry_after)))
+
+
+def request_client_ip(request) -> Optional[str]:
+    """Client address of a Starlette request or WebSocket, as the process-wide limiter resolves it"""
+    peer = request.client.host if request.client else None
+    return rate_limiter.client_ip(peer, ",".join(request.headers.getlist("x-forwarded-for")))
+
+
+# Process-wide limiter shared by both apps' password routes
+rate_limiter = RateLimiter()
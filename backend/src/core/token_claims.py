@@ -0,0 +1,110 @@
+"""
+Authorization from verified JWT claims, without loading the user.
+
+Access tokens carry the user's role, name and contact details. While a
+token is younger than max_age_seconds those claims are trusted as signed,
+so a role-gated request costs one signature check. Older tokens, and
+tokens issued before the claims were added, go through the cached user
+lookup, which sees the stored role and active flag. The claims window is
+the short lifetime; the token itself stays valid as long as before.
+
+A user changed inside that window (deactivated, role or profile edited)
+must not keep acting on claims issued before the change. USER_CHANGED
+events record when each user last changed, and tokens issued up to then
+take the lookup path instead. Only changes younger than the window are
+kept, so the list stays a handful of ids; at startup, and after an event
+bus gap, it is rebuilt from the users' updated_at.
+
+The events only reach other workers and replicas over EVENT_BUS_BACKEND=mongo;
+the in-process bus supports exactly one backend process (see event_bus).
+"""
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Optional
+
+from src.core.event_bus import Event, event_bus
+from src.core.principal_cache import USER_CHANGED
+
+# Claims a token needs before it can stand in for the user document
+REQUIRED_CLAIMS = ("sub", "iat", "role", "name", "email")
+
+
+def principal_claims(user: Dict[str, Any]) -> Dict[str, Any]:
+    """Claims to sign into an access token for this user"""
+    return {
+        "role": getattr(user.get("role"), "value", user.get("role")),
+        "name": user.get("name") or user.get("full_name", ""),
+        "email": user.get("email"),
+        "phone": user.get("phone", ""),
+    }
+
+
+class TokenClaims:
+    def __init__(self, max_age_seconds: float = 900, clock: Callable[[], float] = time.time):
+        self.max_age_seconds = max_age_seconds
+        self._clock = clock
+        # user id -> time of the user's last change, only while younger than max_age_seconds
+        self._changed: Dict[str, float] = {}
+        self.stats = {"claims": 0, "lookups": 0, "changed": 0}
+
+    def configure(self, max_age_seconds: Optional[float] = None):
+        """A max age of 0 sends every request through the user lookup"""
+        if max_age_seconds is not None:
+            self.max_age_seconds = max_age_seconds
+
+    def principal(self, payload: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """The user as signed in the token, or None when the caller must look the user up"""
+        now = self._clock()
+        user_id = payload.get("sub")
+        issued_at = payload.get("iat")
+        if (not self.max_age_seconds or any(payload.get(claim) is None for claim in REQUIRED_CLAIMS)
+                or now - issued_at > self.max_age_seconds
+                or issued_at <= self._changed.get(user_id, float("-inf"))):
+            self.stats["lookups"] += 1
+            return None
+        self.stats["claims"] += 1
+        return {
+            "id": user_id,
+            "role": payload["role"],
+            "name": payload["name"],
+            "email": payload["email"],
+            "phone": payload.get("phone", ""),
+        }
+
+    def changed(self, user_id: str, changed_at: Optional[float] = None):
+        self._prune()
+        changed_at = changed_at if changed_at is not None else self._clock()
+        self._changed[user_id] = max(changed_at, self._changed.get(user_id, changed_at))
+        self.stats["changed"] += 1
+
+    def _prune(self):
+        cutoff = self._clock() - self.max_age_seconds
+        for user_id in [user_id for user_id, at in self._changed.items() if at < cutoff]:
+            del self._changed[user_id]
+
+    async def load(self, users):
+        """Rebuild the change list from users updated within the claims window"""
+        since = datetime.fromtimestamp(self._clock() - self.max_age_seconds, timezone.utc)
+        self._changed.clear()
+        async for user in users.find({"updated_at": {"$gte": since}}, {"id": 1, "updated_at": 1}):
+            if "id" not in user:
+                continue
+            updated_at = user["updated_at"]
+            if updated_at.tzinfo is None:
+                updated_at = updated_at.replace(tzinfo=timezone.utc)
+            self.changed(user["id"], updated_at.timestamp())
+
+    def counts(self) -> Dict[str, Any]:
+        self._prune()
+        return {"max_age_seconds": self.max_age_seconds, "recently_changed": len(self._changed), **self.stats}
+
+
+async def apply_user_event(event: Event):
+    if event["type"] == USER_CHANGED:
+        payload = event["payload"]
+        token_claims.changed(payload["user_id"], payload.get("changed_at"))
+
+
+# Process-wide; each app sets the claims window
+token_claims = TokenClaims()
+event_bus.subscribe(apply_user_event)
@@ -0,0 +1,95 @@
+import asyncio
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from pymongo import ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BLOCK_SIZE = 20
+
+
+class TokenNumberSequencer:
+    """
+    Collision-free daily token numbers ("E-001-031025").
+
+    One counter document per (prefix, day) is advanced with a single atomic
+    find_one_and_update($inc). Each worker reserves a block of numbers at a
+    time and hands them out locally, so most calls never touch Mongo. Numbers
+    are unique across workers and increase monotonically within a worker;
+    numbers left in a block when a worker stops are skipped, never reused.
+    """
+
+    def __init__(self, collection=None, block_size: int = DEFAULT_BLOCK_SIZE):
+        self._collection = collection
+        self.block_size = max(1, block_size)
+        # counter key -> (next value to hand out, last value reserved)
+        self._blocks: Dict[str, Tuple[int, int]] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+
+    def configure(self, collection, block_size: Optional[int] = None):
+        self._collection = collection
+        if block_size is not None:
+            self.block_size = max(1, block_size)
+        self._blocks.clear()
+
+    @staticmethod
+    def day_key(now: Optional[datetime] = None) -> str:
+        return (now or datetime.now()).strftime("%d%m%y")
+
+    async def _reserve(self, key: str, count: int) -> Tuple[int, int]:
+        """Atomically reserve `count` numbers for key; returns (first, last)"""
+        if self._collection is None:
+            raise RuntimeError("Token sequencer is not bound to a collection")
+        counter = await self._collection.find_one_and_update(
+            {"_id": key},
+            {"$inc": {"value": count}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        last = counter["value"]
+        return last - count + 1, last
+
+    async def next_values(self, prefix: str, count: int = 1, now: Optional[datetime] = None) -> List[int]:
+        """Hand out `count` sequence numbers for prefix on the given day"""
+        day = self.day_key(now)
+        key = f"{prefix}-{day}"
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            values: List[int] = []
+            next_value, last = self._blocks.get(key, (1, 0))
+            while len(values) < count:
+                if next_value > last:
+                    needed = count - len(values)
+                    next_value, last = await self._reserve(key, max(needed, self.block_size))
+                take = min(count - len(values), last - next_value + 1)
+                values.extend(range(next_value, next_value + take))
+                next_value += take
+            self._blocks[key] = (next_value, last)
+            self._prune(day)
+            return values
+
+    def _prune(self, day: str):
+        """Forget blocks reserved for previous days"""
+        for stale in [key for key in self._blocks if not key.endswith(day)]:
+            self._blocks.pop(stale, None)
+            self._locks.pop(stale, None)
+
+    @staticmethod
+    def format(prefix: str, value: int, day: str) -> str:
+        return f"{prefix}-{value:03d}-{day}"
+
+    async def next_token_number(self, prefix: str, now: Optional[datetime] = None) -> str:
+        return (await self.next_token_numbers(prefix, 1, now))[0]
+
+    async def next_token_numbers(self, prefix: str, count: int, now: Optional[datetime] = None) -> List[str]:
+        # One clock reading for counter and suffix, or a call across midnight would format
+        # the new day's counter with yesterday's date
+        now = now or datetime.now()
+        day = self.day_key(now)
+        return [self.format(prefix, value, day) for value in await self.next_values(prefix, count, now)]
+
+
+# Process-wide sequencer; bound to the token_counters collection at startup
+token_sequencer = TokenNumberSequencer()
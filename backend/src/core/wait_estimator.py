@@ -0,0 +1,249 @@
+import logging
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ANY_HOUR = -1
+
+
+def _as_utc(value: datetime) -> datetime:
+    # Mongo hands back naive datetimes that are stored as UTC
+    return value.replace(tzinfo=timezone.utc) if value.tzinfo is None else value
+
+
+class P2Quantile:
+    """
+    Streaming quantile estimate (Jain & Chlamtac P-square) in constant memory.
+
+    Five markers track the minimum, the target quantile, the maximum and two
+    midpoints; marker heights are adjusted with a parabolic fit as samples arrive.
+    """
+
+    __slots__ = ("p", "count", "_heights", "_positions", "_desired", "_increments")
+
+    def __init__(self, p: float):
+        self.p = p
+        self.count = 0
+        self._heights: List[float] = []
+        self._positions = [0.0, 1.0, 2.0, 3.0, 4.0]
+        self._desired = [0.0, 2 * p, 4 * p, 2 + 2 * p, 4.0]
+        self._increments = [0.0, p / 2, p, (1 + p) / 2, 1.0]
+
+    def add(self, x: float):
+        self.count += 1
+        heights = self._heights
+        if self.count <= 5:
+            heights.append(x)
+            heights.sort()
+            return
+
+        if x < heights[0]:
+            heights[0] = x
+            k = 0
+        elif x >= heights[4]:
+            heights[4] = x
+            k = 3
+        else:
+            k = 0
+            while not heights[k] <= x < heights[k + 1]:
+                k += 1
+
+        positions = self._positions
+        for i in range(k + 1, 5):
+            positions[i] += 1
+        for i in range(5):
+            self._desired[i] += self._increments[i]
+
+        for i in (1, 2, 3):
+            d = self._desired[i] - positions[i]
+            if (d >= 1 and positions[i + 1] - positions[i] > 1) or (d <= -1 and positions[i - 1] - positions[i] < -1):
+                step = 1 if d > 0 else -1
+                candidate = self._parabolic(i, step)
+                if heights[i - 1] < candidate < heights[i + 1]:
+                    heights[i] = candidate
+                else:
+                    heights[i] += step * (heights[i + step] - heights[i]) / (positions[i + step] - positions[i])
+                positions[i] += step
+
+    def _parabolic(self, i: int, step: int) -> float:
+        q, n = self._heights, self._positions
+        return q[i] + step / (n[i + 1] - n[i - 1]) * (
+            (n[i] - n[i - 1] + step) * (q[i + 1] - q[i]) / (n[i + 1] - n[i])
+            + (n[i + 1] - n[i] - step) * (q[i] - q[i - 1]) / (n[i] - n[i - 1])
+        )
+
+    def value(self) -> Optional[float]:
+        if not self._heights:
+            return None
+        if self.count <= 5:
+            return self._heights[round(self.p * (len(self._heights) - 1))]
+        return self._heights[2]
+
+
+class ServiceTimeBucket:
+    """Running service-time statistics for one (category, hour) bucket"""
+
+    __slots__ = ("count", "ewma", "median", "p90")
+
+    def __init__(self):
+        self.count = 0
+        self.ewma = 0.0
+        self.median = P2Quantile(0.5)
+        self.p90 = P2Quantile(0.9)
+
+    def add(self, minutes: float, alpha: float):
+        self.count += 1
+        self.ewma = minutes if self.count == 1 else alpha * minutes + (1 - alpha) * self.ewma
+        self.median.add(minutes)
+        self.p90.add(minutes)
+
+    def summary(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "ewma_minutes": round(self.ewma, 2),
+            "p50_minutes": round(self.median.value() or 0.0, 2),
+            "p90_minutes": round(self.p90.value() or 0.0, 2),
+        }
+
+
+class WaitTimeEstimator:
+    """
+    Wait-time estimates learned from observed service durations (call -> complete).
+
+    Durations feed an EWMA plus p50/p90 sketches per category and per hour of
+    day, O(1) memory per bucket. A token's estimate is the expected service
+    time of everyone ahead of it divided by the number of counters, computed
+    for the whole queue in one numpy pass and cached until the queue, the
+    observations or the hour change. Buckets with too few samples fall back to
+    the category-wide bucket and then to the static per-priority table.
+    """
+
+    def __init__(self, priors: Optional[Dict[int, float]] = None, alpha: float = 0.2,
+                 min_samples: int = 5, counters: int = 1):
+        self.priors: Dict[int, float] = {int(k): float(v) for k, v in (priors or {}).items()}
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.counters = max(1, counters)
+        self._buckets: Dict[Tuple[str, int], ServiceTimeBucket] = {}
+        self._revision = 0
+        self._cache_stamp: Optional[Tuple[int, int, int]] = None
+        self._cache: Dict[str, int] = {}
+        self._model: Dict[str, Any] = {"counters": self.counters, "service_minutes": {}}
+
+    def configure(self, priors: Optional[Dict[int, float]] = None, counters: Optional[int] = None):
+        if priors is not None:
+            self.priors = {int(k): float(v) for k, v in priors.items()}
+        if counters is not None:
+            self.counters = max(1, counters)
+        self._revision += 1
+
+    @staticmethod
+    def hour_of(at: Optional[datetime] = None) -> int:
+        return _as_utc(at).astimezone().hour if at else datetime.now().hour
+
+    def record(self, category: str, minutes: float, at: Optional[datetime] = None):
+        if minutes < 0:
+            return
+        hour = self.hour_of(at)
+        for key in ((category, hour), (category, ANY_HOUR)):
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = self._buckets[key] = ServiceTimeBucket()
+            bucket.add(minutes, self.alpha)
+        self._revision += 1
+
+    def record_service(self, token: Dict[str, Any], completed_at: datetime) -> Optional[float]:
+        """Record the call-to-complete duration of a served token; returns minutes"""
+        called_at = token.get("called_at")
+        if not called_at:
+            return None
+        minutes = (_as_utc(completed_at) - _as_utc(called_at)).total_seconds() / 60
+        self.record(token.get("category", ""), minutes, called_at)
+        return minutes
+
+    async def warm(self, collection, limit: int = 500) -> int:
+        """Seed the buckets from recently served tokens so restarts keep their estimates"""
+        cursor = collection.find(
+            {"status": "completed", "called_at": {"$ne": None}},
+            {"category": 1, "called_at": 1, "updated_at": 1, "_id": 0}
+        ).sort("updated_at", -1).limit(limit)
+        served = await cursor.to_list(limit)
+        for token in reversed(served):
+            self.record_service(token, token["updated_at"])
+        logger.info(f"Wait-time estimator warmed with {len(served)} service samples")
+        return len(served)
+
+    def expected_service(self, category: str, priority_level: int, hour: int) -> float:
+        for key in ((category, hour), (category, ANY_HOUR)):
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket.count >= self.min_samples:
+                return bucket.ewma
+        return self.priors.get(int(priority_level), 0.0)
+
+    def estimate(self, entries: Sequence[Dict[str, Any]], now: Optional[datetime] = None) -> np.ndarray:
+        """Estimated wait in minutes for each entry of an ordered queue"""
+        if not entries:
+            return np.zeros(0)
+        hour = self.hour_of(now)
+        # Only a handful of distinct (category, priority) pairs; look each up once
+        lookup: Dict[Tuple[str, int], int] = {}
+        codes = np.fromiter(
+            (lookup.setdefault((e.get("category") or "", int(e["priority_level"])), len(lookup)) for e in entries),
+            dtype=np.int64,
+            count=len(entries),
+        )
+        table = np.array([self.expected_service(c, p, hour) for c, p in lookup])
+        service = table[codes]
+        ahead = np.cumsum(service) - service
+        return ahead / self.counters
+
+    def stamp(self, engine, now: Optional[datetime] = None) -> Tuple[int, int, int]:
+        """Changes whenever the queue's estimates would change"""
+        return engine.version, self._revision, self.hour_of(now)
+
+    def queue_estimates(self, engine, now: Optional[datetime] = None) -> Dict[str, int]:
+        """Estimated wait per token id for the engine's queue, recomputed only when stale"""
+        self._refresh(engine, now)
+        return self._cache
+
+    def wait_model(self, engine, now: Optional[datetime] = None) -> Dict[str, Any]:
+        """
+        What a client needs to recompute queue_estimates itself: the counter count and the
+        expected service minutes per "<category>:<priority_level>" class in the queue
+        """
+        self._refresh(engine, now)
+        return self._model
+
+    def _refresh(self, engine, now: Optional[datetime]):
+        stamp = self.stamp(engine, now)
+        if stamp != self._cache_stamp:
+            entries = list(engine.entries())
+            waits = np.rint(self.estimate(entries, now)).astype(int)
+            self._cache = {entry["id"]: int(wait) for entry, wait in zip(entries, waits)}
+            hour = self.hour_of(now)
+            classes = {(entry.get("category") or "", int(entry["priority_level"])) for entry in entries}
+            self._model = {
+                "counters": self.counters,
+                "service_minutes": {
+                    f"{category}:{priority}": self.expected_service(category, priority, hour)
+                    for category, priority in sorted(classes)
+                },
+            }
+            self._cache_stamp = stamp
+
+    def stats(self) -> Dict[str, Any]:
+        categories: Dict[str, Any] = {}
+        for (category, hour), bucket in sorted(self._buckets.items()):
+            summary = bucket.summary()
+            if hour == ANY_HOUR:
+                categories.setdefault(category, {"hours": {}}).update(summary)
+            else:
+                categories.setdefault(category, {"hours": {}})["hours"][hour] = summary
+        return {"counters": self.counters, "categories": categories}
+
+
+# Process-wide estimator; priors and counter count are set by the app
+wait_estimator = WaitTimeEstimator()
@@ -24,6 +24,13 @@ async def connect_to_mongo():
         await db.client.admin.command('ping')
         # Cache the database handle
         db.db = db.client[settings.MONGODB_DB_NAME]
+        # The only guard against concurrent duplicate active tokens; failing here fails startup
+        await db.db.tokens.create_index(
+            [("patient_id", 1), ("status", 1)],
+            name="active_token_per_patient",
+            unique=True,
+            partialFilterExpression={"status": "active"}
+        )
         # Create minimal required indexes
         try:
             await db.db.users.create_index("email", unique=True)
@@ -33,6 +40,7 @@ async def connect_to_mongo():
             await db.db.tokens.create_index("status")
             await db.db.tokens.create_index("priority_level")
             await db.db.tokens.create_index("created_at")
+            await db.db.tokens.create_index([("status", 1), ("priority_level", 1), ("created_at", 1)])
         except Exception as ie:
             logging.warning(f"Index creation warning: {str(ie)}")
         logging.info("Successfully connected to MongoDB")
@@ -1,9 +1,19 @@
+import asyncio
 import logging
 from fastapi import FastAPI
+from fastapi.responses import JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from src.core.config import settings
 from src.api.v1.router import api_router
-from src.db.mongodb import connect_to_mongo, close_mongo_connection
+from src.db.mongodb import connect_to_mongo, close_mongo_connection, get_database
+from src.core.event_bus import event_bus, MongoChangeStreamBackend
+from src.core.password_hasher import PasswordHasherBusy, password_hasher
+from src.core.priority_aging import priority_aging
+from src.core.queue_engine import queue_engine
+from src.core.rate_limiter import MongoBucketBackend, RateLimited, parse_networks, rate_limiter, retry_after_header
+from src.core.token_claims import token_claims
+from src.core.token_sequencer import token_sequencer
+from src.core.wait_estimator import wait_estimator
 
 # Configure logging
 logging.basicConfig(
@@ -37,6 +47,30 @@ app.add_middleware(
     expose_headers=["Content-Type"]
 )
 
+password_hasher.configure(
+    workers=settings.PASSWORD_HASH_WORKERS,
+    max_pending=settings.PASSWORD_HASH_MAX_PENDING,
+    rounds=settings.PASSWORD_HASH_ROUNDS,
+    target_ms=settings.PASSWORD_HASH_TARGET_MS
+)
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy(request, exc: PasswordHasherBusy):
+    return JSONResponse(status_code=503, content={"detail": "Server busy, please retry"}, headers={"Retry-After": "1"})
+
+rate_limiter.configure(
+    trusted_proxies=parse_networks(settings.TRUSTED_PROXIES),
+    ip_burst=settings.RATE_LIMIT_IP_BURST,
+    ip_per_minute=settings.RATE_LIMIT_IP_PER_MINUTE,
+    email_burst=settings.RATE_LIMIT_EMAIL_BURST,
+    email_per_minute=settings.RATE_LIMIT_EMAIL_PER_MINUTE
+)
+
+@app.exception_handler(RateLimited)
+async def rate_limited(request, exc: RateLimited):
+    return JSONResponse(status_code=429, content={"detail": "Too many attempts, please retry later"},
+                        headers={"Retry-After": retry_after_header(exc)})
+
 # Include the API router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
@@ -44,9 +78,30 @@ app.include_router(api_router, prefix=settings.API_V1_STR)
 @app.on_event("startup")
 async def startup_db_client():
     await connect_to_mongo()
+    database = await get_database()
+    await queue_engine.load(database.tokens)
+    await wait_estimator.warm(database.tokens)
+    token_sequencer.configure(database.token_counters, settings.TOKEN_SEQUENCE_BLOCK_SIZE)
+    await token_claims.load(database.users)
+    if settings.RATE_LIMIT_BACKEND == "mongo":
+        rate_limiter.configure(backend=MongoBucketBackend(database.rate_limits))
+        await rate_limiter.start()
+    if settings.EVENT_BUS_BACKEND == "mongo":
+        event_bus.configure(MongoChangeStreamBackend(database.queue_events, settings.EVENT_BUS_TTL_SECONDS))
+        # Rebuild from Mongo whenever events from other workers may have been missed
+        event_bus.on_gap(lambda: queue_events.reload_queue(database.tokens))
+        event_bus.on_gap(lambda: token_claims.load(database.users))
+    event_bus.check_workers(settings.WEB_CONCURRENCY)
+    await event_bus.start()
+    app.state.priority_aging_task = asyncio.create_task(priority_aging.run(settings.PRIORITY_AGING_INTERVAL))
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    task = getattr(app.state, "priority_aging_task", None)
+    if task:
+        task.cancel()
+    await event_bus.stop()
+    password_hasher.shutdown()
     await close_mongo_connection()
 
 @app.get("/")
@@ -0,0 +1,138 @@
+import asyncio
+import uuid
+from typing import Any, AsyncIterator, Dict, FrozenSet, List, Optional, Set
+
+from src.core.encoding import dumps
+from src.core.queue_delta import QueueDeltaTracker
+from src.websocket_manager import manager
+
+# Queued in place of deltas when a stream fell behind: send a fresh snapshot
+RESYNC = object()
+
+
+def project_rows(rows: List[Dict[str, Any]], fields: Optional[FrozenSet[str]]) -> List[Dict[str, Any]]:
+    if fields is None:
+        return rows
+    return [{field: value for field, value in row.items() if field == "token_id" or field in fields} for row in rows]
+
+
+def project(message: Dict[str, Any], fields: Optional[FrozenSet[str]]) -> Dict[str, Any]:
+    """Strip a queue_snapshot/queue_delta down to token_id plus the requested fields"""
+    if fields is None:
+        return message
+    if message["type"] == "queue_snapshot":
+        return {**message, "data": project_rows(message["data"], fields)}
+    updated = [row for row in project_rows(message["updated"], fields) if len(row) > 1]
+    moved = message["moved"] if "position" in fields else []
+    return {
+        **message,
+        "inserted": project_rows(message["inserted"], fields),
+        "moved": moved,
+        "updated": updated,
+    }
+
+
+class QueueStream:
+    """One SSE client: a bounded queue of encoded events, collapsing to a resync when it overflows"""
+
+    def __init__(self, fields: Optional[FrozenSet[str]], max_queue: int):
+        self.fields = fields
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+
+    def offer(self, event: bytes):
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(RESYNC)
+
+
+class QueueStreamHub:
+    """
+    Server-Sent Events feed of the queue for read-only screens.
+
+    Streams carry the same sequenced queue_snapshot/queue_delta messages
+    staff sockets get, published from the same flushes. The event id is
+    "<epoch>-<seq>"; a reconnect with Last-Event-ID from this process replays
+    the missed deltas, anything else (expired history, another worker behind
+    the load balancer, a restart) starts over from a snapshot. Streams asking
+    for the same fields share one projection and encoding per delta.
+    """
+
+    def __init__(self, deltas: QueueDeltaTracker, max_queue: int = 64, keepalive: float = 15.0,
+                 retry_ms: int = 3000):
+        self.deltas = deltas
+        self.max_queue = max_queue
+        self.keepalive = keepalive
+        self.retry_ms = retry_ms
+        self.epoch = uuid.uuid4().hex[:8]
+        self.streams: Set[QueueStream] = set()
+        self.stats = {"opened": 0, "resumed": 0, "resyncs": 0, "events": 0}
+
+    def configure(self, max_queue: Optional[int] = None, keepalive: Optional[float] = None):
+        if max_queue is not None:
+            self.max_queue = max_queue
+        if keepalive is not None:
+            self.keepalive = keepalive
+
+    def event(self, message: Dict[str, Any], fields: Optional[FrozenSet[str]]) -> bytes:
+        body = dumps(project(message, fields))
+        return b"id: %s-%d\nevent: %s\ndata: %s\n\n" % (
+            self.epoch.encode(), message["seq"], message["type"].encode(), body
+        )
+
+    def publish(self, delta: Dict[str, Any]):
+        """Hand a freshly published delta to every open stream"""
+        encoded: Dict[Optional[FrozenSet[str]], bytes] = {}
+        for stream in list(self.streams):
+            if stream.fields not in encoded:
+                encoded[stream.fields] = self.event(delta, stream.fields)
+            stream.offer(encoded[stream.fields])
+            self.stats["events"] += 1
+
+    def _resume_from(self, last_event_id: Optional[str]) -> Optional[List[Dict[str, Any]]]:
+        if not last_event_id:
+            return None
+        epoch, _, seq = last_event_id.partition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return None
+        return self.deltas.since(int(seq))
+
+    async def events(self, last_event_id: Optional[str] = None,
+                     fields: Optional[FrozenSet[str]] = None) -> AsyncIterator[bytes]:
+        stream = QueueStream(fields, self.max_queue)
+        # Registered in the same step that reads history, so no delta is missed or repeated
+        self.streams.add(stream)
+        self.stats["opened"] += 1
+        missed = self._resume_from(last_event_id)
+        if missed is None:
+            initial = [self.event(self.deltas.snapshot(), fields)]
+        else:
+            self.stats["resumed"] += 1
+            initial = [self.event(delta, fields) for delta in missed]
+        try:
+            yield b"retry: %d\n\n" % self.retry_ms
+            for event in initial:
+                yield event
+            while True:
+                try:
+                    event = await asyncio.wait_for(stream.queue.get(), self.keepalive)
+                except asyncio.TimeoutError:
+                    # Comment line: keeps proxies and load balancers from closing an idle stream
+                    yield b": keepalive\n\n"
+                    continue
+                if event is RESYNC:
+                    self.stats["resyncs"] += 1
+                    event = self.event(self.deltas.snapshot(), fields)
+                yield event
+        finally:
+            self.streams.discard(stream)
+
+    def counts(self) -> Dict[str, Any]:
+        return {"open": len(self.streams), **self.stats}
+
+
+# Fed from the WebSocket manager's delta tracker, so both transports share one seq
+queue_stream = QueueStreamHub(manager.queue_deltas)
+manager.add_delta_listener(queue_stream.publish)
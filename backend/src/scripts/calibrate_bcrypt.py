@@ -0,0 +1,51 @@
+"""
+Measure bcrypt hash time per cost on this host and recommend a cost.
+
+Run it on the same CPU class the pods use; put the recommendation in
+PASSWORD_HASH_ROUNDS (or set PASSWORD_HASH_TARGET_MS and let each worker
+pick the cost at startup). Existing hashes move to the new cost as users
+log in.
+
+    python -m src.scripts.calibrate_bcrypt --target-ms 100
+    python -m src.scripts.calibrate_bcrypt --target-ms 250 --max-rounds 14 --samples 5 --output bcrypt.json
+"""
+import argparse
+import json
+import os
+
+from src.core.password_hasher import MAX_ROUNDS, MIN_ROUNDS, measure_cost
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time bcrypt costs on this host")
+    parser.add_argument("--target-ms", type=float, default=100.0, help="desired milliseconds per hash")
+    parser.add_argument("--min-rounds", type=int, default=MIN_ROUNDS)
+    parser.add_argument("--max-rounds", type=int, default=MAX_ROUNDS)
+    parser.add_argument("--samples", type=int, default=3, help="hashes timed per cost (median is used)")
+    parser.add_argument("--output", help="write the report as JSON here")
+    args = parser.parse_args()
+
+    timings = {}
+    for rounds in range(args.min_rounds, args.max_rounds + 1):
+        timings[rounds] = round(measure_cost(rounds, args.samples), 2)
+        print(f"cost {rounds:2d}: {timings[rounds]:9.2f} ms")
+        if timings[rounds] > args.target_ms * 4:
+            # Every further cost doubles again; no need to sit through them
+            break
+
+    recommended = min(timings, key=lambda rounds: abs(timings[rounds] - args.target_ms))
+    report = {
+        "target_ms": args.target_ms,
+        "cpu_count": os.cpu_count(),
+        "timings_ms": timings,
+        "recommended_rounds": recommended,
+        "recommended_ms": timings[recommended],
+    }
+    print(f"\nRecommended: PASSWORD_HASH_ROUNDS={recommended} (~{timings[recommended]} ms per hash)")
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+"""
+Event-loop latency during a login storm, with and without the password pool.
+
+Simulates the shift-change rush: a burst of logins, each a bcrypt verify,
+while a probe task measures how late the event loop wakes it (the delay
+every WebSocket fan-out and request would see). "inline" calls bcrypt in
+the coroutine like the handlers used to; "pool" goes through the bounded
+password pool, so excess logins are refused instead of stalling the loop.
+
+    python -m src.scripts.login_storm_benchmark --logins 200 --rate 100
+    python -m src.scripts.login_storm_benchmark --rounds 10 --workers 2 --output storm.json
+"""
+import argparse
+import asyncio
+import json
+import time
+from typing import Any, Dict, List
+
+import bcrypt
+import numpy as np
+
+from src.core.password_hasher import PasswordHasher, PasswordHasherBusy
+
+PROBE_INTERVAL = 0.005
+
+
+def summary(values: List[float]) -> Dict[str, Any]:
+    if not values:
+        return {"count": 0}
+    data = np.array(values)
+    return {
+        "count": len(values),
+        "p50_ms": round(float(np.percentile(data, 50)), 3),
+        "p95_ms": round(float(np.percentile(data, 95)), 3),
+        "p99_ms": round(float(np.percentile(data, 99)), 3),
+        "max_ms": round(float(data.max()), 3),
+    }
+
+
+async def probe(lags: List[float], stop: asyncio.Event):
+    """Sleep PROBE_INTERVAL repeatedly; any extra wake-up delay is event-loop lag"""
+    while not stop.is_set():
+        started = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(max(0.0, (time.perf_counter() - started - PROBE_INTERVAL) * 1000))
+
+
+async def storm(mode: str, args: argparse.Namespace, password: bytes, hashed: bytes) -> Dict[str, Any]:
+    hasher = PasswordHasher(workers=args.workers, max_pending=args.max_pending)
+    lags: List[float] = []
+    latencies: List[float] = []
+    outcomes = {"ok": 0, "rejected": 0}
+    stop = asyncio.Event()
+    probe_task = asyncio.create_task(probe(lags, stop))
+    await asyncio.sleep(0.05)
+
+    async def login():
+        started = time.perf_counter()
+        await asyncio.sleep(0)
+        try:
+            if mode == "inline":
+                bcrypt.checkpw(password, hashed)
+            else:
+                await hasher.run(bcrypt.checkpw, password, hashed)
+        except PasswordHasherBusy:
+            outcomes["rejected"] += 1
+            return
+        outcomes["ok"] += 1
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    began = time.perf_counter()
+    tasks = []
+    for index in range(args.logins):
+        if args.rate:
+            delay = began + index / args.rate - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+        tasks.append(asyncio.create_task(login()))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - began
+    stop.set()
+    await probe_task
+    hasher.shutdown()
+    return {
+        "event_loop_lag": summary(lags),
+        "login_latency": summary(latencies),
+        "logins": outcomes,
+        "logins_per_second": round(outcomes["ok"] / elapsed, 1),
+        "elapsed_seconds": round(elapsed, 3),
+        "pool": hasher.counts() if mode == "pool" else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Event-loop latency during a burst of bcrypt logins")
+    parser.add_argument("--logins", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=0, help="logins per second; 0 sends them all at once")
+    parser.add_argument("--rounds", type=int, default=12, help="bcrypt cost of the stored hash")
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--max-pending", type=int, default=64)
+    parser.add_argument("--modes", default="inline,pool")
+    parser.add_argument("--output", help="write the report as JSON here")
+    args = parser.parse_args()
+
+    password = b"Shift-change-2025"
+    hashed = bcrypt.hashpw(password, bcrypt.gensalt(rounds=args.rounds))
+    report = {"config": vars(args), "modes": {}}
+    for mode in args.modes.split(","):
+        report["modes"][mode] = asyncio.run(storm(mode, args, password, hashed))
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text)
+    print(text)
+
+
+if __name__ == "__main__":
+    main()
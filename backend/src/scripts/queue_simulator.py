@@ -0,0 +1,237 @@
+"""
+Discrete-event simulator for the token queue.
+
+Drives the real priority assignment, queue engine and wait-time estimator used
+by the API against synthetic or recorded arrival/service traces, fully offline.
+Reports throughput, per-operation latency, estimate error and per-priority
+wait distributions as JSON so runs can be compared across queue changes.
+
+    python -m src.scripts.queue_simulator --scale 5 --counters 6
+    python -m src.scripts.queue_simulator --trace opd_day.jsonl --output run.json
+    python -m src.scripts.queue_simulator --scale 3 --aging
+
+Trace files hold one JSON object per line:
+    {"arrival_minute": 3.5, "category": "urgent_medical", "service_minutes": 12.0}
+"""
+import argparse
+import heapq
+import json
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from src.api.v1.endpoints.tokens import (
+    BASE_TIME_PER_PATIENT,
+    assign_priority_by_category,
+    calculate_wait_time,
+)
+from src.core.priority_aging import PriorityAgingScheduler
+from src.core.queue_engine import QueueEngine
+from src.core.wait_estimator import WaitTimeEstimator
+
+# Share of arrivals per category on a typical OPD day
+DEFAULT_CATEGORY_MIX = {
+    "emergency": 0.03,
+    "urgent_medical": 0.07,
+    "serious_condition": 0.15,
+    "regular_consultation": 0.50,
+    "report_pickup": 0.15,
+    "report_consultation": 0.10,
+}
+
+# Mean call-to-complete minutes per category for synthetic traces
+DEFAULT_SERVICE_MINUTES = {
+    "emergency": 25.0,
+    "urgent_medical": 15.0,
+    "serious_condition": 12.0,
+    "regular_consultation": 8.0,
+    "report_pickup": 3.0,
+    "report_consultation": 6.0,
+}
+
+ARRIVAL, SERVICE_DONE = 0, 1
+
+
+def synthetic_trace(arrivals_per_hour: float, hours: float, seed: int,
+                    mix: Optional[Dict[str, float]] = None) -> List[Dict[str, Any]]:
+    """Poisson arrivals with a category mix and exponential service times"""
+    rng = random.Random(seed)
+    mix = mix or DEFAULT_CATEGORY_MIX
+    categories, weights = list(mix), list(mix.values())
+    trace, clock = [], 0.0
+    while True:
+        clock += rng.expovariate(arrivals_per_hour / 60)
+        if clock > hours * 60:
+            return trace
+        category = rng.choices(categories, weights)[0]
+        trace.append({
+            "arrival_minute": clock,
+            "category": category,
+            "service_minutes": rng.expovariate(1 / DEFAULT_SERVICE_MINUTES[category]),
+        })
+
+
+def load_trace(path: str) -> List[Dict[str, Any]]:
+    with open(path) as handle:
+        trace = [json.loads(line) for line in handle if line.strip()]
+    return sorted(trace, key=lambda event: event["arrival_minute"])
+
+
+def _percentiles(values: List[float], points=(50, 90, 95, 99)) -> Dict[str, float]:
+    if not values:
+        return {f"p{p}": 0.0 for p in points}
+    results = np.percentile(np.asarray(values, dtype=float), points)
+    return {f"p{p}": round(float(value), 3) for p, value in zip(points, results)}
+
+
+class QueueSimulator:
+    def __init__(self, trace: List[Dict[str, Any]], counters: int = 4,
+                 start: Optional[datetime] = None, aging: bool = False):
+        self.trace = trace
+        self.counters = counters
+        self.start = start or datetime(2025, 1, 6, 8, 0, tzinfo=timezone.utc)
+        self.engine = QueueEngine()
+        self._now = self.start.timestamp()
+        # Aging runs on simulated time, ticked before every dispatch
+        self.aging = PriorityAgingScheduler(self.engine, clock=lambda: self._now) if aging else None
+        self.estimator = WaitTimeEstimator(priors=BASE_TIME_PER_PATIENT, counters=counters)
+        self.latency_ns: Dict[str, List[int]] = defaultdict(list)
+
+    def _timed(self, operation: str, fn, *args):
+        started = time.perf_counter_ns()
+        result = fn(*args)
+        self.latency_ns[operation].append(time.perf_counter_ns() - started)
+        return result
+
+    def _at(self, minute: float) -> datetime:
+        return self.start + timedelta(minutes=minute)
+
+    def run(self) -> Dict[str, Any]:
+        events: List = []
+        for index, arrival in enumerate(self.trace):
+            heapq.heappush(events, (arrival["arrival_minute"], index, ARRIVAL, index))
+
+        tokens: Dict[str, Dict[str, Any]] = {}
+        free_counters = self.counters
+        sequence = len(self.trace)
+        max_queue = 0
+        clock = 0.0
+
+        def dispatch(now: float):
+            nonlocal free_counters, sequence
+            while free_counters and len(self.engine):
+                token_id = self._timed("rank_head", self.engine.token_at, 1)
+                self._timed("remove", self.engine.remove, token_id)
+                token = tokens[token_id]
+                token["called_minute"] = now
+                free_counters -= 1
+                sequence += 1
+                heapq.heappush(events, (now + token["service_minutes"], sequence, SERVICE_DONE, token_id))
+
+        while events:
+            clock, _, kind, payload = heapq.heappop(events)
+            now = self._at(clock)
+            self._now = now.timestamp()
+            if kind == ARRIVAL:
+                arrival = self.trace[payload]
+                token_id = f"sim-{payload}"
+                priority = assign_priority_by_category(arrival["category"])
+                token = {
+                    "id": token_id,
+                    "token_number": token_id,
+                    "patient_name": token_id,
+                    "priority_level": priority,
+                    "category": arrival["category"],
+                    "status": "active",
+                    "created_at": now,
+                    "arrival_minute": clock,
+                    "service_minutes": float(arrival["service_minutes"]),
+                }
+                tokens[token_id] = token
+                position = self._timed("insert", self.engine.add, token)
+                estimates = self._timed("estimate_queue", self.estimator.queue_estimates, self.engine, now)
+                token["adaptive_estimate"] = estimates[token_id]
+                token["static_estimate"] = calculate_wait_time(position, priority)
+                max_queue = max(max_queue, len(self.engine))
+            else:
+                token = tokens[payload]
+                self._timed("record_service", self.estimator.record_service,
+                            {"category": token["category"], "called_at": self._at(token["called_minute"])}, now)
+                token["completed_minute"] = clock
+                free_counters += 1
+            if self.aging:
+                self._timed("aging_tick", self.aging.tick)
+            dispatch(clock)
+
+        return self._report(tokens, clock, max_queue)
+
+    def _report(self, tokens: Dict[str, Dict[str, Any]], end_minute: float, max_queue: int) -> Dict[str, Any]:
+        served = [t for t in tokens.values() if "completed_minute" in t]
+        waits_by_priority: Dict[int, List[float]] = defaultdict(list)
+        adaptive_error, static_error = [], []
+        for token in served:
+            wait = token["called_minute"] - token["arrival_minute"]
+            waits_by_priority[int(token["priority_level"])].append(wait)
+            adaptive_error.append(abs(token["adaptive_estimate"] - wait))
+            static_error.append(abs(token["static_estimate"] - wait))
+
+        hours = max(end_minute, 1e-9) / 60
+        return {
+            "arrivals": len(tokens),
+            "served": len(served),
+            "counters": self.counters,
+            "aging": self.aging.stats() if self.aging else None,
+            "simulated_hours": round(hours, 2),
+            "throughput_per_hour": round(len(served) / hours, 2),
+            "max_queue_length": max_queue,
+            "operation_latency_us": {
+                operation: {**_percentiles([ns / 1000 for ns in samples]), "count": len(samples)}
+                for operation, samples in sorted(self.latency_ns.items())
+            },
+            "estimate_error_minutes": {
+                "adaptive": {"mae": round(float(np.mean(adaptive_error)), 2) if served else 0.0,
+                             **_percentiles(adaptive_error)},
+                "static": {"mae": round(float(np.mean(static_error)), 2) if served else 0.0,
+                           **_percentiles(static_error)},
+            },
+            "wait_minutes_by_priority": {
+                str(priority): {**_percentiles(waits), "max": round(max(waits), 2), "count": len(waits)}
+                for priority, waits in sorted(waits_by_priority.items())
+            },
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline queue simulator and benchmark")
+    parser.add_argument("--trace", help="JSON-lines arrival/service trace; synthetic if omitted")
+    parser.add_argument("--arrivals-per-hour", type=float, default=25.0)
+    parser.add_argument("--scale", type=float, default=1.0, help="Multiplier applied to the arrival rate")
+    parser.add_argument("--hours", type=float, default=8.0)
+    parser.add_argument("--counters", type=int, default=4)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--aging", action="store_true", help="Promote long-waiting tokens by category threshold")
+    parser.add_argument("--output", help="Write the JSON report to this file")
+    args = parser.parse_args()
+
+    if args.trace:
+        trace = load_trace(args.trace)
+    else:
+        trace = synthetic_trace(args.arrivals_per_hour * args.scale, args.hours, args.seed)
+
+    started = time.perf_counter()
+    report = QueueSimulator(trace, counters=args.counters, aging=args.aging).run()
+    report["wall_clock_seconds"] = round(time.perf_counter() - started, 3)
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as handle:
+            handle.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -16,9 +16,16 @@ async def setup_indexes():
         # Tokens collection indexes
         await db.tokens.create_index("token_number", unique=True)
         await db.tokens.create_index("patient_id")
+        await db.tokens.create_index(
+            [("patient_id", 1), ("status", 1)],
+            name="active_token_per_patient",
+            unique=True,
+            partialFilterExpression={"status": "active"}
+        )
         await db.tokens.create_index("status")
         await db.tokens.create_index("priority_level")
         await db.tokens.create_index("created_at")
+        await db.tokens.create_index([("status", 1), ("priority_level", 1), ("created_at", 1)])
         
         # Appointments collection indexes
         await db.appointments.create_index("patient_id")
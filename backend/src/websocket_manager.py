@@ -1,74 +1,581 @@
 import json
 import asyncio
-from typing import List, Dict, Any
+import time
+from typing import Any, Callable, Dict, List, Optional, Set, Tuple, Union
 from fastapi import WebSocket, WebSocketDisconnect
 import logging
+from src.core.encoding import Frame
+from src.core.queue_delta import QueueDeltaTracker
+from src.core.queue_engine import queue_engine
 
 logger = logging.getLogger(__name__)
 
+# Queued in place of a message: the writer sends the queue snapshot current at write time
+SNAPSHOT = object()
+
+
+class ConnectionWriter:
+    """
+    Bounded outbound queue plus a writer task for one socket.
+
+    Producers call offer(), which never waits, so one stalled client cannot
+    delay other sockets or the request that triggered a broadcast. When the
+    queue overflows, a staff/admin socket drops its backlog and falls back to
+    snapshot-only mode (queue deltas collapse into one pending snapshot,
+    written once it drains); overflowing again, overflowing a patient socket
+    or a send exceeding the timeout evicts the connection.
+    """
+
+    def __init__(self, manager: "ConnectionManager", websocket: WebSocket, user_id: str, user_role: str,
+                 max_queue: int, send_timeout: float, client_host: Optional[str] = None):
+        self.manager = manager
+        self.websocket = websocket
+        self.user_id = user_id
+        self.user_role = user_role
+        self.client_host = client_host
+        self.send_timeout = send_timeout
+        # Last time the client sent anything; see ConnectionManager.reap_idle
+        self.last_seen = time.monotonic()
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.snapshot_only = False
+        self._snapshot_pending = False
+        self.closed = False
+        self.sent = 0
+        self.dropped = 0
+        self.max_depth = 0
+        self.latency_ewma_ms = 0.0
+        self.latency_max_ms = 0.0
+        self.task = asyncio.get_running_loop().create_task(self._run())
+
+    def offer(self, message, queue_update: bool = False) -> bool:
+        """Queue a message for this socket without waiting; False when it was not queued"""
+        if self.closed:
+            return False
+        if queue_update and self.snapshot_only:
+            # Deltas are meaningless here; one pending snapshot covers them all
+            message = SNAPSHOT
+        if message is SNAPSHOT:
+            if self._snapshot_pending:
+                return True
+            self._snapshot_pending = True
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self._overflow()
+            return False
+        self.max_depth = max(self.max_depth, self.queue.qsize())
+        return True
+
+    def _overflow(self):
+        self.dropped += self.queue.qsize() + 1
+        if self.user_role == "patient" or self.snapshot_only:
+            self.manager.evict(self, "send queue overflow")
+            return
+        logger.warning(f"Slow consumer {self.user_id} ({self.user_role}) downgraded to snapshot-only")
+        self.manager.connection_stats["downgraded"] += 1
+        while not self.queue.empty():
+            self.queue.get_nowait()
+        self.snapshot_only = True
+        self._snapshot_pending = False
+        self.offer(SNAPSHOT)
+
+    async def _run(self):
+        while True:
+            message = await self.queue.get()
+            if message is SNAPSHOT:
+                self._snapshot_pending = False
+                message = self.manager.snapshot_frame()
+            text = message.text if isinstance(message, Frame) else message
+            started = time.perf_counter()
+            try:
+                await asyncio.wait_for(self.websocket.send_text(text), self.send_timeout)
+            except Exception as e:
+                self.manager.evict(self, f"send failed: {e!r}")
+                return
+            elapsed_ms = (time.perf_counter() - started) * 1000
+            self.latency_ewma_ms = elapsed_ms if not self.sent else 0.8 * self.latency_ewma_ms + 0.2 * elapsed_ms
+            self.latency_max_ms = max(self.latency_max_ms, elapsed_ms)
+            self.sent += 1
+            if self.snapshot_only and self.queue.empty() and not self._snapshot_pending:
+                # Caught up on a snapshot: deltas can resume from its seq
+                self.snapshot_only = False
+
+    def close(self):
+        self.closed = True
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "user_id": self.user_id,
+            "role": self.user_role,
+            "mode": "snapshot_only" if self.snapshot_only else "delta",
+            "idle_seconds": round(time.monotonic() - self.last_seen, 1),
+            "queue_depth": self.queue.qsize(),
+            "max_queue_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "send_latency_ms": {"ewma": round(self.latency_ewma_ms, 3), "max": round(self.latency_max_ms, 3)},
+        }
+
+
 class ConnectionManager:
-    def __init__(self):
-        # Store active connections by user role
-        self.active_connections: Dict[str, List[WebSocket]] = {
-            'patient': [],
-            'staff': [],
-            'admin': []
+    def __init__(self, coalesce_window: float = 0.1, send_queue_size: int = 64, send_timeout: float = 5.0):
+        # Connections by user role; dicts keep connect order and remove in O(1)
+        self.active_connections: Dict[str, Dict[WebSocket, ConnectionWriter]] = {
+            'patient': {},
+            'staff': {},
+            'admin': {}
         }
-        # Store connections by user ID for targeted updates
-        self.user_connections: Dict[str, WebSocket] = {}
+        # Connections by user ID for targeted updates, one entry per open tab or device
+        self.user_connections: Dict[str, Dict[WebSocket, ConnectionWriter]] = {}
+        # Sequenced queue deltas for staff/admin screens
+        self.queue_deltas = QueueDeltaTracker()
+        # Mutations within one window are flushed as a single staff/admin update
+        self.coalesce_window = coalesce_window
+        self._queue_source: Optional[Callable[[], List[Dict[str, Any]]]] = None
+        # Sent with snapshots and changed deltas so clients recompute wait estimates themselves
+        self._wait_model_source: Optional[Callable[[], Dict[str, Any]]] = None
+        self._pending_tokens: Dict[Any, Dict[str, Any]] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self.coalesce_stats = {"changes": 0, "flushes": 0, "immediate_flushes": 0}
+        # Called with every published delta, e.g. to feed the SSE queue stream
+        self._delta_listeners: List[Callable[[Dict[str, Any]], None]] = []
+        # Per-socket outbound queues; see ConnectionWriter
+        self.send_queue_size = send_queue_size
+        self.send_timeout = send_timeout
+        self.writers: Dict[WebSocket, ConnectionWriter] = {}
+        self.connection_stats = {"downgraded": 0, "evicted": 0, "reaped": 0, "rejected": 0, "unauthorized": 0}
+        # Server pings every heartbeat_interval; sockets silent for idle_timeout are reaped
+        self.heartbeat_interval = 25.0
+        self.idle_timeout = 60.0
+        # Connection limits; 0 or a missing role means unlimited
+        self.max_connections = 0
+        self.max_connections_per_user = 0
+        self.max_connections_per_ip = 0
+        self.max_connections_per_role: Dict[str, int] = {}
+        self.ip_connections: Dict[str, int] = {}
+        self._snapshot_frame: Optional[Frame] = None
+        self._snapshot_seq = -1
+        # token_id -> {socket: (position, eta) last pushed}; see subscribe_position
+        self.position_subscriptions: Dict[str, Dict[WebSocket, Optional[Tuple[int, int]]]] = {}
+        self._subscribed_tokens: Dict[WebSocket, Set[str]] = {}
+        self.position_step = 3
+        self.eta_step = 5
+        self.near_head = 5
+        self.position_stats = {"pushes": 0, "suppressed": 0, "rejected": 0}
 
-    async def connect(self, websocket: WebSocket, user_id: str, user_role: str):
+    def configure(self, queue_source: Optional[Callable[[], List[Dict[str, Any]]]] = None,
+                  wait_model_source: Optional[Callable[[], Dict[str, Any]]] = None,
+                  coalesce_window: Optional[float] = None, send_queue_size: Optional[int] = None,
+                  send_timeout: Optional[float] = None, position_step: Optional[int] = None,
+                  eta_step: Optional[int] = None, near_head: Optional[int] = None,
+                  heartbeat_interval: Optional[float] = None, idle_timeout: Optional[float] = None,
+                  max_connections: Optional[int] = None, max_connections_per_user: Optional[int] = None,
+                  max_connections_per_ip: Optional[int] = None,
+                  max_connections_per_role: Optional[Dict[str, int]] = None):
+        if queue_source is not None:
+            self._queue_source = queue_source
+        if wait_model_source is not None:
+            self._wait_model_source = wait_model_source
+        if coalesce_window is not None:
+            self.coalesce_window = coalesce_window
+        if send_queue_size is not None:
+            self.send_queue_size = send_queue_size
+        if send_timeout is not None:
+            self.send_timeout = send_timeout
+        if position_step is not None:
+            self.position_step = position_step
+        if eta_step is not None:
+            self.eta_step = eta_step
+        if near_head is not None:
+            self.near_head = near_head
+        if heartbeat_interval is not None:
+            self.heartbeat_interval = heartbeat_interval
+        if idle_timeout is not None:
+            self.idle_timeout = idle_timeout
+        if max_connections is not None:
+            self.max_connections = max_connections
+        if max_connections_per_user is not None:
+            self.max_connections_per_user = max_connections_per_user
+        if max_connections_per_ip is not None:
+            self.max_connections_per_ip = max_connections_per_ip
+        if max_connections_per_role is not None:
+            self.max_connections_per_role = dict(max_connections_per_role)
+
+    def _limit_exceeded(self, user_id: str, user_role: str, client_host: Optional[str]) -> Optional[str]:
+        if self.max_connections and len(self.writers) >= self.max_connections:
+            return "global"
+        role_limit = self.max_connections_per_role.get(user_role)
+        if role_limit and len(self.active_connections.get(user_role, ())) >= role_limit:
+            return "role"
+        if self.max_connections_per_user and len(self.user_connections.get(user_id, ())) >= self.max_connections_per_user:
+            return "user"
+        if (self.max_connections_per_ip and client_host
+                and self.ip_connections.get(client_host, 0) >= self.max_connections_per_ip):
+            return "ip"
+        return None
+
+    def add_delta_listener(self, listener: Callable[[Dict[str, Any]], None]):
+        self._delta_listeners.append(listener)
+
+    def _notify_delta(self, delta: Dict[str, Any]):
+        for listener in self._delta_listeners:
+            try:
+                listener(delta)
+            except Exception as e:
+                logger.error(f"Queue delta listener failed: {e}")
+
+    async def connect(self, websocket: WebSocket, user_id: str, user_role: str,
+                      client_host: Optional[str] = None) -> bool:
+        """
+        Register a socket; returns False, having refused the handshake, when a limit is reached.
+
+        user_id and user_role must be the identity verified from the token,
+        never the one the client asked for: the per-user and per-role limits
+        are keyed on them, and so are disconnect and position subscriptions.
+        client_host is the client's address as resolved behind trusted
+        proxies; it defaults to the socket's peer address.
+        """
+        if client_host is None:
+            client = getattr(websocket, "client", None)
+            client_host = client.host if client else None
+        # An unknown role would get a bucket of its own, outside every role limit
+        limit = ("role" if user_role not in self.active_connections
+                 else self._limit_exceeded(user_id, user_role, client_host))
+        if limit:
+            self.connection_stats["rejected"] += 1
+            logger.warning(f"Refusing connection for {user_id} ({user_role}): {limit} connection limit reached")
+            # Closing before accept refuses the handshake
+            await self._close_quietly(websocket)
+            return False
         await websocket.accept()
-        self.user_connections[user_id] = websocket
-        self.active_connections[user_role].append(websocket)
-        logger.info(f"User {user_id} ({user_role}) connected. Total connections: {len(self.user_connections)}")
+        writer = ConnectionWriter(self, websocket, user_id, user_role, self.send_queue_size, self.send_timeout,
+                                  client_host)
+        self.writers[websocket] = writer
+        if writer.client_host:
+            self.ip_connections[writer.client_host] = self.ip_connections.get(writer.client_host, 0) + 1
+        self.user_connections.setdefault(user_id, {})[websocket] = writer
+        self.active_connections[user_role][websocket] = writer
+        logger.info(f"User {user_id} ({user_role}) connected. Total connections: {len(self.writers)}")
+        if user_role in ("staff", "admin"):
+            # Deltas only make sense on top of a snapshot
+            await self.send_queue_snapshot(websocket)
+        return True
+
+    async def refuse(self, websocket: WebSocket, reason: str):
+        """Refuse a handshake that failed authentication"""
+        self.connection_stats["unauthorized"] += 1
+        logger.warning(f"Refusing connection: {reason}")
+        # 1008: policy violation
+        await self._close_quietly(websocket, code=1008)
 
     def disconnect(self, websocket: WebSocket, user_id: str, user_role: str):
-        if user_id in self.user_connections:
-            del self.user_connections[user_id]
-        if websocket in self.active_connections[user_role]:
-            self.active_connections[user_role].remove(websocket)
-        logger.info(f"User {user_id} ({user_role}) disconnected. Total connections: {len(self.user_connections)}")
-
-    async def send_personal_message(self, message: str, user_id: str):
-        if user_id in self.user_connections:
+        """Forget one connection; the user's other connections stay registered"""
+        writer = self.writers.pop(websocket, None)
+        if writer:
+            # Release the slots the socket was registered under, whatever the caller passed
+            user_id, user_role = writer.user_id, writer.user_role
+        user_sockets = self.user_connections.get(user_id)
+        if user_sockets is not None:
+            user_sockets.pop(websocket, None)
+            if not user_sockets:
+                del self.user_connections[user_id]
+        self.active_connections.get(user_role, {}).pop(websocket, None)
+        if writer:
+            writer.close()
+            if writer.client_host:
+                remaining = self.ip_connections.get(writer.client_host, 0) - 1
+                if remaining > 0:
+                    self.ip_connections[writer.client_host] = remaining
+                else:
+                    self.ip_connections.pop(writer.client_host, None)
+        for token_id in self._subscribed_tokens.pop(websocket, ()):
+            self._drop_subscription(websocket, token_id)
+        logger.info(f"User {user_id} ({user_role}) disconnected. Total connections: {len(self.writers)}")
+
+    def evict(self, writer: ConnectionWriter, reason: str):
+        """Drop a connection that cannot keep up; the client reconnects and resyncs"""
+        if writer.closed:
+            return
+        logger.warning(f"Evicting {writer.user_id} ({writer.user_role}): {reason}")
+        self.connection_stats["evicted"] += 1
+        self.disconnect(writer.websocket, writer.user_id, writer.user_role)
+        asyncio.get_running_loop().create_task(self._close_quietly(writer.websocket))
+
+    def reap_idle(self, now: Optional[float] = None) -> int:
+        """Evict sockets that sent nothing, not even a pong, for idle_timeout seconds"""
+        now = time.monotonic() if now is None else now
+        idle = [writer for writer in self.writers.values() if now - writer.last_seen > self.idle_timeout]
+        for writer in idle:
+            self.connection_stats["reaped"] += 1
+            self.evict(writer, "idle")
+        return len(idle)
+
+    async def run_heartbeat(self):
+        """Ping every socket each interval and reap the ones that stopped answering"""
+        while True:
+            await asyncio.sleep(self.heartbeat_interval)
             try:
-                await self.user_connections[user_id].send_text(message)
+                self.reap_idle()
+                if self.writers:
+                    # Clients answer {"type": "pong"}; any message counts as a sign of life
+                    await self.broadcast_to_all(Frame({"type": "ping"}))
             except Exception as e:
-                logger.error(f"Error sending message to user {user_id}: {e}")
-
-    async def broadcast_to_role(self, message: str, role: str):
-        if role in self.active_connections:
-            disconnected = []
-            for connection in self.active_connections[role]:
-                try:
-                    await connection.send_text(message)
-                except Exception as e:
-                    logger.error(f"Error broadcasting to {role}: {e}")
-                    disconnected.append(connection)
-            
-            # Remove disconnected connections
-            for connection in disconnected:
-                if connection in self.active_connections[role]:
-                    self.active_connections[role].remove(connection)
-
-    async def broadcast_to_all(self, message: str):
+                logger.error(f"WebSocket heartbeat failed: {e}")
+
+    def touch(self, websocket: WebSocket):
+        writer = self.writers.get(websocket)
+        if writer:
+            writer.last_seen = time.monotonic()
+
+    @staticmethod
+    async def _close_quietly(websocket: WebSocket, code: int = 1013):
+        try:
+            # 1013 (default): try again later
+            await asyncio.wait_for(websocket.close(code=code), 1.0)
+        except Exception:
+            pass
+
+    async def send_to(self, websocket: WebSocket, message: Union[str, Frame]):
+        """Queue a message on one socket, behind anything already pending for it"""
+        writer = self.writers.get(websocket)
+        if writer:
+            writer.offer(message)
+
+    async def send_personal_message(self, message: Union[str, Frame], user_id: str):
+        """Queue message on every connection the user has open"""
+        for writer in list(self.user_connections.get(user_id, {}).values()):
+            writer.offer(message)
+
+    async def broadcast_to_role(self, message: Union[str, Frame], role: str, queue_update: bool = False):
+        """Queue message on every socket of role; returns without waiting for any send"""
+        # offer() may evict, which removes from this dict
+        for writer in list(self.active_connections.get(role, {}).values()):
+            writer.offer(message, queue_update=queue_update)
+
+    async def broadcast_to_all(self, message: Union[str, Frame]):
         """Broadcast to all connected users"""
         for role in self.active_connections:
             await self.broadcast_to_role(message, role)
 
     async def send_queue_update(self, queue_data: List[Dict[str, Any]]):
-        """Send queue update to all staff and admin users"""
-        message = json.dumps({
-            "type": "queue_update",
-            "data": queue_data
-        })
-        await self.broadcast_to_role(message, "staff")
-        await self.broadcast_to_role(message, "admin")
+        """Send the change since the last queue update to all staff and admin users"""
+        delta = self.queue_deltas.publish(queue_data, self._wait_model())
+        if delta is None:
+            return
+        self._notify_delta(delta)
+        message = Frame(delta)
+        await self.broadcast_to_role(message, "staff", queue_update=True)
+        await self.broadcast_to_role(message, "admin", queue_update=True)
+
+    def queue_changed(self, urgent: bool = False):
+        """
+        Note a queue mutation. The queue is rebuilt and broadcast once per
+        coalescing window; urgent changes (CRITICAL tokens) flush right away.
+        Never blocks the caller.
+        """
+        self.coalesce_stats["changes"] += 1
+        if urgent:
+            self.coalesce_stats["immediate_flushes"] += 1
+            self._schedule_flush(0)
+        elif self._flush_task is None:
+            self._schedule_flush(self.coalesce_window)
+
+    def _schedule_flush(self, delay: float):
+        if self._flush_task is not None:
+            if delay:
+                return
+            self._flush_task.cancel()
+        self._flush_task = asyncio.get_running_loop().create_task(self._flush_after(delay))
+
+    async def _flush_after(self, delay: float):
+        if delay:
+            await asyncio.sleep(delay)
+        self._flush_task = None
+        try:
+            await self.flush_queue_update()
+        except Exception as e:
+            logger.error(f"Error flushing queue update: {e}")
+
+    async def flush_queue_update(self):
+        """Broadcast one merged update for everything changed since the last flush"""
+        tokens = list(self._pending_tokens.values())
+        self._pending_tokens.clear()
+        delta = self.queue_deltas.publish(self._queue_source(), self._wait_model()) if self._queue_source else None
+        self.coalesce_stats["flushes"] += 1
+        if delta is not None:
+            self._notify_delta(delta)
+            # Token updates from the window ride along instead of one frame each
+            message = Frame({**delta, "tokens": tokens} if tokens else delta)
+            await self.broadcast_to_role(message, "staff", queue_update=True)
+            await self.broadcast_to_role(message, "admin", queue_update=True)
+            self._push_positions(self.position_subscriptions, delta["total_count"])
+            return
+        for token_data in tokens:
+            message = Frame({"type": "token_update", "data": token_data})
+            await self.broadcast_to_role(message, "staff")
+            await self.broadcast_to_role(message, "admin")
+
+    def _wait_model(self) -> Optional[Dict[str, Any]]:
+        return self._wait_model_source() if self._wait_model_source else None
+
+    def snapshot_frame(self) -> Frame:
+        """Encoded queue_snapshot for the latest seq, shared by every socket that needs one"""
+        snapshot = self.queue_deltas.snapshot()
+        if self._snapshot_frame is None or self._snapshot_seq != snapshot["seq"]:
+            self._snapshot_frame = Frame(snapshot)
+            self._snapshot_seq = snapshot["seq"]
+        return self._snapshot_frame
+
+    async def send_queue_snapshot(self, websocket: WebSocket):
+        writer = self.writers.get(websocket)
+        if writer:
+            writer.offer(SNAPSHOT)
+
+    async def handle_message(self, websocket: WebSocket, data: str) -> bool:
+        """Answer client protocol messages; returns False for anything else"""
+        self.touch(websocket)
+        try:
+            message = json.loads(data)
+        except ValueError:
+            return False
+        if not isinstance(message, dict):
+            return False
+        message_type = message.get("type")
+        if message_type == "pong":
+            pass
+        elif message_type == "resync":
+            await self._resync(websocket, message.get("since"))
+        elif message_type == "subscribe_position":
+            self.subscribe_position(websocket, message.get("token_id"))
+        elif message_type == "unsubscribe_position":
+            self.unsubscribe_position(websocket, message.get("token_id"))
+        else:
+            return False
+        return True
+
+    async def _resync(self, websocket: WebSocket, since: Any):
+        missed = self.queue_deltas.since(since) if isinstance(since, int) else None
+        writer = self.writers.get(websocket)
+        if missed is None or writer is None:
+            await self.send_queue_snapshot(websocket)
+        else:
+            for delta in missed:
+                writer.offer(Frame(delta), queue_update=True)
+
+    def subscribe_position(self, websocket: WebSocket, token_id: Any) -> bool:
+        """
+        Push position_update messages for one queued token to this socket.
+
+        Patients may only follow their own tokens; the socket's user is the
+        one verified from its JWT at the handshake. The current position goes
+        out right away; after that a push is sent only when the position or
+        ETA moves by the configured step, on every move within the first
+        near_head places, and once with position 0 when the token leaves the
+        queue, which also ends the subscription.
+        """
+        writer = self.writers.get(websocket)
+        if writer is None:
+            return False
+        entry = queue_engine.entry(token_id) if isinstance(token_id, str) else None
+        if entry is None or (writer.user_role == "patient" and entry.get("patient_id") != writer.user_id):
+            # Same answer for unknown and foreign tokens, so ids cannot be probed
+            self.position_stats["rejected"] += 1
+            writer.offer(Frame({"type": "error", "detail": "Token not found in queue", "token_id": token_id}))
+            return False
+        self.position_subscriptions.setdefault(token_id, {})[websocket] = None
+        self._subscribed_tokens.setdefault(websocket, set()).add(token_id)
+        if self.queue_deltas.row(token_id) is not None:
+            self._push_positions({token_id: {websocket: None}}, len(self.queue_deltas.snapshot()["data"]))
+        else:
+            # Queued after the last broadcast; the next flush carries its position
+            self.queue_changed()
+        return True
+
+    def unsubscribe_position(self, websocket: WebSocket, token_id: Any):
+        tokens = self._subscribed_tokens.get(websocket)
+        if tokens and token_id in tokens:
+            tokens.discard(token_id)
+            self._drop_subscription(websocket, token_id)
+
+    def _drop_subscription(self, websocket: WebSocket, token_id: str):
+        subscribers = self.position_subscriptions.get(token_id)
+        if subscribers is not None:
+            subscribers.pop(websocket, None)
+            if not subscribers:
+                del self.position_subscriptions[token_id]
+
+    def _position_due(self, last: Optional[Tuple[int, int]], position: int, eta: int) -> bool:
+        if last is None:
+            return True
+        last_position, last_eta = last
+        if position == last_position and eta == last_eta:
+            return False
+        if position == 0 or position <= self.near_head:
+            return True
+        return abs(position - last_position) >= self.position_step or abs(eta - last_eta) >= self.eta_step
+
+    def _push_positions(self, subscriptions: Dict[str, Dict[WebSocket, Any]], total_count: int):
+        """Send position_update to the subscribers whose token moved far enough since their last push"""
+        for token_id, subscribers in list(subscriptions.items()):
+            row = self.queue_deltas.row(token_id)
+            position = row["position"] if row else 0
+            eta = row.get("estimated_wait_time", 0) if row else 0
+            message = None
+            for websocket in list(subscribers):
+                last = self.position_subscriptions.get(token_id, {}).get(websocket)
+                if not self._position_due(last, position, eta):
+                    self.position_stats["suppressed"] += 1
+                    continue
+                writer = self.writers.get(websocket)
+                if writer is None:
+                    continue
+                if message is None:
+                    # One encoded frame per token, shared by all of its subscribers
+                    message = Frame({
+                        "type": "position_update",
+                        "token_id": token_id,
+                        "position": position,
+                        "estimated_wait_time": eta,
+                        "total_count": total_count,
+                    })
+                writer.offer(message)
+                self.position_stats["pushes"] += 1
+                if position == 0:
+                    self.unsubscribe_position(websocket, token_id)
+                else:
+                    self.position_subscriptions[token_id][websocket] = (position, eta)
+
+    def counts(self) -> Dict[str, Any]:
+        """Live connection counts and limits; constant time, cheap enough to poll"""
+        return {
+            "total": len(self.writers),
+            "users": len(self.user_connections),
+            "client_hosts": len(self.ip_connections),
+            "by_role": {role: len(connections) for role, connections in self.active_connections.items()},
+            "limits": {
+                "global": self.max_connections,
+                "per_user": self.max_connections_per_user,
+                "per_ip": self.max_connections_per_ip,
+                "per_role": self.max_connections_per_role,
+            },
+            **self.connection_stats,
+        }
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-connection send latency and queue depth, plus fan-out counters"""
+        return {
+            **self.counts(),
+            **self.coalesce_stats,
+            "position_subscriptions": sum(len(subscribers) for subscribers in self.position_subscriptions.values()),
+            "position_pushes": self.position_stats,
+            "connections": [writer.stats() for writer in self.writers.values()],
+        }
 
     async def send_token_update(self, token_data: Dict[str, Any], user_id: str = None):
         """Send token update to specific user or all relevant users"""
-        message = json.dumps({
+        message = Frame({
             "type": "token_update",
             "data": token_data
         })
@@ -77,13 +584,14 @@ class ConnectionManager:
             # Send to specific user (patient who created the token)
             await self.send_personal_message(message, user_id)
         
-        # Also send to all staff/admin for queue updates
-        await self.broadcast_to_role(message, "staff")
-        await self.broadcast_to_role(message, "admin")
+        # Staff/admin copies go out with the next coalesced queue flush
+        self._pending_tokens[token_data.get("id")] = token_data
+        if self._flush_task is None:
+            self._schedule_flush(self.coalesce_window)
 
     async def send_analytics_update(self, analytics_data: Dict[str, Any]):
         """Send analytics update to staff and admin"""
-        message = json.dumps({
+        message = Frame({
             "type": "analytics_update",
             "data": analytics_data
         })
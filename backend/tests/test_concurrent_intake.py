@@ -0,0 +1,95 @@
+import asyncio
+import uuid
+
+import aiohttp
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from src.core.config import settings
+
+API_URL = "http://127.0.0.1:8000/api/v1"
+CONCURRENT_CREATES = 200
+
+
+async def _staff_headers(session):
+    staff = {
+        "email": f"intake-{uuid.uuid4().hex[:10]}@example.com",
+        "name": "Intake Desk",
+        "phone": "9876543210",
+        "password": "IntakePass123",
+        "role": "staff",
+    }
+    async with session.post(f"{API_URL}/register", json=staff) as response:
+        assert response.status == 200, await response.text()
+        result = await response.json()
+    return {"Authorization": f"Bearer {result['access_token']}"}
+
+
+async def _create(session, headers, patient_id, category="regular_consultation"):
+    payload = {
+        "category": category,
+        "patient_id": patient_id,
+        "patient_name": f"Patient {patient_id[:6]}",
+        "patient_phone": "9123456789",
+    }
+    async with session.post(f"{API_URL}/tokens", json=payload, headers=headers) as response:
+        return response.status, await response.json()
+
+
+async def _cancel_all(session, headers, token_ids):
+    for token_id in token_ids:
+        async with session.put(f"{API_URL}/tokens/{token_id}/cancel", headers=headers):
+            pass
+
+
+def test_concurrent_creates_store_distinct_active_tokens(event_loop):
+    async def run():
+        categories = ["emergency", "urgent_medical", "serious_condition",
+                      "regular_consultation", "report_pickup", "report_consultation"]
+        created = []
+        client = AsyncIOMotorClient(settings.MONGODB_URL)
+        tokens = client[settings.MONGODB_DB_NAME].tokens
+        async with aiohttp.ClientSession() as session:
+            headers = await _staff_headers(session)
+            try:
+                results = await asyncio.gather(*(
+                    _create(session, headers, str(uuid.uuid4()), categories[i % len(categories)])
+                    for i in range(CONCURRENT_CREATES)
+                ))
+                created = [body["id"] for status, body in results if status == 200]
+                assert len(created) == CONCURRENT_CREATES
+
+                # Stored state, checked against Mongo rather than the engine under test
+                stored = await tokens.find({"id": {"$in": created}}).to_list(None)
+                assert len({token["token_number"] for token in stored}) == CONCURRENT_CREATES
+                assert await tokens.count_documents({"id": {"$in": created}, "status": "active"}) == CONCURRENT_CREATES
+
+                # Positions form a gapless permutation over exactly the tokens Mongo holds as active
+                async with session.get(f"{API_URL}/queue", headers=headers) as response:
+                    queue = await response.json()
+                positions = sorted(entry["position"] for entry in queue["queue"])
+                assert positions == list(range(1, queue["total_count"] + 1))
+                active = await tokens.distinct("id", {"status": "active"})
+                assert {entry["token_id"] for entry in queue["queue"]} == set(active)
+                assert set(created) <= set(active)
+            finally:
+                await _cancel_all(session, headers, created)
+                client.close()
+
+    event_loop.run_until_complete(run())
+
+
+def test_concurrent_creates_for_one_patient_yield_single_active_token(event_loop):
+    async def run():
+        patient_id = str(uuid.uuid4())
+        async with aiohttp.ClientSession() as session:
+            headers = await _staff_headers(session)
+            results = await asyncio.gather(*(
+                _create(session, headers, patient_id) for _ in range(20)
+            ))
+            accepted = [body["id"] for status, body in results if status == 200]
+            rejected = [status for status, _ in results if status == 400]
+            await _cancel_all(session, headers, accepted)
+        assert len(accepted) == 1
+        assert len(rejected) == 19
+
+    event_loop.run_until_complete(run())
@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timezone
+from enum import Enum, IntEnum
+
+from bson import ObjectId
+from pydantic import BaseModel
+
+from src.core import encoding
+from src.core.encoding import Frame, dumps
+
+
+class Status(str, Enum):
+    ACTIVE = "active"
+
+
+class Priority(IntEnum):
+    HIGH = 2
+
+
+class Row(BaseModel):
+    token_id: str
+    created_at: datetime
+
+
+def _sample():
+    created = datetime(2025, 1, 6, 8, 30, 15, 120000, tzinfo=timezone.utc)
+    return {
+        "_id": ObjectId("65a1b2c3d4e5f60718293a4b"),
+        "status": Status.ACTIVE,
+        "priority_level": Priority.HIGH,
+        "created_at": created,
+        "naive": datetime(2025, 1, 6, 8, 30),
+        "row": Row(token_id="t1", created_at=created),
+    }
+
+
+EXPECTED = {
+    "_id": "65a1b2c3d4e5f60718293a4b",
+    "status": "active",
+    "priority_level": 2,
+    "created_at": "2025-01-06T08:30:15.120000+00:00",
+    "naive": "2025-01-06T08:30:00",
+    "row": {"token_id": "t1", "created_at": "2025-01-06T08:30:15.120000+00:00"},
+}
+
+
+def test_encodes_datetimes_enums_and_object_ids():
+    assert json.loads(dumps(_sample())) == EXPECTED
+
+
+def test_stdlib_fallback_matches(monkeypatch):
+    monkeypatch.setattr(encoding, "orjson", None)
+    assert json.loads(dumps(_sample())) == EXPECTED
+
+
+def test_frame_text_is_decoded_once():
+    frame = Frame({"type": "queue_delta", "seq": 1})
+    assert frame.text is frame.text
+    assert frame.text.encode() == frame.data
@@ -0,0 +1,237 @@
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+
+import pytest
+
+from src.core.event_bus import EventBus, MongoChangeStreamBackend
+
+
+class SharedLog:
+    """Stands in for the change-stream collection: every worker sees every insert"""
+
+    def __init__(self):
+        self.subscribers = []
+
+    def backend(self):
+        log = self
+
+        class Backend:
+            async def start(self, deliver, gap):
+                log.subscribers.append(deliver)
+
+            async def stop(self):
+                pass
+
+            async def publish(self, event):
+                for deliver in log.subscribers:
+                    await deliver(dict(event))
+
+        return Backend()
+
+
+def _worker(log):
+    return _worker_with(log.backend())
+
+
+def _worker_with(backend):
+    bus = EventBus(backend)
+    seen = []
+
+    async def record(event):
+        seen.append((event["type"], event["payload"]))
+
+    bus.subscribe(record)
+    return bus, seen
+
+
+def test_events_reach_every_worker_exactly_once():
+    async def run():
+        log = SharedLog()
+        (one, seen_one), (two, seen_two) = _worker(log), _worker(log)
+        await one.start()
+        await two.start()
+        await one.publish("token.dequeued", {"token_id": "a"})
+        await two.publish("token.dequeued", {"token_id": "b"})
+        return one, seen_one, seen_two
+
+    one, seen_one, seen_two = asyncio.run(run())
+    expected = [("token.dequeued", {"token_id": "a"}), ("token.dequeued", {"token_id": "b"})]
+    assert seen_one == expected
+    assert seen_two == expected
+    assert one.stats["published"] == 1 and one.stats["received"] == 1
+
+
+def test_failing_handler_does_not_stop_others():
+    async def run():
+        bus = EventBus()
+        seen = []
+
+        async def broken(event):
+            raise RuntimeError("boom")
+
+        async def record(event):
+            seen.append(event["type"])
+
+        bus.subscribe(broken)
+        bus.subscribe(record)
+        await bus.publish("tokens.queued", {"tokens": []})
+        return bus, seen
+
+    bus, seen = asyncio.run(run())
+    assert seen == ["tokens.queued"]
+    assert bus.stats["handler_errors"] == 1
+
+
+def test_queue_events_apply_to_the_engine():
+    from src.core import queue_events
+    from src.core.queue_engine import queue_engine
+
+    token = {"id": "bus-1", "token_number": "E-001", "patient_name": "P", "priority_level": 1,
+             "category": "emergency", "status": "active", "created_at": datetime.now(timezone.utc)}
+
+    async def run():
+        await queue_events.tokens_queued([token], urgent=True)
+        position = queue_engine.position("bus-1")
+        await queue_events.token_dequeued("bus-1")
+        return position
+
+    assert asyncio.run(run()) == 1
+    assert "bus-1" not in queue_engine
+
+
+def test_several_workers_need_a_shared_backend():
+    EventBus().check_workers(1)
+    with pytest.raises(RuntimeError):
+        EventBus().check_workers(4)
+    EventBus(SharedLog().backend()).check_workers(4)
+
+
+class ScriptedCollection:
+    """Change streams that deliver scripted changes, then fail or stay open"""
+
+    def __init__(self, scripts):
+        self.scripts = list(scripts)
+        self.resumed_after = []
+
+    async def create_index(self, *args, **kwargs):
+        pass
+
+    def watch(self, pipeline, resume_after=None):
+        self.resumed_after.append(resume_after)
+        changes, error = self.scripts.pop(0)
+        collection = self
+
+        class Stream:
+            resume_token = resume_after
+
+            async def __aenter__(self):
+                if error and not changes:
+                    raise error
+                return self
+
+            async def __aexit__(self, *exc):
+                return False
+
+            def __aiter__(self):
+                return self._changes()
+
+            async def _changes(self):
+                for token, document in changes:
+                    self.resume_token = token
+                    yield {"fullDocument": document}
+                if error:
+                    raise error
+                collection.drained.set()
+                await asyncio.Event().wait()
+
+        return Stream()
+
+
+def test_change_stream_resumes_once_then_resyncs():
+    first = {"type": "a", "payload": {}, "origin": "other"}
+    second = {"type": "b", "payload": {}, "origin": "other"}
+
+    async def run():
+        collection = ScriptedCollection([
+            ([("t1", first)], ConnectionError("stepdown")),
+            # The resumed stream fails straight away, so continuity is lost
+            ([], ConnectionError("history lost")),
+            ([("t2", second)], None),
+        ])
+        collection.drained = asyncio.Event()
+        bus, seen = _worker_with(MongoChangeStreamBackend(collection, retry_seconds=0))
+        gaps = []
+
+        async def gap():
+            gaps.append(len(seen))
+
+        bus.on_gap(gap)
+        await bus.start()
+        await asyncio.wait_for(collection.drained.wait(), 5)
+        await bus.stop()
+        return collection, seen, gaps
+
+    collection, seen, gaps = asyncio.run(run())
+    assert collection.resumed_after == [None, "t1", None]
+    assert seen == [("a", {}), ("b", {})]
+    # Resync when the first stream opens and again after the failed resume, never after the good one
+    assert gaps == [0, 1]
+
+
+def _replica_set_url():
+    """The test Mongo URL when it points at a replica set, which change streams need"""
+    from pymongo import MongoClient
+    from pymongo.errors import PyMongoError
+
+    url = os.getenv("MONGODB_URL", "mongodb://localhost:27017")
+    try:
+        with MongoClient(url, serverSelectionTimeoutMS=1000) as client:
+            hello = client.admin.command("hello")
+    except PyMongoError:
+        return None
+    return url if hello.get("setName") else None
+
+
+def test_mongo_change_stream_reaches_the_other_worker():
+    url = _replica_set_url()
+    if url is None:
+        pytest.skip("MONGODB_URL is not a reachable replica set")
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    async def run():
+        client = AsyncIOMotorClient(url)
+        collection = client["queue_event_bus_test"][f"events_{uuid.uuid4().hex[:8]}"]
+        workers, opened = [], []
+        try:
+            for _ in range(2):
+                bus, seen = _worker_with(MongoChangeStreamBackend(collection, retry_seconds=0.1))
+                ready = asyncio.Event()
+
+                async def gap(ready=ready):
+                    ready.set()
+
+                bus.on_gap(gap)
+                await bus.start()
+                workers.append((bus, seen))
+                opened.append(ready)
+            await asyncio.wait_for(asyncio.gather(*(ready.wait() for ready in opened)), 10)
+            (one, seen_one), (two, seen_two) = workers
+            await one.publish("token.dequeued", {"token_id": "a"})
+            for _ in range(100):
+                if seen_two:
+                    break
+                await asyncio.sleep(0.05)
+            return seen_one, seen_two, one.stats["received"]
+        finally:
+            for bus, _ in workers:
+                await bus.stop()
+            await collection.drop()
+            client.close()
+
+    seen_one, seen_two, echoed = asyncio.run(run())
+    assert seen_one == [("token.dequeued", {"token_id": "a"})]
+    assert seen_two == [("token.dequeued", {"token_id": "a"})]
+    # The publisher's own insert comes back on its stream and is skipped
+    assert echoed == 0
@@ -0,0 +1,73 @@
+import asyncio
+import threading
+import time
+
+import bcrypt
+import pytest
+
+from src.core.password_hasher import (
+    MAX_ROUNDS,
+    MIN_ROUNDS,
+    PasswordHasher,
+    PasswordHasherBusy,
+    hash_rounds,
+    rounds_for_target,
+)
+
+
+def test_slow_hashing_leaves_the_event_loop_free():
+    async def run():
+        hasher = PasswordHasher(workers=2)
+        ticks = 0
+
+        async def ticker():
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.005)
+                ticks += 1
+
+        task = asyncio.create_task(ticker())
+        results = await asyncio.gather(*(hasher.run(lambda: time.sleep(0.1) or "hashed") for _ in range(2)))
+        task.cancel()
+        hasher.shutdown()
+        return results, ticks, hasher.counts()
+
+    results, ticks, counts = asyncio.run(run())
+    assert results == ["hashed", "hashed"]
+    assert ticks >= 10
+    assert counts["completed"] == 2 and counts["pending"] == 0
+
+
+def test_jobs_beyond_the_pending_cap_are_refused():
+    async def run():
+        hasher = PasswordHasher(workers=1, max_pending=2)
+        release = threading.Event()
+        running = [asyncio.create_task(hasher.run(release.wait, 5)) for _ in range(2)]
+        await asyncio.sleep(0)
+        with pytest.raises(PasswordHasherBusy):
+            await hasher.run(release.wait, 5)
+        release.set()
+        await asyncio.gather(*running)
+        await asyncio.sleep(0.01)
+        after = await hasher.run(lambda: "ok")
+        hasher.shutdown()
+        return hasher.counts(), after
+
+    counts, after = asyncio.run(run())
+    assert after == "ok"
+    assert counts["rejected"] == 1 and counts["max_pending"] == 2 and counts["pending"] == 0
+
+
+def test_rehash_is_needed_only_for_other_bcrypt_costs():
+    hasher = PasswordHasher(rounds=10)
+    assert hash_rounds("$2b$12$" + "a" * 53) == 12
+    assert hasher.needs_rehash("$2b$12$" + "a" * 53)
+    assert not hasher.needs_rehash(bcrypt.hashpw(b"pw", hasher.salt()))
+    assert not hasher.needs_rehash("not-a-bcrypt-hash")
+
+
+def test_target_time_picks_the_closest_cost():
+    # A cost-8 probe of 6 ms doubles per round: 10 -> 24 ms, 12 -> 96 ms, 13 -> 192 ms
+    assert rounds_for_target(100, probe_ms=6) == 12
+    assert rounds_for_target(1, probe_ms=6) == MIN_ROUNDS
+    assert rounds_for_target(10 ** 6, probe_ms=6) == MAX_ROUNDS
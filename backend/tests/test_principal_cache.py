@@ -0,0 +1,53 @@
+import asyncio
+
+from src.core.principal_cache import PrincipalCache, principal_cache, token_id, user_changed
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_hits_expire_with_the_ttl_or_the_token():
+    clock = Clock()
+    cache = PrincipalCache(ttl_seconds=60, clock=clock)
+    cache.put("u1", "jti-1", {"id": "u1"})
+    cache.put("u1", "jti-2", {"id": "u1"}, token_expires=clock.now + 10)
+    assert cache.get("u1", "jti-1") == {"id": "u1"}
+    assert cache.get("u2", "jti-1") is None
+
+    clock.now += 30
+    assert cache.get("u1", "jti-2") is None
+    assert cache.get("u1", "jti-1") is not None
+    clock.now += 31
+    assert cache.get("u1", "jti-1") is None
+    assert cache.stats == {"hits": 2, "misses": 3, "expired": 2, "evicted": 0, "invalidated": 0}
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = PrincipalCache(max_entries=2)
+    cache.put("a", 1, "A")
+    cache.put("b", 1, "B")
+    cache.get("a", 1)
+    cache.put("c", 1, "C")
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == "A" and cache.get("c", 1) == "C"
+    assert cache.counts()["entries"] == 2 and cache.stats["evicted"] == 1
+
+
+def test_user_changed_drops_every_token_of_that_user():
+    principal_cache.clear()
+    principal_cache.put("u1", "jti-1", "one")
+    principal_cache.put("u1", "jti-2", "two")
+    principal_cache.put("u2", "jti-3", "other")
+    asyncio.run(user_changed("u1"))
+    assert principal_cache.get("u1", "jti-1") is None and principal_cache.get("u1", "jti-2") is None
+    assert principal_cache.get("u2", "jti-3") == "other"
+
+
+def test_token_id_falls_back_to_the_signature():
+    assert token_id({"jti": "abc"}, "h.p.s") == "abc"
+    assert token_id({}, "header.payload.signature") == "signature"
@@ -0,0 +1,134 @@
+from datetime import datetime, timedelta, timezone
+
+from src.core.priority_aging import PriorityAgingScheduler
+from src.core.queue_engine import QueueEngine
+
+START = datetime(2025, 1, 1, tzinfo=timezone.utc)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = START.timestamp()
+
+    def __call__(self):
+        return self.now
+
+    def advance(self, minutes):
+        self.now += minutes * 60
+        return self.now
+
+
+def _token(token_id, priority, category, minutes=0):
+    return {"id": token_id, "token_number": token_id, "patient_name": token_id,
+            "priority_level": priority, "category": category, "status": "active",
+            "created_at": START + timedelta(minutes=minutes)}
+
+
+def _setup(thresholds, ceiling=2):
+    clock = FakeClock()
+    engine = QueueEngine()
+    aging = PriorityAgingScheduler(engine, thresholds=thresholds, ceiling=ceiling, clock=clock)
+    return engine, aging, clock
+
+
+def test_waiting_token_is_promoted_one_class_per_threshold():
+    engine, aging, clock = _setup({"report_consultation": 30})
+    engine.add(_token("old", 6, "report_consultation"))
+    engine.add(_token("new", 3, "serious_condition", minutes=1))
+    assert engine.ordered_ids() == ["new", "old"]
+
+    assert aging.tick(clock.advance(29)) == []
+    assert aging.tick(clock.advance(2)) == ["old"]
+    assert engine.entry("old")["effective_priority"] == 5
+    assert engine.entry("old")["priority_level"] == 6
+
+    clock.advance(60)
+    aging.tick()
+    # Three promotions (6 -> 3) put it ahead of the later MEDIUM_HIGH arrival
+    assert engine.entry("old")["effective_priority"] == 3
+    assert engine.ordered_ids() == ["old", "new"]
+
+
+def test_ceiling_is_never_crossed():
+    engine, aging, clock = _setup({"regular_consultation": 10}, ceiling=2)
+    engine.add(_token("a", 4, "regular_consultation"))
+    clock.advance(500)
+    aging.tick()
+    assert engine.entry("a")["effective_priority"] == 2
+    assert aging.stats()["scheduled_tokens"] == 0
+
+
+def test_overdue_token_is_aged_on_add_and_untracked_on_remove():
+    engine, aging, clock = _setup({"report_pickup": 30})
+    clock.advance(65)
+    engine.add(_token("late", 5, "report_pickup"))
+    assert engine.entry("late")["effective_priority"] == 3
+
+    engine.remove("late")
+    assert aging.stats()["scheduled_tokens"] == 0
+    assert aging.tick(clock.advance(120)) == []
+
+
+def test_categories_without_threshold_do_not_age():
+    engine, aging, clock = _setup({"report_pickup": 30})
+    engine.add(_token("a", 4, "regular_consultation"))
+    assert aging.tick(clock.advance(600)) == []
+    assert engine.entry("a")["effective_priority"] == 4
+
+
+def test_tick_only_touches_due_tokens_in_a_large_queue():
+    engine, aging, clock = _setup({"regular_consultation": 60})
+    for index in range(20000):
+        engine.add(_token(f"t{index}", 4, "regular_consultation", minutes=index * 0.01))
+
+    clock.advance(60.5)
+    changed = aging.tick()
+    # Only the tokens created in the first half minute have waited an hour
+    assert set(changed) == {f"t{index}" for index in range(51)}
+    assert aging.stats()["scheduled_tokens"] == 20000
+    assert engine.ordered_ids()[:51] == [f"t{index}" for index in range(51)]
+
+
+class TokenCollection:
+    """Minimal stand-in for the tokens collection: load scans and atomic claims"""
+
+    def __init__(self, tokens):
+        self.tokens = {token["id"]: dict(token) for token in tokens}
+
+    async def _scan(self, query):
+        for token in list(self.tokens.values()):
+            if token["status"] == query["status"]:
+                yield dict(token)
+
+    def find(self, query, projection=None):
+        return self._scan(query)
+
+    async def find_one_and_update(self, query, update, return_document=None):
+        token = self.tokens.get(query["id"])
+        if token is None or token["status"] != query["status"]:
+            return None
+        token.update(update["$set"])
+        return dict(token)
+
+
+def test_claim_after_reload_still_honours_aging():
+    import asyncio
+
+    engine, aging, clock = _setup({"report_pickup": 30.0})
+    tokens = TokenCollection([_token("fresh-high", 2, "urgent_medical", minutes=100),
+                              _token("starved", 5, "report_pickup")])
+    clock.advance(120)
+    engine.add(_token("gone", 1, "emergency"))
+    claim = {"$set": {"status": "in_service"}}
+
+    async def run():
+        # The only candidate was closed elsewhere, so the engine is rebuilt from Mongo
+        first, stale = await engine.claim_head(tokens, claim, candidates=1)
+        await engine.load(tokens)
+        claimed, _ = await engine.claim_head(tokens, claim)
+        return first, stale, claimed
+
+    first, stale, claimed = asyncio.run(run())
+    assert first is None and stale == 1 and "gone" not in engine
+    # Aged to class 2 at minute 90, ahead of the class-2 token that arrived at minute 100
+    assert claimed["id"] == "starved"
@@ -0,0 +1,111 @@
+import random
+
+import numpy as np
+
+from src.core.queue_delta import QueueDeltaTracker
+
+MODEL = {"counters": 2, "service_minutes": {"consult:4": 20.0, "reports:5": 7.5}}
+
+
+def _class(token_id):
+    return ("consult", 4) if sum(map(ord, token_id)) % 2 else ("reports", 5)
+
+
+def _with_estimates(rows, model):
+    """Client-side wait recomputation, as documented on QueueDeltaTracker"""
+    total = 0.0
+    for row in rows:
+        service = model["service_minutes"][f"{row['category']}:{row['priority_level']}"]
+        total += service
+        row["estimated_wait_time"] = int(np.rint((total - service) / model["counters"]))
+    return rows
+
+
+def _queue(ids, model=MODEL):
+    rows = [{"token_id": token_id, "position": index, "category": _class(token_id)[0],
+             "priority_level": _class(token_id)[1]}
+            for index, token_id in enumerate(ids, start=1)]
+    return _with_estimates(rows, model)
+
+
+def _apply(queue, delta, model):
+    """Client-side application, as documented on QueueDeltaTracker"""
+    dropped = set(delta["removed"]) | {move["token_id"] for move in delta["moved"]}
+    rows = {row["token_id"]: dict(row) for row in queue}
+    result = [rows[row["token_id"]] for row in queue if row["token_id"] not in dropped]
+    placed = [(row["position"], dict(row)) for row in delta["inserted"]]
+    placed += [(move["position"], rows[move["token_id"]]) for move in delta["moved"]]
+    for position, row in sorted(placed, key=lambda item: item[0]):
+        result.insert(position - 1, row)
+    by_id = {row["token_id"]: row for row in result}
+    for change in delta["updated"]:
+        by_id[change["token_id"]].update(change)
+    for position, row in enumerate(result, start=1):
+        row["position"] = position
+    return _with_estimates(result, model)
+
+
+def test_insert_at_head_is_one_entry_not_a_full_shift():
+    tracker = QueueDeltaTracker()
+    before = _queue(["a", "b", "c"])
+    tracker.publish(before, MODEL)
+    after = _queue(["x", "a", "b", "c"])
+    delta = tracker.publish(after, MODEL)
+    # Every row behind the insert now waits longer, yet none of them is listed
+    assert all(new["estimated_wait_time"] > old["estimated_wait_time"] for old, new in zip(before, after[1:]))
+    assert delta["seq"] == 2
+    assert [row["token_id"] for row in delta["inserted"]] == ["x"]
+    assert delta["moved"] == [] and delta["removed"] == [] and delta["updated"] == []
+    assert "wait_model" not in delta
+    assert _apply(before, delta, MODEL) == after
+
+
+def test_wait_model_change_is_sent_once_instead_of_every_row():
+    tracker = QueueDeltaTracker()
+    tracker.publish(_queue(["a", "b", "c"]), MODEL)
+    slower = {**MODEL, "counters": 1}
+    delta = tracker.publish(_queue(["a", "b", "c"], slower), slower)
+    assert delta["updated"] == [] and delta["wait_model"] == slower
+    assert tracker.snapshot()["wait_model"] == slower
+
+
+def test_unchanged_queue_publishes_nothing():
+    tracker = QueueDeltaTracker()
+    tracker.publish(_queue(["a"]), MODEL)
+    assert tracker.publish(_queue(["a"]), MODEL) is None
+    assert tracker.seq == 1
+
+
+def test_random_deltas_reconstruct_the_queue():
+    rng = random.Random(3)
+    tracker = QueueDeltaTracker()
+    ids, client, counter, model = [], [], 0, MODEL
+    for _ in range(300):
+        action = rng.random()
+        if ids and action < 0.3:
+            ids.remove(rng.choice(ids))
+        elif len(ids) > 1 and action < 0.5:
+            moved = ids.pop(rng.randrange(len(ids)))
+            ids.insert(rng.randrange(len(ids) + 1), moved)
+        else:
+            counter += 1
+            ids.insert(rng.randrange(len(ids) + 1), f"t{counter}")
+        if rng.random() < 0.1:
+            model = {"counters": rng.randrange(1, 4),
+                     "service_minutes": {"consult:4": rng.choice([15.0, 20.0]), "reports:5": 7.5}}
+        view = _queue(ids, model)
+        delta = tracker.publish(view, model)
+        if delta is not None:
+            client = _apply(client, delta, delta.get("wait_model", model))
+        assert client == view
+
+
+def test_resync_replays_buffered_deltas_then_falls_back_to_snapshot():
+    tracker = QueueDeltaTracker(history=2)
+    for size in range(1, 5):
+        tracker.publish(_queue([f"t{i}" for i in range(size)]))
+    assert [delta["seq"] for delta in tracker.since(2)] == [3, 4]
+    assert tracker.since(4) == []
+    assert tracker.since(1) is None
+    snapshot = tracker.snapshot()
+    assert snapshot["seq"] == 4 and len(snapshot["data"]) == 4
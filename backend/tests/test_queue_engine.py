@@ -0,0 +1,104 @@
+import asyncio
+import bisect
+import random
+from datetime import datetime, timedelta, timezone
+
+from src.core.queue_engine import QueueEngine, RankedSkipList
+
+
+def _token(token_id, priority, minutes):
+    created_at = datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=minutes)
+    return {"id": token_id, "token_number": token_id, "patient_name": token_id,
+            "priority_level": priority, "status": "active", "created_at": created_at}
+
+
+def test_skip_list_matches_sorted_list():
+    rng = random.Random(7)
+    skip_list, reference = RankedSkipList(), []
+    for _ in range(3000):
+        if reference and rng.random() < 0.4:
+            key = rng.choice(reference)
+            rank = bisect.bisect_left(reference, key)
+            reference.pop(rank)
+            assert skip_list.remove(key) == rank
+        else:
+            key = rng.random()
+            rank = bisect.bisect_left(reference, key)
+            reference.insert(rank, key)
+            assert skip_list.insert(key) == rank
+    assert list(skip_list) == reference
+    for index in range(0, len(reference), 37):
+        assert skip_list.select(index) == reference[index]
+        assert skip_list.rank(reference[index]) == index
+
+
+def test_engine_orders_by_priority_then_arrival():
+    engine = QueueEngine()
+    assert engine.add(_token("a", 4, 0)) == 1
+    assert engine.add(_token("b", 4, 1)) == 2
+    assert engine.add(_token("c", 1, 2)) == 1
+    assert engine.add(_token("d", 2, 3)) == 2
+    assert engine.ordered_ids() == ["c", "d", "a", "b"]
+
+    assert engine.remove("d") == 2
+    assert engine.position("a") == 2
+    assert engine.remove("missing") is None
+
+    # "b" arrived before "c", so it moves ahead of it within the CRITICAL class
+    assert engine.reprioritize("b", 1) == (3, 1)
+    assert engine.ordered_ids() == ["b", "c", "a"]
+    assert engine.token_at(3) == "a"
+
+
+def test_engine_mixes_naive_and_aware_timestamps():
+    engine = QueueEngine()
+    engine.add(_token("aware", 3, 5))
+    naive = _token("naive", 3, 0)
+    naive["created_at"] = naive["created_at"].replace(tzinfo=None)
+    assert engine.add(naive) == 1
+
+
+class SlowTokens:
+    """Active tokens handed out one at a time, so the test can act while a load is reading"""
+
+    def __init__(self, tokens, on_read):
+        self.tokens = tokens
+        self.on_read = on_read
+
+    async def find(self, query, projection=None):
+        for index, token in enumerate(self.tokens):
+            await asyncio.sleep(0)
+            self.on_read(index)
+            yield dict(token)
+
+
+def test_reload_swaps_in_at_once_and_keeps_changes_made_meanwhile():
+    engine = QueueEngine()
+    engine.add(_token("old", 3, 0))
+    engine.add(_token("called", 3, 1))
+    seen = []
+
+    def on_read(index):
+        # Readers mid-load see the previous queue, never a partial one
+        seen.append(engine.ordered_ids())
+        if index == 0:
+            engine.add(_token("new", 1, 5))
+            engine.remove("called")
+
+    stored = [_token("old", 3, 0), _token("called", 3, 1)]
+    asyncio.run(engine.load(SlowTokens(stored, on_read)))
+    assert seen[0] == ["old", "called"]
+    assert seen[1] == ["new", "old"]
+    assert engine.ordered_ids() == ["new", "old"]
+
+
+def test_claim_on_an_empty_category_reports_nothing_stale():
+    engine = QueueEngine()
+    engine.add(_token("a", 3, 0))
+
+    class Tokens:
+        async def find_one_and_update(self, query, update, return_document=None):
+            return None
+
+    assert asyncio.run(engine.claim_head(Tokens(), {}, category="emergency")) == (None, 0)
+    assert asyncio.run(engine.claim_head(Tokens(), {})) == (None, 1)
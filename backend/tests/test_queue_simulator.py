@@ -0,0 +1,12 @@
+from src.scripts.queue_simulator import QueueSimulator, synthetic_trace
+
+
+def test_simulator_serves_every_arrival_in_priority_order():
+    trace = synthetic_trace(arrivals_per_hour=40, hours=2, seed=1)
+    report = QueueSimulator(trace, counters=3).run()
+
+    assert report["arrivals"] == len(trace)
+    assert report["served"] == len(trace)
+    assert set(report["operation_latency_us"]) >= {"insert", "remove", "rank_head", "estimate_queue"}
+    waits = report["wait_minutes_by_priority"]
+    assert waits["1"]["p50"] <= waits["4"]["p50"]
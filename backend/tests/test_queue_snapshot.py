@@ -0,0 +1,56 @@
+import json
+from datetime import datetime, timezone
+
+from src.core.queue_engine import QueueEngine
+from src.core.queue_snapshot import QueueSnapshotCache
+
+
+def _cache():
+    engine = QueueEngine()
+    calls = []
+
+    def build():
+        calls.append(engine.version)
+        return {"queue": [{"token_id": entry["id"], "created_at": entry["created_at"]}
+                          for entry in engine.entries()], "total_count": len(engine)}
+
+    cache = QueueSnapshotCache(build=build, stamp=lambda: (engine.version,))
+    return engine, cache, calls
+
+
+def _add(engine, token_id):
+    engine.add({"id": token_id, "token_number": token_id, "patient_name": token_id, "priority_level": 4,
+                "status": "active", "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc)})
+
+
+def test_snapshot_is_built_once_per_version():
+    engine, cache, calls = _cache()
+    _add(engine, "a")
+    first_etag, first = cache.check(None)
+    second_etag, second = cache.check(None)
+    assert first_etag == second_etag and first is second
+    assert calls == [engine.version]
+    assert json.loads(first)["queue"][0]["created_at"] == "2025-01-01T00:00:00+00:00"
+
+    _add(engine, "b")
+    etag, body = cache.check(first_etag)
+    assert etag != first_etag
+    assert json.loads(body)["total_count"] == 2
+    assert len(calls) == 2
+
+
+def test_matching_if_none_match_skips_the_build():
+    engine, cache, calls = _cache()
+    etag = cache.etag()
+    assert cache.check(etag) == (etag, None)
+    assert cache.check(f'"other", W/{etag}') == (etag, None)
+    assert cache.check("*") == (etag, None)
+    assert calls == []
+    assert cache.stats()["not_modified"] == 3
+
+
+def test_etag_differs_across_process_epochs():
+    engine = QueueEngine()
+    one = QueueSnapshotCache(build=dict, stamp=lambda: (engine.version,))
+    two = QueueSnapshotCache(build=dict, stamp=lambda: (engine.version,))
+    assert one.etag() != two.etag()
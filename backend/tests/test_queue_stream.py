@@ -0,0 +1,65 @@
+import asyncio
+import json
+
+from src.core.queue_delta import QueueDeltaTracker
+from src.queue_stream import QueueStreamHub
+
+
+def _rows(*ids):
+    return [
+        {"token_id": token_id, "token_number": token_id.upper(), "position": index, "patient_name": "P"}
+        for index, token_id in enumerate(ids, start=1)
+    ]
+
+
+def _parse(chunk):
+    fields = dict(line.split(": ", 1) for line in chunk.decode().strip().split("\n"))
+    return fields.get("id"), fields.get("event"), json.loads(fields["data"]) if "data" in fields else None
+
+
+def _publish(hub, rows):
+    delta = hub.deltas.publish(rows)
+    hub.publish(delta)
+    return delta
+
+
+def test_stream_starts_with_a_projected_snapshot_then_deltas():
+    async def run():
+        hub = QueueStreamHub(QueueDeltaTracker())
+        _publish(hub, _rows("a", "b"))
+        events = hub.events(fields=frozenset({"token_number", "position"}))
+        assert (await events.__anext__()).startswith(b"retry:")
+        snapshot = _parse(await events.__anext__())
+        _publish(hub, _rows("b", "c"))
+        delta = _parse(await events.__anext__())
+        await events.aclose()
+        return hub, snapshot, delta
+
+    hub, snapshot, delta = asyncio.run(run())
+    assert snapshot[0] == f"{hub.epoch}-1" and snapshot[1] == "queue_snapshot"
+    assert snapshot[2]["data"][0] == {"token_id": "a", "token_number": "A", "position": 1}
+    assert delta[1] == "queue_delta"
+    assert delta[2]["removed"] == ["a"]
+    assert delta[2]["inserted"] == [{"token_id": "c", "token_number": "C", "position": 2}]
+    assert hub.streams == set()
+
+
+def test_last_event_id_resumes_only_on_the_same_epoch():
+    async def run():
+        hub = QueueStreamHub(QueueDeltaTracker())
+        for ids in (("a",), ("a", "b"), ("b",)):
+            _publish(hub, _rows(*ids))
+        resumed = hub.events(last_event_id=f"{hub.epoch}-1")
+        await resumed.__anext__()
+        replay = [_parse(await resumed.__anext__()) for _ in range(2)]
+        other_worker = hub.events(last_event_id="deadbeef-1")
+        await other_worker.__anext__()
+        fresh = _parse(await other_worker.__anext__())
+        await resumed.aclose()
+        await other_worker.aclose()
+        return hub, replay, fresh
+
+    hub, replay, fresh = asyncio.run(run())
+    assert [event[0] for event in replay] == [f"{hub.epoch}-2", f"{hub.epoch}-3"]
+    assert fresh[1] == "queue_snapshot" and fresh[2]["seq"] == 3
+    assert hub.stats["resumed"] == 1
@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+
+from src.core.rate_limiter import InProcessBucketBackend, RateLimited, RateLimiter, parse_networks
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_bucket_allows_a_burst_then_refills():
+    async def run():
+        clock = Clock()
+        limiter = RateLimiter(ip_burst=3, ip_per_minute=60, email_burst=0, clock=clock)
+        for _ in range(3):
+            await limiter.check("10.0.0.1")
+        with pytest.raises(RateLimited) as refused:
+            await limiter.check("10.0.0.1")
+        await limiter.check("10.0.0.2")
+        clock.now += 1
+        await limiter.check("10.0.0.1")
+        return refused.value.retry_after, limiter.stats
+
+    retry_after, stats = asyncio.run(run())
+    assert retry_after == pytest.approx(1.0)
+    assert stats["allowed"] == 5 and stats["rejected"] == 1 and stats["rejected_ip"] == 1
+
+
+def test_one_email_is_limited_across_addresses_and_case():
+    async def run():
+        limiter = RateLimiter(ip_burst=100, email_burst=2, email_per_minute=1, clock=Clock())
+        await limiter.check("10.0.0.1", "Nurse@Example.com")
+        await limiter.check("10.0.0.2", "nurse@example.com ")
+        with pytest.raises(RateLimited):
+            await limiter.check("10.0.0.3", "nurse@example.com")
+        await limiter.check("10.0.0.3", "doctor@example.com")
+        return limiter.stats
+
+    stats = asyncio.run(run())
+    assert stats["rejected_email"] == 1 and stats["rejected_ip"] == 0
+
+
+def test_store_errors_let_attempts_through():
+    class Broken:
+        async def take(self, *args):
+            raise ConnectionError("store down")
+
+    async def run():
+        limiter = RateLimiter(backend=Broken(), clock=Clock())
+        await limiter.check("10.0.0.1", "a@example.com")
+        return limiter.stats
+
+    stats = asyncio.run(run())
+    assert stats["allowed"] == 1 and stats["backend_errors"] == 2
+
+
+def test_memory_backend_drops_least_recently_used_buckets():
+    async def run():
+        backend = InProcessBucketBackend(max_keys=2)
+        for key in ("a", "b", "c"):
+            await backend.take(key, 1, 1, 0)
+        return len(backend), backend.evicted, await backend.take("a", 1, 1, 0)
+
+    size, evicted, a_again = asyncio.run(run())
+    assert size == 2 and evicted == 1
+    assert a_again == (True, 0)
+
+
+def test_forwarded_for_is_only_believed_from_trusted_proxies():
+    limiter = RateLimiter(trusted_proxies=parse_networks("10.0.0.0/8, 127.0.0.1"))
+    # The ingress appends the address it saw; anything to its left came from the client
+    assert limiter.client_ip("10.1.2.3", "6.6.6.6, 203.0.113.7") == "203.0.113.7"
+    assert limiter.client_ip("10.1.2.3", "203.0.113.7, 10.9.9.9") == "203.0.113.7"
+    assert limiter.client_ip("203.0.113.7", "6.6.6.6") == "203.0.113.7"
+    assert limiter.client_ip("10.1.2.3", "") == "10.1.2.3"
+    # All hops trusted: a client inside the range cannot mint new buckets by varying the left hops
+    assert limiter.client_ip("10.1.2.3", "10.4.4.4, 127.0.0.1") == "127.0.0.1"
+    assert limiter.client_ip("10.1.2.3", "10.5.5.5, 127.0.0.1") == "127.0.0.1"
+    assert limiter.client_ip(None, "6.6.6.6") is None
+    assert RateLimiter().client_ip("10.1.2.3", "203.0.113.7") == "10.1.2.3"
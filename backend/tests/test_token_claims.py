@@ -0,0 +1,45 @@
+import asyncio
+
+from src.core.principal_cache import user_changed
+from src.core.token_claims import TokenClaims, principal_claims, token_claims
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def payload(issued_at, **claims):
+    return {"sub": "u1", "iat": issued_at, **principal_claims({"role": "staff", "name": "S", "email": "s@x.com"}),
+            **claims}
+
+
+def test_fresh_complete_claims_stand_in_for_the_user():
+    clock = Clock()
+    claims = TokenClaims(max_age_seconds=900, clock=clock)
+    assert claims.principal(payload(990)) == {"id": "u1", "role": "staff", "name": "S", "email": "s@x.com",
+                                              "phone": ""}
+    assert claims.principal({"sub": "u1", "iat": 990}) is None
+    clock.now += 900
+    assert claims.principal(payload(990)) is None
+    assert claims.stats == {"claims": 1, "lookups": 2, "changed": 0}
+
+
+def test_tokens_issued_before_a_change_are_looked_up_until_the_window_passes():
+    clock = Clock()
+    claims = TokenClaims(max_age_seconds=900, clock=clock)
+    claims.changed("u1", 995.5)
+    assert claims.principal(payload(995)) is None
+    assert claims.principal(payload(996)) is not None
+    assert claims.principal(payload(995, sub="u2")) is not None
+    clock.now += 1000
+    assert claims.counts()["recently_changed"] == 0
+
+
+def test_user_changed_events_reach_the_claims_list():
+    token_claims.configure(max_age_seconds=900)
+    asyncio.run(user_changed("u3"))
+    assert token_claims.principal({**payload(0), "sub": "u3", "iat": int(token_claims._clock()) - 1}) is None
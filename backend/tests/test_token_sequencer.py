@@ -0,0 +1,62 @@
+import asyncio
+from datetime import datetime
+
+from src.core.token_sequencer import TokenNumberSequencer
+
+
+class CounterCollection:
+    """Minimal stand-in for the token_counters collection"""
+
+    def __init__(self):
+        self.values = {}
+        self.calls = 0
+
+    async def find_one_and_update(self, query, update, upsert=False, return_document=None):
+        self.calls += 1
+        await asyncio.sleep(0)
+        key = query["_id"]
+        self.values[key] = self.values.get(key, 0) + update["$inc"]["value"]
+        return {"_id": key, "value": self.values[key]}
+
+
+def test_numbers_are_unique_and_reserved_in_blocks():
+    collection = CounterCollection()
+    sequencer = TokenNumberSequencer(collection, block_size=10)
+    now = datetime(2025, 10, 3, 9, 30)
+
+    async def run():
+        return await asyncio.gather(*(sequencer.next_token_number("E", now) for _ in range(25)))
+
+    numbers = asyncio.run(run())
+    assert sorted(numbers) == [f"E-{i:03d}-031025" for i in range(1, 26)]
+    assert collection.calls == 3
+
+
+def test_workers_never_share_numbers():
+    collection = CounterCollection()
+    workers = [TokenNumberSequencer(collection, block_size=5) for _ in range(3)]
+    now = datetime(2025, 10, 3, 9, 30)
+
+    async def run():
+        batches = [worker.next_values("ML", 7, now) for worker in workers]
+        return await asyncio.gather(*batches)
+
+    values = [value for batch in asyncio.run(run()) for value in batch]
+    assert sorted(values) == list(range(1, 22))
+
+
+def test_day_is_read_once_across_midnight(monkeypatch):
+    import src.core.token_sequencer as module
+
+    readings = iter([datetime(2025, 10, 3, 23, 59, 59), datetime(2025, 10, 4, 0, 0, 0)])
+
+    class Clock(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return next(readings)
+
+    monkeypatch.setattr(module, "datetime", Clock)
+    collection = CounterCollection()
+    number = asyncio.run(TokenNumberSequencer(collection).next_token_number("E"))
+    assert number == "E-001-031025"
+    assert list(collection.values) == ["E-031025"]
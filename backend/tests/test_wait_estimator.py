@@ -0,0 +1,69 @@
+import random
+from datetime import datetime, timedelta, timezone
+
+from src.core.queue_engine import QueueEngine
+from src.core.wait_estimator import P2Quantile, WaitTimeEstimator
+
+PRIORS = {1: 0, 2: 5, 3: 15, 4: 20, 5: 5, 6: 10}
+
+
+def test_p2_quantile_tracks_distribution():
+    rng = random.Random(3)
+    samples = [rng.expovariate(1 / 12) for _ in range(20000)]
+    sketch = P2Quantile(0.9)
+    for sample in samples:
+        sketch.add(sample)
+    exact = sorted(samples)[int(0.9 * len(samples))]
+    assert abs(sketch.value() - exact) / exact < 0.05
+
+
+def test_estimates_fall_back_to_priors_until_enough_samples():
+    estimator = WaitTimeEstimator(PRIORS, min_samples=3)
+    queue = [{"id": "a", "category": "report_pickup", "priority_level": 5},
+             {"id": "b", "category": "regular_consultation", "priority_level": 4},
+             {"id": "c", "category": "regular_consultation", "priority_level": 4}]
+    assert estimator.estimate(queue).tolist() == [0, 5, 25]
+
+    called_at = datetime.now(timezone.utc)
+    for _ in range(3):
+        estimator.record_service({"category": "report_pickup", "called_at": called_at},
+                                 called_at + timedelta(minutes=2))
+    assert estimator.estimate(queue).tolist() == [0, 2, 22]
+
+
+def test_queue_estimates_are_cached_per_queue_version():
+    engine = QueueEngine()
+    estimator = WaitTimeEstimator(PRIORS, counters=2)
+    now = datetime.now(timezone.utc)
+    engine.add({"id": "x", "priority_level": 4, "category": "regular_consultation", "created_at": now})
+    engine.add({"id": "y", "priority_level": 4, "category": "regular_consultation", "created_at": now + timedelta(seconds=1)})
+    first = estimator.queue_estimates(engine)
+    assert first == {"x": 0, "y": 10}
+    assert estimator.queue_estimates(engine) is first
+
+    engine.remove("x")
+    assert estimator.queue_estimates(engine) == {"y": 0}
+
+
+def test_wait_model_reproduces_the_estimates():
+    rng = random.Random(5)
+    engine = QueueEngine()
+    estimator = WaitTimeEstimator(PRIORS, counters=3)
+    start = datetime.now(timezone.utc)
+    called_at = start - timedelta(hours=1)
+    for _ in range(6):
+        estimator.record_service({"category": "report_pickup", "called_at": called_at},
+                                 called_at + timedelta(minutes=rng.uniform(1, 9)))
+    categories = {5: "report_pickup", 4: "regular_consultation", 2: "urgent_medical"}
+    for index in range(40):
+        priority = rng.choice(list(categories))
+        engine.add({"id": f"t{index}", "priority_level": priority, "category": categories[priority],
+                    "created_at": start + timedelta(seconds=index)})
+
+    model = estimator.wait_model(engine)
+    total, recomputed = 0.0, {}
+    for entry in engine.entries():
+        service = model["service_minutes"][f"{entry['category']}:{entry['priority_level']}"]
+        total += service
+        recomputed[entry["id"]] = round((total - service) / model["counters"])
+    assert recomputed == estimator.queue_estimates(engine)
@@ -0,0 +1,331 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+
+from src.websocket_manager import ConnectionManager
+
+
+class FakeSocket:
+    def __init__(self):
+        self.sent = []
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, message):
+        self.sent.append(json.loads(message))
+
+
+def _manager(window=0.05):
+    queue = []
+    manager = ConnectionManager(coalesce_window=window)
+    manager.configure(queue_source=lambda: [
+        {"token_id": token_id, "position": index} for index, token_id in enumerate(queue, start=1)
+    ])
+    return manager, queue
+
+
+def test_burst_of_changes_is_flushed_once():
+    async def run():
+        manager, queue = _manager()
+        staff = FakeSocket()
+        await manager.connect(staff, "s1", "staff")
+        for index in range(10):
+            queue.append(f"t{index}")
+            await manager.send_token_update({"id": f"t{index}", "status": "active"})
+            manager.queue_changed()
+        await asyncio.sleep(0.1)
+        return manager, staff.sent
+
+    manager, sent = asyncio.run(run())
+    assert [message["type"] for message in sent] == ["queue_snapshot", "queue_delta"]
+    assert len(sent[1]["inserted"]) == 10
+    assert len(sent[1]["tokens"]) == 10
+    assert manager.coalesce_stats["flushes"] == 1
+
+
+def test_urgent_change_skips_the_window():
+    async def run():
+        manager, queue = _manager(window=10)
+        admin = FakeSocket()
+        await manager.connect(admin, "a1", "admin")
+        queue.append("routine")
+        manager.queue_changed()
+        queue.insert(0, "emergency")
+        manager.queue_changed(urgent=True)
+        await asyncio.sleep(0.01)
+        return admin.sent
+
+    sent = asyncio.run(run())
+    assert [row["token_id"] for row in sent[-1]["inserted"]] == ["emergency", "routine"]
+
+
+class StalledSocket(FakeSocket):
+    def __init__(self):
+        super().__init__()
+        self.release = asyncio.Event()
+        self.closed_with = None
+
+    async def send_text(self, message):
+        await self.release.wait()
+        await super().send_text(message)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_stalled_socket_never_delays_other_sockets():
+    async def run():
+        manager = ConnectionManager(send_queue_size=4, send_timeout=30)
+        stalled, healthy = StalledSocket(), FakeSocket()
+        await manager.connect(stalled, "slow", "staff")
+        await manager.connect(healthy, "fast", "staff")
+        for index in range(3):
+            await manager.send_queue_update([{"token_id": f"t{index}", "position": 1}])
+        await asyncio.sleep(0.01)
+        return manager, stalled, healthy
+
+    manager, stalled, healthy = asyncio.run(run())
+    assert len(healthy.sent) == 4
+    assert stalled.sent == []
+    slow = next(conn for conn in manager.stats()["connections"] if conn["user_id"] == "slow")
+    assert slow["queue_depth"] >= 3
+
+
+def test_overflow_downgrades_to_snapshot_only_then_evicts():
+    async def run():
+        manager = ConnectionManager(send_queue_size=2, send_timeout=30)
+        stalled = StalledSocket()
+        await manager.connect(stalled, "slow", "staff")
+        for index in range(4):
+            await manager.send_queue_update([{"token_id": f"t{index}", "position": 1}])
+        writer = manager.writers[stalled]
+        assert writer.snapshot_only
+        # Further deltas collapse into the single pending snapshot
+        await manager.send_queue_update([{"token_id": "t9", "position": 1}])
+        assert writer.queue.qsize() <= 2
+
+        writer.offer("personal-1")
+        writer.offer("personal-2")
+        await asyncio.sleep(0.01)
+        return manager, stalled
+
+    manager, stalled = asyncio.run(run())
+    assert stalled not in manager.writers
+    assert stalled.closed_with == 1013
+    assert manager.stats()["downgraded"] == 1
+    assert manager.stats()["evicted"] == 1
+
+
+def _patient_queue(count):
+    from src.core.queue_engine import queue_engine
+
+    base = datetime(2025, 1, 6, 9, 0, tzinfo=timezone.utc)
+    for index in range(count):
+        queue_engine.add({
+            "id": f"pos-{index}", "token_number": f"R-{index:03d}", "patient_id": f"p{index}",
+            "patient_name": "P", "priority_level": 4, "category": "regular_consultation",
+            "status": "active", "created_at": base + timedelta(minutes=index),
+        })
+    manager = ConnectionManager(coalesce_window=0)
+    manager.configure(position_step=3, eta_step=5, near_head=2, queue_source=lambda: [
+        {"token_id": entry["id"], "position": position, "estimated_wait_time": position}
+        for position, entry in enumerate(queue_engine.entries(), start=1)
+    ])
+    return manager, queue_engine
+
+
+def test_position_pushes_only_cross_thresholds():
+    async def run():
+        manager, engine = _patient_queue(8)
+        try:
+            patient = FakeSocket()
+            await manager.connect(patient, "p7", "patient")
+            manager.subscribe_position(patient, "pos-7")
+            await asyncio.sleep(0.01)
+            # Position 8 -> 7 -> 6 stays under the step, 5 crosses it
+            for token_id in ("pos-0", "pos-1", "pos-2"):
+                engine.remove(token_id)
+                await manager.flush_queue_update()
+            await asyncio.sleep(0.01)
+            # 4 and 3 are suppressed again; within the first two places every move is pushed
+            for token_id in ("pos-3", "pos-4", "pos-5", "pos-6", "pos-7"):
+                engine.remove(token_id)
+                await manager.flush_queue_update()
+            await asyncio.sleep(0.01)
+            return manager, patient.sent
+        finally:
+            engine.clear()
+
+    manager, sent = asyncio.run(run())
+    assert [message["position"] for message in sent] == [8, 5, 2, 1, 0]
+    assert sent[0] == {"type": "position_update", "token_id": "pos-7", "position": 8,
+                       "estimated_wait_time": 8, "total_count": 8}
+    assert manager.position_subscriptions == {}
+    assert manager.position_stats["suppressed"] == 4
+
+
+def test_patients_cannot_follow_other_patients_tokens():
+    async def run():
+        manager, engine = _patient_queue(2)
+        try:
+            patient, staff = FakeSocket(), FakeSocket()
+            await manager.connect(patient, "p0", "patient")
+            await manager.connect(staff, "s1", "staff")
+            refused = manager.subscribe_position(patient, "pos-1")
+            allowed = manager.subscribe_position(staff, "pos-1")
+            await asyncio.sleep(0.01)
+            return refused, allowed, patient.sent, staff.sent
+        finally:
+            engine.clear()
+
+    refused, allowed, patient_sent, staff_sent = asyncio.run(run())
+    assert not refused and allowed
+    assert patient_sent == [{"type": "error", "detail": "Token not found in queue", "token_id": "pos-1"}]
+    assert staff_sent[-1]["type"] == "position_update" and staff_sent[-1]["position"] == 2
+
+
+def test_every_tab_of_a_user_gets_personal_messages():
+    async def run():
+        manager = ConnectionManager()
+        first, second = FakeSocket(), FakeSocket()
+        await manager.connect(first, "p1", "patient")
+        await manager.connect(second, "p1", "patient")
+        await manager.send_personal_message('{"n": 1}', "p1")
+        await asyncio.sleep(0.01)
+        manager.disconnect(first, "p1", "patient")
+        manager.disconnect(first, "p1", "patient")
+        await manager.send_personal_message('{"n": 2}', "p1")
+        await asyncio.sleep(0.01)
+        remaining = (list(manager.user_connections["p1"]), list(manager.active_connections["patient"]))
+        manager.disconnect(second, "p1", "patient")
+        return manager, first.sent, second.sent, remaining, second
+
+    manager, first_sent, second_sent, (users, patients), second = asyncio.run(run())
+    assert first_sent == [{"n": 1}]
+    assert second_sent == [{"n": 1}, {"n": 2}]
+    assert users == patients == [second]
+    assert manager.user_connections == {} and manager.active_connections["patient"] == {}
+
+
+class ClientSocket(FakeSocket):
+    def __init__(self, host):
+        super().__init__()
+        self.client = type("Address", (), {"host": host})()
+        self.accepted = False
+        self.closed_with = None
+
+    async def accept(self):
+        self.accepted = True
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def test_connection_limits_refuse_the_handshake():
+    async def run():
+        manager = ConnectionManager()
+        manager.configure(max_connections_per_user=2, max_connections_per_ip=3,
+                          max_connections_per_role={"staff": 1})
+        tabs = [ClientSocket("10.0.0.1") for _ in range(3)]
+        results = [await manager.connect(tab, "p1", "patient") for tab in tabs]
+        other_user = ClientSocket("10.0.0.1")
+        results.append(await manager.connect(other_user, "p2", "patient"))
+        results.append(await manager.connect(ClientSocket("10.0.0.1"), "p3", "patient"))
+        results.append(await manager.connect(ClientSocket("10.0.0.2"), "s1", "staff"))
+        results.append(await manager.connect(ClientSocket("10.0.0.3"), "s2", "staff"))
+        manager.disconnect(tabs[0], "p1", "patient")
+        return manager, tabs, results
+
+    manager, tabs, results = asyncio.run(run())
+    assert results == [True, True, False, True, False, True, False]
+    assert not tabs[2].accepted and tabs[2].closed_with == 1013
+    counts = manager.counts()
+    assert counts["total"] == 3 and counts["rejected"] == 3
+    assert counts["by_role"] == {"patient": 2, "staff": 1, "admin": 0}
+    assert manager.ip_connections == {"10.0.0.1": 2, "10.0.0.2": 1}
+
+
+def test_limits_follow_the_registered_identity():
+    async def run():
+        manager = ConnectionManager()
+        manager.configure(max_connections_per_user=1, max_connections_per_role={"staff": 1})
+        staff = ClientSocket("10.0.0.1")
+        results = [await manager.connect(staff, "s1", "staff")]
+        # Roles outside the known ones would escape every role limit
+        unknown = ClientSocket("10.0.0.2")
+        results.append(await manager.connect(unknown, "s2", "superstaff"))
+        # A caller passing other ids still frees the slots the socket holds
+        manager.disconnect(staff, "someone-else", "patient")
+        results.append(await manager.connect(ClientSocket("10.0.0.3"), "s1", "staff"))
+        return manager, unknown, results
+
+    manager, unknown, results = asyncio.run(run())
+    assert results == [True, False, True]
+    assert not unknown.accepted and "superstaff" not in manager.active_connections
+    assert list(manager.user_connections) == ["s1"]
+    assert manager.counts()["by_role"] == {"patient": 0, "staff": 1, "admin": 0}
+
+
+def test_silent_sockets_are_reaped_and_pongs_keep_them():
+    async def run():
+        manager = ConnectionManager()
+        manager.configure(idle_timeout=30)
+        silent, answering = ClientSocket("10.0.0.1"), ClientSocket("10.0.0.2")
+        await manager.connect(silent, "p1", "patient")
+        await manager.connect(answering, "p2", "patient")
+        start = manager.writers[silent].last_seen
+        assert await manager.handle_message(answering, '{"type": "pong"}')
+        manager.writers[answering].last_seen = start + 20
+        reaped = manager.reap_idle(now=start + 45)
+        await asyncio.sleep(0.01)
+        return manager, silent, answering, reaped
+
+    manager, silent, answering, reaped = asyncio.run(run())
+    assert reaped == 1
+    assert silent.closed_with == 1013 and silent not in manager.writers
+    assert answering in manager.writers
+    assert manager.counts()["reaped"] == 1
+
+
+def test_snapshot_after_a_load_holds_the_loaded_queue():
+    from src.core.queue_engine import QueueEngine
+
+    class Tokens:
+        async def find(self, query, projection=None):
+            for index in range(3):
+                yield {"id": f"t{index}", "token_number": f"R-{index}", "patient_name": "P", "priority_level": 4,
+                       "status": "active", "created_at": datetime(2025, 1, 1, tzinfo=timezone.utc) + timedelta(minutes=index)}
+
+    async def run():
+        engine = QueueEngine()
+        manager = ConnectionManager()
+        manager.configure(queue_source=lambda: [
+            {"token_id": entry["id"], "position": position} for position, entry in enumerate(engine.entries(), start=1)
+        ])
+        await engine.load(Tokens())
+        # What the apps do at startup, before any mutation has been broadcast
+        await manager.flush_queue_update()
+        staff = FakeSocket()
+        await manager.connect(staff, "s1", "staff")
+        await asyncio.sleep(0.01)
+        return staff.sent
+
+    sent = asyncio.run(run())
+    assert sent[0]["type"] == "queue_snapshot"
+    assert [row["token_id"] for row in sent[0]["data"]] == ["t0", "t1", "t2"]
+
+
+def test_per_ip_limit_uses_the_resolved_client_address():
+    async def run():
+        manager = ConnectionManager()
+        manager.configure(max_connections_per_ip=1)
+        # Every socket arrives from the ingress; the resolved client addresses differ
+        first = await manager.connect(ClientSocket("10.0.0.9"), "p1", "patient", "203.0.113.1")
+        second = await manager.connect(ClientSocket("10.0.0.9"), "p2", "patient", "203.0.113.2")
+        repeat = await manager.connect(ClientSocket("10.0.0.9"), "p3", "patient", "203.0.113.1")
+        return manager, [first, second, repeat]
+
+    manager, results = asyncio.run(run())
+    assert results == [True, True, False]
+    assert manager.ip_connections == {"203.0.113.1": 1, "203.0.113.2": 1}
@@ -10,7 +10,7 @@ import api from '../utils/api';
 import useWebSocket from '../hooks/useWebSocket';
 
 const PatientDashboard = () => {
-  const { user, logout } = useAuth();
+  const { user, token, logout } = useAuth();
   const [activeToken, setActiveToken] = useState(null);
   const [tokenHistory, setTokenHistory] = useState([]);
   const [loading, setLoading] = useState(false);
@@ -18,8 +18,11 @@ const PatientDashboard = () => {
   const [queueData, setQueueData] = useState([]);
   
   // WebSocket connection for real-time updates
-  const wsUrl = user ? `ws://localhost:8000/ws/${user.id}/${user.role}` : null;
-  const { isConnected, lastMessage, error } = useWebSocket(wsUrl);
+  // Browsers cannot set headers on a WebSocket handshake, so the JWT goes in the query string
+  const wsUrl = user && token
+    ? `ws://localhost:8000/ws/${user.id}/${user.role}?access_token=${encodeURIComponent(token)}`
+    : null;
+  const { isConnected, lastMessage, error, sendMessage } = useWebSocket(wsUrl);
 
   const [tokenForm, setTokenForm] = useState({
     category: '',
@@ -38,7 +41,12 @@ const PatientDashboard = () => {
   useEffect(() => {
     fetchTokens();
     fetchQueue();
-    
+  }, []);
+
+  useEffect(() => {
+    // Position pushes replace polling while the socket is up
+    if (isConnected) return undefined;
+
     // Set up polling for real-time updates (fallback)
     const interval = setInterval(() => {
       fetchTokens();
@@ -46,7 +54,14 @@ const PatientDashboard = () => {
     }, 60000); // Poll every 60 seconds as fallback
 
     return () => clearInterval(interval);
-  }, []);
+  }, [isConnected]);
+
+  // Follow the active token's position; re-sent after every reconnect
+  useEffect(() => {
+    if (isConnected && activeToken?.id && activeToken.status === 'active') {
+      sendMessage({ type: 'subscribe_position', token_id: activeToken.id });
+    }
+  }, [isConnected, activeToken?.id]);
 
   // Handle WebSocket messages for real-time updates
   useEffect(() => {
@@ -63,6 +78,19 @@ const PatientDashboard = () => {
             fetchQueue();
           }
           break;
+        case 'position_update':
+          if (activeToken?.id !== lastMessage.token_id) break;
+          if (lastMessage.position === 0) {
+            // Left the queue: called, completed or cancelled
+            fetchTokens();
+          } else {
+            setActiveToken(prev => ({
+              ...prev,
+              position: lastMessage.position,
+              estimated_wait_time: lastMessage.estimated_wait_time
+            }));
+          }
+          break;
         case 'queue_update':
           // Update queue data
           setQueueData(lastMessage.data);
@@ -138,7 +166,9 @@ const PatientDashboard = () => {
   };
 
   const getPositionInQueue = () => {
-    if (!activeToken || !queueData.length) return null;
+    if (!activeToken) return null;
+    if (activeToken.position) return activeToken.position;
+    if (!queueData.length) return null;
     
     const tokenInQueue = queueData.find(item => item.token_id === activeToken.id);
     return tokenInQueue ? tokenInQueue.position : null;
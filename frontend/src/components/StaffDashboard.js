@@ -1,4 +1,4 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useAuth } from '../App';
 import { Button } from '@/components/ui/button';
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from '@/components/ui/card';
@@ -11,9 +11,10 @@ import { Label } from '@/components/ui/label';
 import { toast } from 'sonner';
 import api from '../utils/api';
 import useWebSocket from '../hooks/useWebSocket';
+import { applyQueueDelta } from '../utils/queueDelta';
 
 const StaffDashboard = () => {
-  const { user, logout } = useAuth();
+  const { user, token, logout } = useAuth();
   const [queueData, setQueueData] = useState([]);
   const [loading, setLoading] = useState(false);
   const [selectedToken, setSelectedToken] = useState(null);
@@ -22,8 +23,15 @@ const StaffDashboard = () => {
   const [analytics, setAnalytics] = useState(null);
   
   // WebSocket connection for real-time updates
-  const wsUrl = user ? `ws://localhost:8000/ws/${user.id}/${user.role}` : null;
-  const { isConnected, lastMessage, error } = useWebSocket(wsUrl);
+  // Browsers cannot set headers on a WebSocket handshake, so the JWT goes in the query string
+  const wsUrl = user && token
+    ? `ws://localhost:8000/ws/${user.id}/${user.role}?access_token=${encodeURIComponent(token)}`
+    : null;
+  const { isConnected, lastMessage, error, sendMessage } = useWebSocket(wsUrl);
+  // Sequence number of the last queue snapshot/delta applied
+  const queueSeq = useRef(null);
+  // Service minutes per class and counter count; wait estimates are recomputed from it
+  const waitModel = useRef(null);
 
   const [tokenForm, setTokenForm] = useState({
     patient_name: '',
@@ -68,17 +76,44 @@ const StaffDashboard = () => {
     return () => clearInterval(interval);
   }, []);
 
+  // A reconnect starts from a fresh snapshot
+  useEffect(() => {
+    if (!isConnected) {
+      queueSeq.current = null;
+    }
+  }, [isConnected]);
+
   // Handle WebSocket messages for real-time updates
   useEffect(() => {
     if (lastMessage) {
       switch (lastMessage.type) {
-        case 'queue_update':
-          // Update queue data in real-time
+        case 'queue_snapshot':
+          queueSeq.current = lastMessage.seq;
+          waitModel.current = lastMessage.wait_model || null;
           setQueueData(lastMessage.data);
           break;
+        case 'queue_delta':
+          // Token changes from the same window ride along with the delta
+          if (lastMessage.tokens) {
+            fetchAnalytics();
+          }
+          if (queueSeq.current !== null && lastMessage.seq === queueSeq.current + 1) {
+            queueSeq.current = lastMessage.seq;
+            if (lastMessage.wait_model) {
+              waitModel.current = lastMessage.wait_model;
+            }
+            const model = waitModel.current;
+            setQueueData((queue) => applyQueueDelta(queue, lastMessage, model));
+          } else if (queueSeq.current === null || lastMessage.seq > queueSeq.current) {
+            // Missed an update; ask for the gap (or a fresh snapshot)
+            sendMessage({ type: 'resync', since: queueSeq.current });
+          }
+          break;
         case 'token_update':
-          // Refresh queue when tokens are created/updated
-          fetchQueue();
+          // Queue changes arrive as deltas once a snapshot is held
+          if (queueSeq.current === null) {
+            fetchQueue();
+          }
           fetchAnalytics();
           break;
         case 'analytics_update':
@@ -94,7 +129,12 @@ const StaffDashboard = () => {
   const fetchQueue = async () => {
     try {
       const response = await api.get('/queue');
-      setQueueData(response.data.queue || []);
+      if (queueSeq.current === null) {
+        setQueueData(response.data.queue || []);
+      } else {
+        // Deltas must apply on top of a sequenced snapshot, so refresh that instead of mixing in this copy
+        sendMessage({ type: 'resync' });
+      }
     } catch (error) {
       console.error('Error fetching queue:', error);
       toast.error('Failed to fetch queue data');
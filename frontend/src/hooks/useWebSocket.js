@@ -25,6 +25,11 @@ const useWebSocket = (url, options = {}) => {
       ws.onmessage = (event) => {
         try {
           const data = JSON.parse(event.data);
+          if (data.type === 'ping') {
+            // Server heartbeat: answer without re-rendering consumers
+            ws.send(JSON.stringify({ type: 'pong' }));
+            return;
+          }
           setLastMessage(data);
         } catch (err) {
           console.error('Error parsing WebSocket message:', err);
@@ -0,0 +1,46 @@
+// numpy's rint: halves round to the even neighbour, so results match the server
+const roundHalfEven = (value) => {
+  const rounded = Math.round(value);
+  return Math.abs(value % 1) === 0.5 && rounded % 2 !== 0 ? rounded - 1 : rounded;
+};
+
+// Recompute estimated_wait_time from queue order and the server's wait model:
+// the service minutes of everyone ahead, shared across the counters.
+export const applyWaitModel = (queue, waitModel) => {
+  if (!waitModel) {
+    return queue;
+  }
+  let total = 0;
+  return queue.map((entry) => {
+    const service = waitModel.service_minutes[`${entry.category || ''}:${entry.priority_level}`] || 0;
+    total += service;
+    return { ...entry, estimated_wait_time: roundHalfEven((total - service) / waitModel.counters) };
+  });
+};
+
+// Apply a server queue_delta to the current queue list.
+// Removed and moved entries are dropped, then moved and inserted entries are
+// placed at their new positions in ascending order, changed fields are merged
+// and positions are renumbered. Wait estimates are not sent per row; they are
+// recomputed from the latest wait model.
+export const applyQueueDelta = (queue, delta, waitModel) => {
+  const dropped = new Set([
+    ...delta.removed,
+    ...delta.moved.map((move) => move.token_id),
+  ]);
+  const byId = new Map(queue.map((entry) => [entry.token_id, entry]));
+  const result = queue.filter((entry) => !dropped.has(entry.token_id));
+
+  const placed = [
+    ...delta.inserted.map((entry) => ({ position: entry.position, entry })),
+    ...delta.moved.map((move) => ({ position: move.position, entry: byId.get(move.token_id) })),
+  ].sort((a, b) => a.position - b.position);
+  placed.forEach(({ position, entry }) => result.splice(position - 1, 0, entry));
+
+  const changes = new Map(delta.updated.map((change) => [change.token_id, change]));
+  return applyWaitModel(result.map((entry, index) => ({
+    ...entry,
+    ...changes.get(entry.token_id),
+    position: index + 1,
+  })), waitModel);
+};
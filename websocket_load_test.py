@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+WebSocket load test for the real-time queue updates.
+
+Opens N patient, staff and admin sockets against a running backend, drives
+token create/complete traffic through the REST API and measures how long
+each change takes to reach every socket that should see it:
+
+- token created   -> staff/admin sockets (queue_delta `inserted`)
+- token completed -> staff/admin sockets (queue_delta `removed`) and the
+                     patient's socket (`token_update` with status completed)
+
+Reports p50/p95/p99 delivery latency, messages that never arrived, server
+memory per connection and server CPU, as JSON so runs can be compared.
+Memory and CPU are read from /proc, so they need the server's pid (Linux)
+or --start-server, which launches uvicorn from backend/ with the connection
+limits lifted (every simulated client shares one IP). Sockets authenticate
+like the app's: simulated users get short-lived access tokens signed with
+the server's JWT secret (--jwt-secret, default $JWT_SECRET_KEY), carrying
+the claims the server accepts without a user lookup.
+
+    python websocket_load_test.py --patients 2000 --staff 20 --admins 5 \\
+        --tokens 300 --rate 30 --start-server
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import httpx
+import jwt
+import websockets
+
+CATEGORIES = ["regular_consultation", "report_pickup", "serious_condition", "urgent_medical", "emergency"]
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return round(ordered[index], 3)
+
+
+def latency_summary(values: List[float]) -> Dict[str, Any]:
+    return {
+        "count": len(values),
+        "p50_ms": percentile(values, 50),
+        "p95_ms": percentile(values, 95),
+        "p99_ms": percentile(values, 99),
+        "max_ms": round(max(values), 3) if values else None,
+    }
+
+
+class ProcessSampler:
+    """RSS and CPU time of the server process, read from /proc"""
+
+    def __init__(self, pid: Optional[int]):
+        self.pid = pid
+        self.ticks = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+    def rss_bytes(self) -> Optional[int]:
+        if not self.pid:
+            return None
+        try:
+            for line in Path(f"/proc/{self.pid}/status").read_text().splitlines():
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+    def cpu_seconds(self) -> Optional[float]:
+        if not self.pid:
+            return None
+        try:
+            fields = Path(f"/proc/{self.pid}/stat").read_text().rsplit(")", 1)[1].split()
+        except OSError:
+            return None
+        # utime and stime are fields 14 and 15 of /proc/<pid>/stat
+        return (int(fields[11]) + int(fields[12])) / self.ticks
+
+
+class LoadClient:
+    """One simulated socket; records when each watched change arrives"""
+
+    def __init__(self, test: "WebSocketLoadTest", user_id: str, role: str):
+        self.test = test
+        self.user_id = user_id
+        self.role = role
+        self.ws = None
+        self.task: Optional[asyncio.Task] = None
+        self.messages = 0
+        self.close_code: Optional[int] = None
+
+    async def connect(self):
+        url = f"{self.test.ws_url}/ws/{self.user_id}/{self.role}?access_token={self.test.access_token(self)}"
+        self.ws = await websockets.connect(url, max_queue=None)
+        self.task = asyncio.create_task(self.read())
+
+    async def read(self):
+        try:
+            async for raw in self.ws:
+                received = time.perf_counter()
+                self.messages += 1
+                try:
+                    message = json.loads(raw)
+                except ValueError:
+                    continue
+                if message.get("type") == "ping":
+                    await self.ws.send('{"type": "pong"}')
+                else:
+                    self.test.observe(self, message, received)
+        except websockets.ConnectionClosed as e:
+            self.close_code = e.code
+        finally:
+            if self.close_code is None and self.ws is not None:
+                self.close_code = self.ws.close_code
+
+    async def close(self):
+        if self.ws is not None:
+            await self.ws.close()
+        if self.task is not None:
+            await asyncio.gather(self.task, return_exceptions=True)
+
+
+class WebSocketLoadTest:
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.base_url = args.base_url.rstrip("/")
+        self.ws_url = self.base_url.replace("http", "ws", 1)
+        self.run_id = uuid.uuid4().hex[:6]
+        self.sampler = ProcessSampler(args.server_pid)
+        self.clients: List[LoadClient] = []
+        self.patients: List[LoadClient] = []
+        self.connect_errors: Dict[str, int] = {}
+        # Send time per change, and the sockets each change has reached
+        self.created_at: Dict[str, float] = {}
+        self.completed_at: Dict[str, float] = {}
+        self.token_patient: Dict[str, str] = {}
+        self.delivered: Dict[tuple, float] = {}
+        self.latencies: Dict[str, List[float]] = {"create": [], "complete_staff": [], "complete_patient": []}
+        self.rest_latencies: Dict[str, List[float]] = {"create": [], "complete": []}
+        self.rest_errors: Dict[str, int] = {}
+
+    def observe(self, client: LoadClient, message: Dict[str, Any], received: float):
+        message_type = message.get("type")
+        if message_type == "queue_delta":
+            for row in message.get("inserted", ()):
+                self._record("create", client, row.get("patient_name"), self.created_at, received)
+            for token_id in message.get("removed", ()):
+                self._record("complete_staff", client, token_id, self.completed_at, received)
+        elif message_type == "token_update" and client.role == "patient":
+            data = message.get("data") or {}
+            if data.get("status") == "completed":
+                self._record("complete_patient", client, data.get("id"), self.completed_at, received)
+
+    def _record(self, kind: str, client: LoadClient, key: Optional[str], sent: Dict[str, float], received: float):
+        if key not in sent or (kind, key, client) in self.delivered:
+            return
+        self.delivered[(kind, key, client)] = received
+        self.latencies[kind].append((received - sent[key]) * 1000)
+
+    def access_token(self, client: LoadClient) -> str:
+        """A fresh token with full claims, so the handshake needs no account for the simulated user"""
+        now = int(time.time())
+        claims = {
+            "sub": client.user_id,
+            "iat": now,
+            "exp": now + 3600,
+            "role": client.role,
+            "name": client.user_id,
+            "email": f"{client.user_id}@load.test",
+        }
+        return jwt.encode(claims, self.args.jwt_secret, algorithm="HS256")
+
+    async def login(self, http: httpx.AsyncClient) -> Dict[str, str]:
+        response = await http.post("/api/v1/auth/login", json={"email": self.args.email, "password": self.args.password})
+        response.raise_for_status()
+        return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+    async def open_sockets(self):
+        plan = ([("patient", f"load-{self.run_id}-p{i}") for i in range(self.args.patients)]
+                + [("staff", f"load-{self.run_id}-s{i}") for i in range(self.args.staff)]
+                + [("admin", f"load-{self.run_id}-a{i}") for i in range(self.args.admins)])
+        gate = asyncio.Semaphore(self.args.connect_concurrency)
+
+        async def open_one(role: str, user_id: str):
+            client = LoadClient(self, user_id, role)
+            async with gate:
+                try:
+                    await client.connect()
+                except Exception as e:
+                    name = type(e).__name__
+                    self.connect_errors[name] = self.connect_errors.get(name, 0) + 1
+                    return
+            self.clients.append(client)
+            if role == "patient":
+                self.patients.append(client)
+
+        await asyncio.gather(*(open_one(role, user_id) for role, user_id in plan))
+
+    async def paced(self, operations):
+        """Run coroutine factories at --rate per second, without waiting for each to finish"""
+        interval = 1 / self.args.rate
+        started = time.perf_counter()
+        pending = []
+        for index, operation in enumerate(operations):
+            delay = started + index * interval - time.perf_counter()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            pending.append(asyncio.create_task(operation()))
+        await asyncio.gather(*pending)
+
+    def _rest_error(self, name: str):
+        self.rest_errors[name] = self.rest_errors.get(name, 0) + 1
+
+    async def create_token(self, http: httpx.AsyncClient, headers: Dict[str, str], index: int):
+        # One active token per patient: tokens beyond the patient sockets go to socketless patients
+        patient = self.patients[index] if index < len(self.patients) else None
+        patient_id = patient.user_id if patient else f"load-{self.run_id}-x{index}"
+        marker = f"load-{self.run_id}-{index}"
+        payload = {
+            "category": CATEGORIES[index % len(CATEGORIES)] if self.args.mixed_priorities else "regular_consultation",
+            "patient_id": patient_id,
+            "patient_name": marker,
+            "patient_phone": "0000000000",
+        }
+        self.created_at[marker] = time.perf_counter()
+        try:
+            response = await http.post("/api/v1/tokens", json=payload, headers=headers)
+        except httpx.HTTPError as e:
+            self.created_at.pop(marker)
+            return self._rest_error(f"create:{type(e).__name__}")
+        self.rest_latencies["create"].append((time.perf_counter() - self.created_at[marker]) * 1000)
+        if response.status_code != 200:
+            self.created_at.pop(marker)
+            return self._rest_error(f"create:{response.status_code}")
+        token_id = response.json()["id"]
+        self.token_patient[token_id] = patient_id
+        if patient:
+            await patient.ws.send(json.dumps({"type": "subscribe_position", "token_id": token_id}))
+
+    async def complete_token(self, http: httpx.AsyncClient, headers: Dict[str, str], token_id: str):
+        self.completed_at[token_id] = time.perf_counter()
+        try:
+            response = await http.put(f"/api/v1/tokens/{token_id}/complete", headers=headers)
+        except httpx.HTTPError as e:
+            self.completed_at.pop(token_id)
+            return self._rest_error(f"complete:{type(e).__name__}")
+        self.rest_latencies["complete"].append((time.perf_counter() - self.completed_at[token_id]) * 1000)
+        if response.status_code != 200:
+            self.completed_at.pop(token_id)
+            self._rest_error(f"complete:{response.status_code}")
+
+    def drops(self) -> Dict[str, Any]:
+        connected = [client for client in self.clients if client.close_code is None]
+        watchers = [client for client in connected if client.role in ("staff", "admin")]
+        by_patient = {client.user_id: client for client in connected if client.role == "patient"}
+        expected = {
+            "create": len(self.created_at) * len(watchers),
+            "complete_staff": len(self.completed_at) * len(watchers),
+            "complete_patient": sum(1 for token_id in self.completed_at if self.token_patient.get(token_id) in by_patient),
+        }
+        result = {}
+        for kind, count in expected.items():
+            received = len(self.latencies[kind])
+            result[kind] = {"expected": count, "received": received, "dropped": max(0, count - received)}
+        return result
+
+    async def run(self) -> Dict[str, Any]:
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.args.http_timeout) as http:
+            headers = await self.login(http)
+            rss_before = self.sampler.rss_bytes()
+
+            started = time.perf_counter()
+            await self.open_sockets()
+            connect_seconds = time.perf_counter() - started
+            # Let snapshots and connect bookkeeping settle before measuring memory
+            await asyncio.sleep(self.args.settle)
+            rss_connected = self.sampler.rss_bytes()
+            print(f"🔌 {len(self.clients)} sockets open in {connect_seconds:.1f}s "
+                  f"({sum(self.connect_errors.values())} failed)")
+
+            cpu_before, wall_before = self.sampler.cpu_seconds(), time.perf_counter()
+            await self.paced([
+                (lambda index=index: self.create_token(http, headers, index)) for index in range(self.args.tokens)
+            ])
+            print(f"📝 created {len(self.created_at)} tokens")
+            await asyncio.sleep(self.args.settle)
+            await self.paced([
+                (lambda token_id=token_id: self.complete_token(http, headers, token_id))
+                for token_id in list(self.token_patient)
+            ])
+            print(f"✅ completed {len(self.completed_at)} tokens")
+            await asyncio.sleep(self.args.drain)
+            cpu_after, wall_after = self.sampler.cpu_seconds(), time.perf_counter()
+            rss_after = self.sampler.rss_bytes()
+
+            try:
+                server_counts = (await http.get("/api/v1/analytics/websockets/counts", headers=headers)).json()
+            except Exception as e:
+                server_counts = {"error": str(e)}
+
+        drops = self.drops()
+        closed_by_server = {}
+        for client in self.clients:
+            if client.close_code is not None:
+                closed_by_server[str(client.close_code)] = closed_by_server.get(str(client.close_code), 0) + 1
+        await asyncio.gather(*(client.close() for client in self.clients))
+
+        per_connection = None
+        if rss_before is not None and rss_connected is not None and self.clients:
+            per_connection = round((rss_connected - rss_before) / len(self.clients))
+        cpu = None
+        if cpu_before is not None and cpu_after is not None:
+            cpu = {
+                "seconds": round(cpu_after - cpu_before, 3),
+                "percent": round(100 * (cpu_after - cpu_before) / (wall_after - wall_before), 1),
+            }
+        return {
+            "run_id": self.run_id,
+            "timestamp": datetime.now().isoformat(),
+            "config": {key: value for key, value in vars(self.args).items() if key != "password"},
+            "connections": {
+                "requested": self.args.patients + self.args.staff + self.args.admins,
+                "opened": len(self.clients),
+                "connect_seconds": round(connect_seconds, 3),
+                "connect_errors": self.connect_errors,
+                "closed_by_server": closed_by_server,
+            },
+            "delivery_latency": {kind: latency_summary(values) for kind, values in self.latencies.items()},
+            "rest_latency": {kind: latency_summary(values) for kind, values in self.rest_latencies.items()},
+            "rest_errors": self.rest_errors,
+            "drops": drops,
+            "server": {
+                "pid": self.args.server_pid,
+                "rss_bytes": {"before": rss_before, "connected": rss_connected, "after": rss_after},
+                "rss_bytes_per_connection": per_connection,
+                "cpu_during_traffic": cpu,
+                "websocket_counts": server_counts,
+            },
+        }
+
+
+def start_server(port: int) -> subprocess.Popen:
+    """Run uvicorn from backend/ with connection limits lifted for a single-IP load generator"""
+    env = {
+        **os.environ,
+        "WS_MAX_CONNECTIONS": "0",
+        "WS_MAX_CONNECTIONS_PER_USER": "0",
+        "WS_MAX_CONNECTIONS_PER_IP": "0",
+    }
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--port", str(port), "--log-level", "warning"],
+        cwd=Path(__file__).resolve().parent / "backend",
+        env=env,
+    )
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            httpx.get(f"http://127.0.0.1:{port}/api/v1/queue", timeout=1)
+            return process
+        except httpx.HTTPError:
+            if process.poll() is not None:
+                raise RuntimeError("uvicorn exited during startup")
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError("uvicorn did not start within 30s")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--email", default="admin@demo.com", help="admin account that drives REST traffic")
+    parser.add_argument("--password", default="demo123")
+    parser.add_argument("--jwt-secret", default=os.environ.get("JWT_SECRET_KEY", "hospital-token-management-secret-key-2025"),
+                        help="the server's JWT_SECRET_KEY, to sign socket tokens for simulated users")
+    parser.add_argument("--patients", type=int, default=500)
+    parser.add_argument("--staff", type=int, default=10)
+    parser.add_argument("--admins", type=int, default=2)
+    parser.add_argument("--tokens", type=int, default=100, help="tokens created, then completed")
+    parser.add_argument("--rate", type=float, default=20, help="REST operations per second")
+    parser.add_argument("--mixed-priorities", action="store_true", help="cycle categories instead of regular only")
+    parser.add_argument("--connect-concurrency", type=int, default=200)
+    parser.add_argument("--settle", type=float, default=2.0, help="seconds to wait after connecting and creating")
+    parser.add_argument("--drain", type=float, default=5.0, help="seconds to wait for late deliveries")
+    parser.add_argument("--http-timeout", type=float, default=30.0)
+    parser.add_argument("--server-pid", type=int, help="server process for memory/CPU sampling")
+    parser.add_argument("--start-server", action="store_true", help="launch uvicorn from backend/ for the run")
+    parser.add_argument("--output", help="defaults to test_reports/ws_load_<timestamp>.json")
+    return parser.parse_args(argv)
+
+
+def main() -> int:
+    args = parse_args()
+    server = None
+    if args.start_server:
+        port = httpx.URL(args.base_url).port or 8000
+        server = start_server(port)
+        args.server_pid = server.pid
+    try:
+        results = asyncio.run(WebSocketLoadTest(args).run())
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait(timeout=10)
+
+    output = Path(args.output or Path(__file__).resolve().parent / "test_reports"
+                  / f"ws_load_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(results, indent=2))
+    print(f"\n📊 Delivery latency (ms)")
+    for kind, summary in results["delivery_latency"].items():
+        print(f"   {kind}: p50={summary['p50_ms']} p95={summary['p95_ms']} p99={summary['p99_ms']} (n={summary['count']})")
+    dropped = sum(entry["dropped"] for entry in results["drops"].values())
+    print(f"   dropped: {dropped}")
+    print(f"\n💾 Results written to {output}")
+    return 0 if dropped == 0 and not results["rest_errors"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())